@@ -15,8 +15,12 @@ setup(
     name='zephrcli',
     version=version,
     package_dir={'': 'src'},
-    packages=['zephrcli'],
+    packages=['zephrcli', 'zephrcli.commands'],
     package_data={'zephrcli': ['VERSION']},
+    extras_require={
+        'encrypted': ['cryptography'],
+        'fast': ['orjson']
+    },
     install_requires=[
         'click',
         'requests',
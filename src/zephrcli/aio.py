@@ -0,0 +1,275 @@
+import asyncio
+import queue
+import threading
+import time
+from urllib.parse import urlsplit
+
+from . import cassette, client, hedge, output, response_cache, throttle, trace
+from .client import Response, admin_base_url, admin_headers, console_base_url, encode_body, public_base_url
+
+# Asyncio counterpart of the requests transport in client.py, used by fan-out commands when the global --concurrency
+# option is set: requests are signed the same way but run as coroutines on one event loop, so hundreds can be in
+# flight without a thread each. Timeouts and retries follow the same global options.
+_IDEMPOTENT = {'GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'}
+_RETRY_STATUSES = {502, 504}
+
+
+class ConnectionPool:
+    # Keep-alive HTTP/1.1 connections per host for one event loop. Connections are only opened when no idle one
+    # is available, so the number open never exceeds the number of requests in flight.
+
+    def __init__(self):
+        self._idle = {}
+
+    async def request(self, method, url, headers, body=b''):
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80))
+        target = f'{parts.path or "/"}?{parts.query}' if parts.query else parts.path or '/'
+        head = [f'{method} {target} HTTP/1.1', f'Host: {parts.netloc}', 'Accept-Encoding: identity',
+                f'Content-Length: {len(body)}']
+        head += [f'{name}: {value}' for name, value in headers.items()]
+        data = ('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body
+
+        # Same policy as the threaded transport: connection errors are always retried, read errors and
+        # 502/504 only for idempotent methods. 429 and 503 are left to the throttle scheduler.
+        attempt = 0
+        while True:
+            connection, reused, sent = None, False, False
+            try:
+                connection, reused = await self._acquire(key)
+                started = time.perf_counter()
+                connection[1].write(data)
+                await connection[1].drain()
+                sent = True
+                response, keep_alive = await asyncio.wait_for(_read_response(connection[0], method, started),
+                                                              client.setting('read_timeout'))
+            except asyncio.CancelledError:
+                # A hedged request whose hedge answered first: the connection is mid-exchange and cannot be reused
+                if connection is not None:
+                    connection[1].close()
+                raise
+            except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError) as e:
+                if connection is not None:
+                    connection[1].close()
+                # A pooled connection the server closed while idle fails before any response; that is not an attempt
+                if reused and (not sent or isinstance(e, asyncio.IncompleteReadError) and not e.partial):
+                    continue
+                if attempt >= client.setting('retries') or (sent and method not in _IDEMPOTENT):
+                    raise
+            else:
+                if keep_alive:
+                    self._idle.setdefault(key, []).append(connection)
+                else:
+                    connection[1].close()
+                if (response.status_code not in _RETRY_STATUSES or method not in _IDEMPOTENT
+                        or attempt >= client.setting('retries')):
+                    return response
+            await asyncio.sleep(0.3 * 2 ** attempt)
+            trace.add('retries', 1)
+            attempt += 1
+
+    async def _acquire(self, key):
+        idle = self._idle.get(key)
+        while idle:
+            connection = idle.pop()
+            if not connection[0].at_eof():
+                return connection, True
+            connection[1].close()
+        scheme, host, port = key
+        connection = await asyncio.wait_for(trace.open_connection(host, port, scheme == 'https'),
+                                            client.setting('connect_timeout'))
+        return connection, False
+
+    def close(self):
+        for connections in self._idle.values():
+            for reader, writer in connections:
+                writer.close()
+        self._idle.clear()
+
+
+async def _read_response(reader, method, started):
+    # started is when the request began to be written, for the server and download times of --trace
+    status_line = (await reader.readuntil(b'\r\n')).decode('latin-1')
+    version, status, reason = (status_line.rstrip('\r\n').split(' ', 2) + [''])[:3]
+    headers = {}
+    while True:
+        line = await reader.readuntil(b'\r\n')
+        if line == b'\r\n':
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    headers_read = time.perf_counter()
+    trace.add('server', headers_read - started)
+    status_code = int(status)
+    keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+    if method == 'HEAD' or status_code in (204, 304) or 100 <= status_code < 200:
+        content = b''
+    elif headers.get('transfer-encoding', '').lower() == 'chunked':
+        chunks = []
+        while True:
+            size = int((await reader.readuntil(b'\r\n')).split(b';')[0], 16)
+            if size == 0:
+                while await reader.readuntil(b'\r\n') != b'\r\n':
+                    pass
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+        content = b''.join(chunks)
+    elif 'content-length' in headers:
+        content = await reader.readexactly(int(headers['content-length']))
+    else:
+        content = await reader.read()
+        keep_alive = False
+    trace.add('download', time.perf_counter() - headers_read)
+    return Response(status_code, reason, headers, content), keep_alive
+
+
+# The pool of the running event loop, so every coroutine on the loop shares connections
+_pools = {}
+
+
+def _pool():
+    loop = asyncio.get_running_loop()
+    pool = _pools.get(loop)
+    if pool is None:
+        pool = _pools[loop] = ConnectionPool()
+    return pool
+
+
+def _cookie_headers(headers, cookies):
+    if cookies:
+        headers['Cookie'] = '; '.join(f'{name}={value}' for name, value in cookies.items())
+    return headers
+
+
+async def admin_request(method, tenant_id, client_id, client_secret, path, query="", body=None, cookies=None,
+                        extra_headers=None):
+    data = encode_body(body)
+    base_url = admin_base_url(tenant_id)
+    url = f'{base_url}{path}?{query}' if query else f'{base_url}{path}'
+
+    def send_once():
+        # Signed again for each attempt, so a retry after Retry-After carries a fresh timestamp and nonce
+        headers = admin_headers(client_id, client_secret, data, method, path, query, extra_headers)
+        return cassette.send_async(method, url, data,
+                                   lambda: _pool().request(method, url, _cookie_headers(headers, cookies), data))
+
+    r = await trace.call_async(method, url, lambda: throttle.call_async(base_url, method, send_once))
+    if method != "GET":
+        response_cache.invalidate(tenant_id, path)
+    return r
+
+
+async def admin_graphql_request(body, cookies, client_id, client_secret):
+    path = '/v4/admin/graphql/'
+    base_url = console_base_url()
+    data = encode_body(body)
+    url = f'{base_url}{path}'
+
+    def send_once():
+        headers = admin_headers(client_id, client_secret, data, "POST", path, "")
+        return cassette.send_async("POST", url, data,
+                                   lambda: _pool().request("POST", url, _cookie_headers(headers, cookies), data))
+
+    return await trace.call_async("POST", url, lambda: throttle.call_async(base_url, "POST", send_once))
+
+
+async def public_request(method, path, tenant_id, site_name, query="", body=None, cookies=None, extra_headers=None):
+    headers = {'Content-Type': 'application/json', 'Accept': 'application/json'}
+    if extra_headers is not None:
+        headers.update(extra_headers)
+    base_url = public_base_url(tenant_id, site_name)
+    url = f'{base_url}{path}?{query}' if query else f'{base_url}{path}'
+    data = encode_body(body)
+    headers = _cookie_headers(headers, cookies)
+
+    def send():
+        return trace.call_async(method, url, lambda: throttle.call_async(base_url, method, lambda: cassette.send_async(
+            method, url, data, lambda: _pool().request(method, url, headers, data))))
+
+    if hedge.applies(method, path):
+        return await hedge.call_async(base_url, send)
+    return await send()
+
+
+async def do_get_admin(tenant_id, client_id, client_secret, path, query=""):
+    output.write_response(await admin_request("GET", tenant_id, client_id, client_secret, path, query=query))
+
+
+async def do_get_public(path, tenant_id, site_name, query="", cookies=None):
+    output.write_response(await public_request("GET", path, tenant_id, site_name, query=query, cookies=cookies))
+
+
+async def do_post_admin(path, body, cookies, tenant_id, client_id, client_secret):
+    output.write_response(await admin_request("POST", tenant_id, client_id, client_secret, path, body=body,
+                                              cookies=cookies))
+
+
+async def do_post_public(path, body, cookies, tenant_id, site_name, extra_headers=None):
+    output.write_response(await public_request("POST", path, tenant_id, site_name, body=body, cookies=cookies,
+                                               extra_headers=extra_headers))
+
+
+async def do_put(tenant_id, client_id, client_secret, path, body=None, extra_headers=None):
+    output.write_response(await admin_request("PUT", tenant_id, client_id, client_secret, path,
+                                              body={} if body is None else body, extra_headers=extra_headers))
+
+
+async def do_delete_admin(tenant_id, client_id, client_secret, path, query=""):
+    output.write_response(await admin_request("DELETE", tenant_id, client_id, client_secret, path, query=query))
+
+
+async def do_delete_public(path, tenant_id, site_name, cookies=None):
+    output.write_response(await public_request("DELETE", path, tenant_id, site_name, cookies=cookies))
+
+
+def run_bounded(fn, items, concurrency):
+    # Async counterpart of bulk.run_bounded: awaits fn(item) for each item with at most `concurrency` in flight on
+    # one event loop in a background thread, and yields (item, result, error) to the caller in completion order
+    results = queue.Queue()
+    done = object()
+
+    def run_loop():
+        try:
+            asyncio.run(_run_bounded(fn, items, concurrency, results))
+        except BaseException as e:
+            results.put((done, e))
+        else:
+            results.put((done, None))
+
+    thread = threading.Thread(target=run_loop, daemon=True)
+    thread.start()
+    while True:
+        entry = results.get()
+        if entry[0] is done:
+            thread.join()
+            if entry[1] is not None:
+                raise entry[1]
+            return
+        yield entry
+
+
+async def _run_bounded(fn, items, concurrency, results):
+    items = iter(items)
+    in_flight = {}
+    exhausted = False
+    try:
+        while in_flight or not exhausted:
+            while not exhausted and len(in_flight) < max(1, concurrency):
+                try:
+                    item = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                in_flight[asyncio.ensure_future(fn(item))] = item
+            if not in_flight:
+                break
+            finished, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            for task in finished:
+                item = in_flight.pop(task)
+                error = task.exception()
+                results.put((item, None if error else task.result(), error))
+    finally:
+        pool = _pools.pop(asyncio.get_running_loop(), None)
+        if pool is not None:
+            pool.close()
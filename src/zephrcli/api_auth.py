@@ -1,11 +1,7 @@
-import keyring
 import click
 import json
-import pwinput
-from click import BadParameter
-from keyring.backends.macOS import Keyring
-from keyring.errors import PasswordDeleteError
-from .config import app_name
+from click import BadParameter, UsageError
+from .credentials import get_creds_string, set_creds_string, delete_creds, new_cache_key
 
 # Options to decorate all commands using keychain credentials
 _admin_api_options = [
@@ -23,11 +19,14 @@ _public_api_options = [
 ]
 
 
+def prompt_secret(prompt):
+    # pwinput is imported on first use rather than at startup
+    import pwinput
+    return pwinput.pwinput(prompt)
+
+
 # Decorator used to add auth_options to any admin API command
 def admin_api_command(func):
-    # Hardcode backend to macOS for the moment; otherwise keyring warns of missing config file
-    keyring.set_keyring(Keyring())
-
     for option in reversed(_admin_api_options):
         func = option(func)
     return func
@@ -41,7 +40,7 @@ def public_api_command(func):
 
 
 def get_creds(profile):
-    creds_string = keyring.get_password(app_name, profile)
+    creds_string = get_creds_string(profile)
     if creds_string is None:
         raise BadParameter(message=f'"{profile}" not found', param_hint='--profile')
     return json.loads(creds_string)
@@ -55,7 +54,49 @@ def get_cred(param_name, profile):
         return None
 
 
-@click.command(help="Authorise and save credentials to key ring")
+def parse_credential_options(profile, tenant_id, client_id, client_secret):
+    # Prefer to use the profile option if specified
+    if profile is not None:
+        # If any credential options also specified - incorrect usage and exit
+        if tenant_id is not None or client_id is not None or client_secret is not None:
+            raise UsageError(
+                'Please use either --profile, or [--tenant-id, --client-id, --client-secret], but not both')
+        # Get credential from profile
+        creds = get_creds(profile)
+        return creds['tenant_id'], creds['client_id'], creds['client_secret']
+    else:
+        if tenant_id is None:
+            tenant_id = click.prompt('Tenant ID')
+        if client_id is None:
+            client_id = click.prompt('Client ID')
+        if client_secret is None:
+            client_secret = prompt_secret('Client secret: ')
+
+    click.echo(click.style(f'Using Zephr tenant: {tenant_id}', fg='green'), err=True)
+    return tenant_id, client_id, client_secret
+
+
+def parse_single_credential_option(profile=None, tenant_id=None):
+    # Prefer to use the profile option if specified
+    if profile is not None:
+        # If tenant_id also specified - incorrect usage and exit
+        if tenant_id is not None:
+            raise UsageError('Please use either --profile, or --tenant-id, but not both')
+        # Get credential from profile
+        tenant_id = get_cred('tenant_id', profile)
+    else:
+        if tenant_id is None:
+            # Prompt for tenant_id
+            tenant_id = click.prompt('Tenant ID')
+    click.echo(click.style(f'Using Zephr tenant: {tenant_id}', fg='green'), err=True)
+    return tenant_id
+
+
+def debug(profile):
+    click.echo(click.style(f'Using profile: {profile}', fg='green'), err=True)
+
+
+@click.command(help="Authorise and save credentials to the credentials backend")
 @click.option('--profile', required=True, prompt=True, help="Profile name used for persistent credentials")
 @click.option('--tenant-id', envvar='TENANT_ID', required=True, prompt=True, help="Zephr tenant ID")
 @click.option('--client-id', envvar='CLIENT_ID', required=True, prompt=True, help="Zephr API client key ID")
@@ -63,19 +104,23 @@ def get_cred(param_name, profile):
 def login(profile, tenant_id, client_id, client_secret):
     # Custom prompt using pwinput for secret to mask with *
     if client_secret is None:
-        client_secret = pwinput.pwinput(f'Client secret: ')
+        client_secret = prompt_secret(f'Client secret: ')
 
     # Save to keyring
     creds = {'tenant_id': tenant_id, 'client_id': client_id, 'client_secret': client_secret}
     print(f'saving credentials for profile: {profile}')
-    keyring.set_password(app_name, profile, json.dumps(creds))
+    set_creds_string(profile, json.dumps(creds))
 
 
-@click.command(help="Remove credentials from key ring")
+@click.command(help="Remove credentials from the credentials backend")
 @click.option('--profile', required=True, prompt=True, help="Profile name used for persistent credentials")
 def logout(profile):
-    try:
-        keyring.delete_password(app_name, profile)
+    if delete_creds(profile):
         print(f'logged out profile: {profile}')
-    except PasswordDeleteError:
+    else:
         print(f'profile: {profile} already logged out')
+
+
+@click.command(help="Print a new key for the encrypted credential cache")
+def credentials_cache_key():
+    print(new_cache_key())
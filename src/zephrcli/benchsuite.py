@@ -0,0 +1,172 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+from click.testing import CliRunner
+
+from .client import encode_body, sign_zephr_request
+from .mock_server import MockZephrServer, MOCK_TENANT_ID, MOCK_CLIENT_ID, MOCK_CLIENT_SECRET
+from .signing import ZephrSigner
+
+SUITES = ['cold-start', 'commands', 'signing', 'bulk']
+
+# Modules that should only be imported once a command needs them
+HEAVY_MODULES = ['requests', 'keyring', 'pwinput', 'http.server', 'sqlite3']
+
+_ADMIN_CREDENTIALS = ['--tenant-id', MOCK_TENANT_ID, '--client-id', MOCK_CLIENT_ID,
+                      '--client-secret', MOCK_CLIENT_SECRET]
+
+# Representative commands timed against the mock server
+_COMMANDS = [
+    ['admin', 'list-users'] + _ADMIN_CREDENTIALS,
+    ['admin', 'create-user', '-e', 'bench@example.com'] + _ADMIN_CREDENTIALS,
+    ['admin', 'list-products'] + _ADMIN_CREDENTIALS,
+    ['admin', 'get-configuration'] + _ADMIN_CREDENTIALS,
+    ['admin', 'list-bundles'] + _ADMIN_CREDENTIALS,
+    ['public', 'list-rules', '-s', 'site', '-r', 'sdk', '--tenant-id', MOCK_TENANT_ID],
+    ['public', 'decide', '-s', 'site', '--tenant-id', MOCK_TENANT_ID, 'mock-feature'],
+]
+
+
+def _summary(samples):
+    samples = sorted(samples)
+    return {'runs': len(samples), 'min_ms': round(samples[0] * 1000, 3),
+            'median_ms': round(statistics.median(samples) * 1000, 3), 'max_ms': round(samples[-1] * 1000, 3)}
+
+
+def bench_cold_start(runs):
+    # Each run is a fresh interpreter, so this includes Python startup and all module imports
+    results = {}
+    env = _subprocess_env()
+    for args in (['--version'], ['admin', '--help']):
+        samples = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            subprocess.run([sys.executable, '-m', 'zephrcli.zephr'] + args, env=env, check=True,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            samples.append(time.perf_counter() - started)
+        results[' '.join(args)] = _summary(samples)
+    return results
+
+
+def startup_heavy_imports():
+    # Heavy modules imported just by loading the CLI entry point
+    script = ('import sys, zephrcli.zephr; '
+              f'print(",".join(m for m in {HEAVY_MODULES!r} if m in sys.modules))')
+    output = subprocess.run([sys.executable, '-c', script], env=_subprocess_env(), check=True,
+                            capture_output=True, text=True).stdout.strip()
+    return output.split(',') if output else []
+
+
+def bench_commands(cli, server, runs):
+    runner = CliRunner()
+    env = _mock_env(server)
+    results = {}
+    for args in _COMMANDS:
+        samples = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            result = runner.invoke(cli, args, env=env)
+            samples.append(time.perf_counter() - started)
+            if result.exception is not None:
+                raise result.exception
+        results[' '.join(args[:2])] = _summary(samples)
+    return results
+
+
+def bench_signing(count):
+    # Per-request cost of the original signing path (one message string, uuid1 nonce) against the signer object
+    body = {'identifiers': {'email_address': 'bench@example.com'}, 'attributes': {}}
+    signer = ZephrSigner(MOCK_CLIENT_ID, MOCK_CLIENT_SECRET)
+
+    def string_signing():
+        for _ in range(count):
+            body_string = json.dumps(body)
+            timestamp, nonce = str(int(time.time() * 1000)), str(uuid.uuid1())
+            digest = sign_zephr_request(MOCK_CLIENT_SECRET, body_string, '/v3/users', '', 'POST', timestamp, nonce)
+            f'ZEPHR-HMAC-SHA256 {MOCK_CLIENT_ID}:{timestamp}:{nonce}:{digest}'
+
+    def signer_signing():
+        for _ in range(count):
+            signer.authorization(encode_body(body), 'POST', '/v3/users')
+
+    def batch_signing():
+        data = encode_body(body)
+        signer.sign_batch([(data, 'POST', '/v3/users', '')] * count)
+
+    results = {}
+    for name, run in [('string', string_signing), ('signer', signer_signing), ('signer-batch', batch_signing)]:
+        started = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - started
+        results[name] = {'signatures': count, 'per_second': round(count / elapsed),
+                         'per_request_us': round(elapsed / count * 1e6, 2)}
+    return results
+
+
+def bench_bulk(cli, server, rows, workers):
+    runner = CliRunner()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'users.csv')
+        with open(path, 'w') as f:
+            f.write('email,first_name,last_name\n')
+            for i in range(rows):
+                f.write(f'bulk{i}@example.com,First{i},Last{i}\n')
+        started = time.perf_counter()
+        result = runner.invoke(cli, ['admin', 'import-users', '--workers', str(workers)] + _ADMIN_CREDENTIALS
+                               + [path], env=_mock_env(server))
+        elapsed = time.perf_counter() - started
+        if result.exception is not None:
+            raise result.exception
+    return {'rows': rows, 'workers': workers, 'seconds': round(elapsed, 3),
+            'rows_per_second': round(rows / elapsed)}
+
+
+def run_suite(cli, suites, runs=5, signing_count=100_000, bulk_rows=2000, bulk_workers=16):
+    results = {}
+    if 'cold-start' in suites:
+        results['cold-start'] = bench_cold_start(runs)
+    if 'signing' in suites:
+        results['signing'] = bench_signing(signing_count)
+    if 'commands' in suites or 'bulk' in suites:
+        server = MockZephrServer().start()
+        try:
+            if 'commands' in suites:
+                results['commands'] = bench_commands(cli, server, runs)
+            if 'bulk' in suites:
+                results['bulk'] = bench_bulk(cli, server, bulk_rows, bulk_workers)
+        finally:
+            server.stop()
+    return results
+
+
+def _mock_env(server):
+    # Catalog responses are not cached, so every run measures the request path
+    return {'ZEPHR_ADMIN_URL': server.url, 'ZEPHR_PUBLIC_URL': server.url, 'ZEPHR_CONSOLE_URL': server.url,
+            'ZEPHR_NO_CACHE': '1'}
+
+
+def _subprocess_env():
+    return dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [_src_dir(), os.environ.get('PYTHONPATH')])))
+
+
+def _src_dir():
+    # Directory containing the zephrcli package, so the subprocess imports this same code
+    return os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def format_suite(results):
+    lines = []
+    for suite, result in results.items():
+        lines.append(f'{suite}:')
+        for name, value in result.items():
+            if isinstance(value, dict):
+                lines.append(f'  {name:<24} ' + '  '.join(f'{k}={v}' for k, v in value.items()))
+            else:
+                lines.append(f'  {name:<24} {value}')
+    return '\n'.join(lines)
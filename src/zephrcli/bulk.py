@@ -0,0 +1,205 @@
+import csv
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import click
+
+from . import throttle
+from .client import admin_graphql_request, admin_request, ensure_pool_size, public_request, setting
+
+
+def detect_format(path, file_format=None):
+    if file_format is not None:
+        return file_format.lower()
+    if path.lower().endswith('.csv'):
+        return 'csv'
+    return 'ndjson'
+
+
+def read_rows(path, file_format=None, skip_through=0):
+    # Stream (row_number, record) pairs; row numbers start at 1 and count data rows only
+    file_format = detect_format(path, file_format)
+    with open(path, newline='') as f:
+        if file_format == 'csv':
+            records = csv.DictReader(f)
+        else:
+            records = (json.loads(line) for line in f if line.strip())
+        for row_number, record in enumerate(records, start=1):
+            if row_number > skip_through:
+                yield row_number, record
+
+
+def run_bounded(fn, items, workers):
+    # Apply fn to each item on a pool of workers, yielding (item, result, error) in completion order.
+    # At most 2 x workers items are pulled from the iterator at once, so large inputs stream in flat memory.
+    items = iter(items)
+    max_in_flight = max(1, workers) * 2
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        in_flight = {}
+        exhausted = False
+        while in_flight or not exhausted:
+            while not exhausted and len(in_flight) < max_in_flight:
+                try:
+                    item = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                in_flight[pool.submit(fn, item)] = item
+            if not in_flight:
+                break
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = in_flight.pop(future)
+                error = future.exception()
+                yield item, None if error else future.result(), error
+
+
+def batched(items, size):
+    # Groups items into lists of up to size, pulling from the iterator one group at a time
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def run_keyed(fn, items, key, workers, lookahead=1000, window=None):
+    # As run_bounded, but items with the same key(item) run one at a time in the order given, while items with
+    # different keys, or a key of None, run concurrently. Up to `lookahead` items are pulled from the iterator
+    # ahead of completion, so a long run of items for one key does not hold up the items after it. With a window,
+    # no item is pulled `window` or more places after the oldest unfinished one, so a consumer putting the results
+    # back in input order holds fewer than `window` of them however slow one item is.
+    import heapq
+    from collections import deque
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        in_flight = {}
+        # Items waiting for the item ahead of them with the same key; a key is present while one is running
+        queued = {}
+        # Positions of the unfinished items, oldest first
+        unfinished = []
+        finished = set()
+        pulled = 0
+        exhausted = False
+        while in_flight or not exhausted:
+            while not exhausted and len(unfinished) < max(lookahead, workers * 2) and \
+                    (window is None or not unfinished or pulled - unfinished[0] < window):
+                try:
+                    item = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                position = pulled
+                pulled += 1
+                heapq.heappush(unfinished, position)
+                item_key = key(item)
+                if item_key is not None and item_key in queued:
+                    queued[item_key].append((item, position))
+                    continue
+                if item_key is not None:
+                    queued[item_key] = deque()
+                in_flight[pool.submit(fn, item)] = item, position
+            if not in_flight:
+                break
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                item, position = in_flight.pop(future)
+                finished.add(position)
+                while unfinished and unfinished[0] in finished:
+                    finished.discard(heapq.heappop(unfinished))
+                item_key = key(item)
+                if item_key is not None:
+                    if queued[item_key]:
+                        following = queued[item_key].popleft()
+                        in_flight[pool.submit(fn, following[0])] = following
+                    else:
+                        del queued[item_key]
+                error = future.exception()
+                yield item, None if error else future.result(), error
+
+
+def run_requests(request_args, items, workers, public=False, graphql=False, limiter=None):
+    # Send one admin (public, or admin console graphql) request per item, where request_args(item) gives the
+    # (args, kwargs) of admin_request, public_request or admin_graphql_request, yielding (item, response, error) in
+    # completion order. A throttle.RateLimiter limiter paces when the requests start.
+    # With the global --concurrency option the requests run on the asyncio engine, otherwise on `workers` threads.
+    concurrency = setting('concurrency')
+    if concurrency:
+        import asyncio
+        from . import aio
+        send_async = aio.admin_graphql_request if graphql else aio.public_request if public else aio.admin_request
+
+        async def request_async(item):
+            delay = limiter.reserve() if limiter is not None else 0
+            if delay:
+                await asyncio.sleep(delay)
+            args, kwargs = request_args(item)
+            return await send_async(*args, **kwargs)
+
+        return aio.run_bounded(request_async, items, concurrency)
+
+    send = admin_graphql_request if graphql else public_request if public else admin_request
+
+    def request(item):
+        if limiter is not None:
+            limiter.acquire()
+        args, kwargs = request_args(item)
+        return send(*args, **kwargs)
+
+    ensure_pool_size(workers)
+    return run_bounded(request, items, workers)
+
+
+class Checkpoint:
+    # Tracks the highest row number below which every row has completed, so a crashed run can skip them.
+    # Rows completed beyond that watermark are retried on resume, so imports are at-least-once.
+
+    def __init__(self, path, save_interval=1.0):
+        self.path = path
+        self.save_interval = save_interval
+        self.done_through = 0
+        self._completed = set()
+        self._last_saved = 0.0
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as f:
+                self.done_through = json.load(f).get('done_through', 0)
+
+    def mark(self, row_number):
+        with self._lock:
+            self._completed.add(row_number)
+            while self.done_through + 1 in self._completed:
+                self.done_through += 1
+                self._completed.discard(self.done_through)
+            if time.monotonic() - self._last_saved >= self.save_interval:
+                self._save()
+
+    def save(self):
+        with self._lock:
+            self._save()
+
+    def _save(self):
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'done_through': self.done_through}, f)
+        os.replace(tmp_path, self.path)
+        self._last_saved = time.monotonic()
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def print_summary(action, succeeded, failed, started, unit='rows'):
+    elapsed = time.monotonic() - started
+    rate = (succeeded + failed) / elapsed if elapsed > 0 else 0.0
+    throttled = throttle.throttled_count()
+    note = f', throttled {throttled} times' if throttled else ''
+    click.echo(click.style(f'{action} {succeeded}, failed {failed} in {elapsed:.1f}s ({rate:.1f} {unit}/sec{note})',
+                           fg='green'), err=True)
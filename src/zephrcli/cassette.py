@@ -0,0 +1,247 @@
+import hashlib
+import struct
+import threading
+import time
+
+import click
+
+# Cassette settings, overridden by the global options on the root cli group
+_settings = {
+    # File every request and response is recorded to
+    'record_path': None,
+    # File responses are served from instead of the network
+    'replay_path': None,
+    # Milliseconds added to each replayed response, or 'recorded' for the latency seen when it was recorded
+    'replay_latency': 0.0,
+}
+
+# A cassette is a header, then one entry per response in the order they arrived, then an index sorted by request
+# key and sequence number, then a footer locating the index. Each entry is
+#   key (8 bytes), sequence (4), status (2), latency ms (float, 4), meta length (4), content length (4),
+# followed by a JSON object of the reason and kept headers, and the body. The index is fixed-size records of
+#   key (8), sequence (4), entry offset (8)
+# so replay can binary search it in a memory map without loading the cassette. All integers are big-endian, which
+# makes the bytes of key + sequence sort in the same order as the values.
+MAGIC = b'ZEPHRCAS1\n'
+INDEX_MAGIC = b'ZCINDEX1'
+_ENTRY = struct.Struct('>8sIHfII')
+_INDEX = struct.Struct('>8sIQ')
+_FOOTER = struct.Struct('>QQ8s')
+# Response headers the commands use; the rest are not recorded
+KEPT_HEADERS = ('content-type', 'retry-after', 'location')
+
+# users counts the root invocations sharing the open cassette, e.g. `zephr --record f shell` and each command run in
+# the shell, so the cassette stays open until the outermost one finishes
+_state = {'recorder': None, 'player': None, 'paths': None, 'users': 0}
+
+
+class CassetteMiss(click.ClickException):
+    pass
+
+
+def configure(record_path=None, replay_path=None, replay_latency=None):
+    # Called once per command run. A nested run with the same cassette keeps using the open one, so a recording is
+    # not truncated and a replay carries on where it was; otherwise the previous cassette is finished first.
+    if replay_latency is not None:
+        _settings['replay_latency'] = replay_latency
+    if _state['users'] and _state['paths'] == (record_path, replay_path):
+        _state['users'] += 1
+        return
+    _finish()
+    _settings.update(record_path=record_path, replay_path=replay_path)
+    if record_path:
+        _state['recorder'] = Recorder(record_path)
+    if replay_path:
+        _state['player'] = Player(replay_path)
+    _state.update(paths=(record_path, replay_path), users=1)
+
+
+def close():
+    # Called when a command finishes: the outermost run to finish writes the index of a recording, and nested runs
+    # leave what they recorded flushed to the file
+    _state['users'] = max(0, _state['users'] - 1)
+    if _state['users']:
+        if _state['recorder'] is not None:
+            _state['recorder'].flush()
+        return
+    _finish()
+
+
+def _finish():
+    recorder, player = _state['recorder'], _state['player']
+    _state.update(recorder=None, player=None, paths=None, users=0)
+    if recorder is not None:
+        recorder.close()
+    if player is not None:
+        player.close()
+
+
+def request_key(method, url, body):
+    # Requests are matched on method, path, query and body, not host, so a cassette recorded against one tenant or
+    # mock server replays against any base URL
+    from urllib.parse import urlsplit
+    parts = urlsplit(url)
+    digest = hashlib.sha256(f'{method} {parts.path}?{parts.query}\0'.encode('UTF-8'))
+    digest.update(body or b'')
+    return digest.digest()[:8]
+
+
+class Recorder:
+
+    def __init__(self, path):
+        self._file = open(path, 'wb')
+        self._file.write(MAGIC)
+        self._index = []
+        self._sequences = {}
+        self._lock = threading.Lock()
+
+    def record(self, method, url, body, r, latency):
+        from .output import dumps
+        key = request_key(method, url, body)
+        headers = {name: r.headers[name] for name in KEPT_HEADERS if r.headers.get(name)}
+        meta = dumps({'reason': r.reason or '', 'headers': headers})
+        content = r.content or b''
+        with self._lock:
+            sequence = self._sequences.get(key, 0)
+            self._sequences[key] = sequence + 1
+            self._index.append(_INDEX.pack(key, sequence, self._file.tell()))
+            self._file.write(_ENTRY.pack(key, sequence, r.status_code, latency * 1000, len(meta), len(content)))
+            self._file.write(meta)
+            self._file.write(content)
+
+    def flush(self):
+        with self._lock:
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            index_offset = self._file.tell()
+            self._index.sort()
+            self._file.write(b''.join(self._index))
+            self._file.write(_FOOTER.pack(index_offset, len(self._index), INDEX_MAGIC))
+            self._file.close()
+
+
+class Player:
+    # Serves recorded responses from a memory map of the cassette. A request made more times than it was recorded
+    # gets its last recorded response again.
+
+    def __init__(self, path):
+        import mmap
+        not_cassette = click.BadParameter(f'{path} is not a zephr cassette made with --record', param_hint="'--replay'")
+        with open(path, 'rb') as f:
+            try:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # An empty file cannot be mapped
+                raise not_cassette
+        if self._map[:len(MAGIC)] != MAGIC:
+            self._map.close()
+            raise not_cassette
+        index_offset, count, magic = 0, 0, None
+        if len(self._map) >= len(MAGIC) + _FOOTER.size:
+            index_offset, count, magic = _FOOTER.unpack_from(self._map, len(self._map) - _FOOTER.size)
+        if magic == INDEX_MAGIC:
+            self._index, self._index_offset, self._count = None, index_offset, count
+        else:
+            # The recording was interrupted before its index was written, so it is rebuilt from the entries
+            self._index = sorted(self._scan())
+        self._next = {}
+        self._lock = threading.Lock()
+
+    def _scan(self):
+        offset = len(MAGIC)
+        while offset + _ENTRY.size <= len(self._map):
+            key, sequence, _, _, meta_length, content_length = _ENTRY.unpack_from(self._map, offset)
+            end = offset + _ENTRY.size + meta_length + content_length
+            if end > len(self._map):
+                break
+            yield _INDEX.pack(key, sequence, offset)
+            offset = end
+
+    def _find(self, key, sequence):
+        # Binary search of the index for (key, sequence); returns the entry offset or None
+        target = key + struct.pack('>I', sequence)
+        low, high = 0, self._count if self._index is None else len(self._index)
+        while low < high:
+            middle = (low + high) // 2
+            record = self._index_record(middle)
+            if record[:12] < target:
+                low = middle + 1
+            else:
+                high = middle
+        if low < (self._count if self._index is None else len(self._index)):
+            record = self._index_record(low)
+            if record[:12] == target:
+                return _INDEX.unpack(record)[2]
+        return None
+
+    def _index_record(self, i):
+        if self._index is not None:
+            return self._index[i]
+        start = self._index_offset + i * _INDEX.size
+        return self._map[start:start + _INDEX.size]
+
+    def response(self, method, url, body):
+        # Returns the next recorded response to the request and its recorded latency in seconds
+        from .client import Response
+        from .output import loads
+        key = request_key(method, url, body)
+        with self._lock:
+            sequence = self._next.get(key, 0)
+            offset = self._find(key, sequence)
+            if offset is not None:
+                self._next[key] = sequence + 1
+            elif sequence:
+                offset = self._find(key, sequence - 1)
+        if offset is None:
+            raise CassetteMiss(f'No recorded response to {method} {url}')
+        _, _, status, latency_ms, meta_length, content_length = _ENTRY.unpack_from(self._map, offset)
+        start = offset + _ENTRY.size
+        meta = loads(self._map[start:start + meta_length])
+        content = self._map[start + meta_length:start + meta_length + content_length]
+        return Response(status, meta['reason'], meta['headers'], content), latency_ms / 1000
+
+    def close(self):
+        self._map.close()
+
+
+def _latency(recorded):
+    latency = _settings['replay_latency']
+    return recorded if latency == 'recorded' else float(latency or 0) / 1000
+
+
+def send(method, url, body, request):
+    # Returns request(), recording the response, or with --replay the recorded response without calling it
+    player, recorder = _state['player'], _state['recorder']
+    if player is not None:
+        r, recorded = player.response(method, url, body)
+        delay = _latency(recorded)
+        if delay:
+            time.sleep(delay)
+        return r
+    if recorder is None:
+        return request()
+    started = time.perf_counter()
+    r = request()
+    recorder.record(method, url, body, r, time.perf_counter() - started)
+    return r
+
+
+async def send_async(method, url, body, request):
+    # As send(), for a coroutine function request on the asyncio engine
+    player, recorder = _state['player'], _state['recorder']
+    if player is not None:
+        import asyncio
+        r, recorded = player.response(method, url, body)
+        delay = _latency(recorded)
+        if delay:
+            await asyncio.sleep(delay)
+        return r
+    if recorder is None:
+        return await request()
+    started = time.perf_counter()
+    r = await request()
+    recorder.record(method, url, body, r, time.perf_counter() - started)
+    return r
+
@@ -0,0 +1,253 @@
+import hashlib
+import threading
+
+from . import cassette, hedge, output, response_cache, throttle, trace
+from .signing import signer_for
+
+# Transport settings, overridden by the global options on the root cli group
+_settings = {
+    'pool_size': 10,
+    'connect_timeout': 5.0,
+    'read_timeout': 30.0,
+    'retries': 2,
+    # Requests in flight on the asyncio engine for fan-out commands; None uses their thread pools
+    'concurrency': None,
+    # Base URL templates, overridable to point the CLI at a local mock server
+    'admin_url': 'https://{tenant_id}.api.zephr.com',
+    'public_url': 'https://{tenant_id}-{site_name}.cdn.zephr.com',
+    'console_url': 'https://console.zephr.com',
+}
+
+# One pooled keep-alive session per host (keyed by base URL), shared by every command in the process
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def configure(pool_size=None, connect_timeout=None, read_timeout=None, retries=None, admin_url=None,
+              public_url=None, console_url=None, concurrency=None):
+    # Each command run in a shell configures the client again. A pool already grown by a fan-out command is kept
+    # rather than shrunk back, which would close the sessions and drop their warm connections.
+    if pool_size is not None and _sessions and pool_size < _settings['pool_size']:
+        pool_size = None
+    changed = {'pool_size': pool_size, 'connect_timeout': connect_timeout,
+               'read_timeout': read_timeout, 'retries': retries, 'admin_url': admin_url,
+               'public_url': public_url, 'console_url': console_url, 'concurrency': concurrency}
+    pool_settings = (_settings['pool_size'], _settings['retries'])
+    _settings.update({k: v for k, v in changed.items() if v is not None})
+    # Sessions already created were mounted with the old pool settings
+    if (_settings['pool_size'], _settings['retries']) != pool_settings:
+        close_sessions()
+
+
+def setting(name):
+    return _settings[name]
+
+
+def ensure_pool_size(workers):
+    # Fan-out commands need a pooled connection per worker, otherwise surplus connections are discarded
+    if workers > _settings['pool_size']:
+        configure(pool_size=workers)
+
+
+def close_sessions():
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+def get_session(base_url):
+    with _sessions_lock:
+        session = _sessions.get(base_url)
+        if session is None:
+            session = _new_session()
+            _sessions[base_url] = session
+        return session
+
+
+def _new_session():
+    # requests is slow to import, so it is loaded with the first session rather than at startup
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    # Connect errors are always retried; read errors and 502/504 only for idempotent methods.
+    # 429 and 503 are retried by the throttle scheduler, which also slows down the rest of the traffic to the host.
+    # urllib3 would otherwise retry a 429 or 503 with Retry-After itself, out of the scheduler's and deadline's sight.
+    retry = Retry(total=_settings['retries'], backoff_factor=0.3, status_forcelist=(502, 504), raise_on_status=False,
+                  respect_retry_after_header=False)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=_settings['pool_size'], max_retries=retry)
+    # With --trace, new connections report their DNS, connect and TLS time
+    if trace.enabled():
+        adapter.poolmanager.pool_classes_by_scheme = trace.connection_pool_classes()
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+class Response:
+    # The parts of requests.Response used by the commands and output helpers, for responses that did not come from
+    # requests: those of the asyncio engine and those replayed from a cassette
+
+    def __init__(self, status_code, reason, headers, content):
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.content = content
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    @property
+    def text(self):
+        return self.content.decode('UTF-8', errors='replace')
+
+    def json(self):
+        return output.loads(self.content)
+
+    def __repr__(self):
+        return f'<Response [{self.status_code}]>'
+
+
+def send(method, base_url, url, sign=None, **kwargs):
+    # sign, if given, returns fresh headers for each attempt so a retried admin request is signed again
+    kwargs.setdefault('timeout', (_settings['connect_timeout'], _settings['read_timeout']))
+
+    def send_once():
+        if sign is not None:
+            kwargs['headers'] = sign()
+        # The session, and with it requests, is only needed when the response is not replayed from a cassette
+        return cassette.send(method, url, kwargs.get('data'),
+                             lambda: trace.send(get_session(base_url).request, method, url, **kwargs))
+
+    return trace.call(method, url, lambda: throttle.call(base_url, method, send_once))
+
+
+def admin_base_url(tenant_id):
+    return _settings['admin_url'].format(tenant_id=tenant_id)
+
+
+def public_base_url(tenant_id, site_name):
+    return _settings['public_url'].format(tenant_id=tenant_id, site_name=site_name)
+
+
+def console_base_url():
+    return _settings['console_url']
+
+
+def sign_zephr_request(secret_key, body, path, query, method, timestamp, nonce):
+    # The plain form of Zephr's signature, kept as the reference the mock server verifies against and benchsuite
+    # compares ZephrSigner with; requests made by the CLI are signed with signer_for
+    message = f'{secret_key}{body}{path}{query}{method}{timestamp}{nonce}'
+    sha_hash = hashlib.sha256(bytes(message, 'UTF-8'))
+    return sha_hash.hexdigest()
+
+
+def encode_body(body):
+    # Request bodies are serialised once, and the same bytes are signed and sent
+    return b'' if body is None else output.dumps(body)
+
+
+def admin_headers(client_id, client_secret, body, method, path, query, extra_headers=None):
+    # body is the encoded request body, as returned by encode_body
+    authorization_header_value = signer_for(client_id, client_secret).authorization(body, method, path, query)
+    headers = {'Authorization': authorization_header_value,
+               'Content-Type': 'application/json', 'Accept': 'application/json'}
+    if extra_headers is not None:
+        headers.update(extra_headers)
+    return headers
+
+
+def admin_request(method, tenant_id, client_id, client_secret, path, query="", body=None, cookies=None,
+                  extra_headers=None):
+    base_url = admin_base_url(tenant_id)
+    data = encode_body(body)
+
+    def sign():
+        return admin_headers(client_id, client_secret, data, method, path, query, extra_headers)
+
+    url = f'{base_url}{path}?{query}' if query else f'{base_url}{path}'
+    r = send(method, base_url, url, sign=sign, data=data or None, cookies=cookies)
+    if method != "GET":
+        response_cache.invalidate(tenant_id, path)
+    return r
+
+
+def public_request(method, path, tenant_id, site_name, query="", body=None, cookies=None, extra_headers=None):
+    base_url = public_base_url(tenant_id, site_name)
+    headers = {'Content-Type': 'application/json',
+               'Accept': 'application/json'}
+    if extra_headers is not None:
+        headers.update(extra_headers)
+
+    url = f'{base_url}{path}?{query}' if query else f'{base_url}{path}'
+    data = encode_body(body) or None
+    if hedge.applies(method, path):
+        return hedge.call(base_url, lambda: send(method, base_url, url, headers=headers, data=data, cookies=cookies))
+    return send(method, base_url, url, headers=headers, data=data, cookies=cookies)
+
+
+def print_response(r):
+    output.write_response(r)
+
+
+def print_json(value):
+    output.write_value(value)
+
+
+def do_get_admin(tenant_id, client_id, client_secret, path, query="", cacheable=False):
+    if cacheable:
+        cached = response_cache.get(tenant_id, "GET", path, query)
+        if cached is not None:
+            output.write_body(cached.encode())
+            return
+    r = admin_request("GET", tenant_id, client_id, client_secret, path, query=query)
+    if cacheable and r.ok:
+        response_cache.put(tenant_id, "GET", path, query, r.text)
+    print_response(r)
+
+
+def do_get_public(path, tenant_id, site_name, query="", cookies=None):
+    print_response(public_request("GET", path, tenant_id, site_name, query=query, cookies=cookies))
+
+
+def do_post_admin(path, body, cookies, tenant_id, client_id, client_secret):
+    print_response(admin_request("POST", tenant_id, client_id, client_secret, path, body=body, cookies=cookies))
+
+
+def do_post_public(path, body, cookies, tenant_id, site_name, extra_headers=None):
+    print_response(public_request("POST", path, tenant_id, site_name, body=body, cookies=cookies,
+                                  extra_headers=extra_headers))
+
+
+def do_put(tenant_id, client_id, client_secret, path, body=None, extra_headers=None):
+    if body is None:
+        body = {}
+    print_response(admin_request("PUT", tenant_id, client_id, client_secret, path, body=body,
+                                 extra_headers=extra_headers))
+
+
+def do_delete_admin(tenant_id, client_id, client_secret, path, query=""):
+    print_response(admin_request("DELETE", tenant_id, client_id, client_secret, path, query=query))
+
+
+def do_delete_public(path, tenant_id, site_name, cookies=None):
+    print_response(public_request("DELETE", path, tenant_id, site_name, cookies=cookies))
+
+
+def admin_graphql_request(body, cookies, client_id, client_secret):
+    path = '/v4/admin/graphql/'
+    base_url = console_base_url()
+    data = encode_body(body)
+
+    def sign():
+        return admin_headers(client_id, client_secret, data, "POST", path, "")
+
+    url = f'{base_url}{path}'
+    return send("POST", base_url, url, sign=sign, data=data, cookies=cookies)
+
+
+def do_admin_graphql(body, cookies, client_id, client_secret):
+    print_response(admin_graphql_request(body, cookies, client_id, client_secret))
@@ -0,0 +1,69 @@
+import click
+
+from ..api_auth import admin_api_command, parse_credential_options
+from ..client import do_get_admin, do_put, do_delete_admin
+
+
+@click.command()
+@admin_api_command
+def list_accounts(profile, tenant_id, client_id, client_secret):
+    tenant_id, client_id, client_secret = parse_credential_options(profile, tenant_id, client_id, client_secret)
+    do_get_admin(tenant_id, client_id, client_secret, "/v3/accounts")
+
+
+@click.command()
+@admin_api_command
+@click.argument('account-id')
+def get_account(profile, tenant_id, client_id, client_secret, account_id):
+    tenant_id, client_id, client_secret = parse_credential_options(profile, tenant_id, client_id, client_secret)
+    do_get_admin(tenant_id, client_id, client_secret, f"/v3/accounts/{account_id}")
+
+
+# TODO - doesn't work as documented - always returns 404! raise issue with Zephr
+@click.command()
+@admin_api_command
+def list_account_users(profile, tenant_id, client_id, client_secret):
+    tenant_id, client_id, client_secret = parse_credential_options(profile, tenant_id, client_id, client_secret)
+    # NOTE - rather than return empty list - this returns 404 if no results
+    do_get_admin(tenant_id, client_id, client_secret, f"/v3/accounts/users")
+
+
+@click.command(help='Add a user to a company account')
+@admin_api_command
+@click.option('-u', '--user-id', required=True, help='The ID of the user')
+@click.option('-a', '--account-id', required=True, help='The ID of the company account')
+def add_user_to_account(profile, tenant_id, client_id, client_secret, user_id, account_id):
+    tenant_id, client_id, client_secret = parse_credential_options(profile, tenant_id, client_id, client_secret)
+    do_put(tenant_id, client_id, client_secret, f"/v3/accounts/{account_id}/users/{user_id}")
+
+
+@click.command(help='Remove user from company account')
+@admin_api_command
+@click.option('-u', '--user-id', required=True, help='The ID of the user')
+@click.option('-a', '--account-id', required=True, help='The ID of the company account')
+def remove_user_from_account(profile, tenant_id, client_id, client_secret, user_id, account_id):
+    tenant_id, client_id, client_secret = parse_credential_options(profile, tenant_id, client_id, client_secret)
+    do_delete_admin(tenant_id, client_id, client_secret, f"/v3/accounts/{account_id}/users/{user_id}")
+
+
+@click.command()
+@admin_api_command
+def list_companies(profile, tenant_id, client_id, client_secret):
+    tenant_id, client_id, client_secret = parse_credential_options(profile, tenant_id, client_id, client_secret)
+    do_get_admin(tenant_id, client_id, client_secret, "/v3/companies")
+
+
+@click.command()
+@admin_api_command
+@click.argument('company-id')
+def get_company(profile, tenant_id, client_id, client_secret, company_id):
+    tenant_id, client_id, client_secret = parse_credential_options(profile, tenant_id, client_id, client_secret)
+    do_get_admin(tenant_id, client_id, client_secret, f"/v3/companies/{company_id}")
+
+
+@click.command()
+@admin_api_command
+@click.argument('company-id')
+def delete_company(profile, tenant_id, client_id, client_secret, company_id):
+    tenant_id, client_id, client_secret = parse_credential_options(profile, tenant_id, client_id, client_secret)
+    do_delete_admin(tenant_id, client_id, client_secret, f"/v3/companies/{company_id}")
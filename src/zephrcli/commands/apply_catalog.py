@@ -0,0 +1,235 @@
+import json
+import time
+
+import click
+
+from ..api_auth import admin_api_command, parse_credential_options
+from ..bulk import print_summary, run_requests
+from ..output import write_record
+from ..paging import result_list
+from ..throttle import DeadlineExceeded
+
+# Lists read before planning; entitlements, meters and credits are only referred to, never written
+CURRENT = {'bundles': '/v3/bundles', 'entitlements': '/v3/entitlements', 'meters': '/v3/meters',
+           'credits': '/v3/credits', 'products': '/v3/products'}
+INCLUDES = ('entitlements', 'meters', 'credits', 'bundles')
+
+
+def load_catalog(path):
+    # A JSON object with a list of bundles, identified by label, and of products, identified by id
+    try:
+        with open(path) as f:
+            catalog = json.load(f)
+    except ValueError as e:
+        raise click.ClickException(f'{path} is not valid JSON: {e}')
+    bundles, products = catalog.get('bundles', []), catalog.get('products', [])
+    labels = [bundle.get('label') for bundle in bundles]
+    if not all(labels) or len(set(labels)) != len(labels):
+        raise click.ClickException('Every bundle needs a label, and no two bundles may share one')
+    product_ids = [product.get('id') for product in products]
+    if not all(product_ids) or len(set(product_ids)) != len(product_ids) or \
+            not all(product.get('bundle') for product in products):
+        raise click.ClickException('Every product needs a unique id and the bundle it grants')
+    return bundles, products
+
+
+def _ref_id(item):
+    # Included items may be ids or objects with an id
+    return item.get('id') if isinstance(item, dict) else item
+
+
+def resolver(items, kind):
+    # Returns a function giving the id of the item with a given id or label
+    ids = {item.get('id') for item in items}
+    labels = {}
+    for item in items:
+        labels.setdefault(item.get('label') or item.get('name'), []).append(item.get('id'))
+
+    def resolve(ref):
+        if ref in ids:
+            return ref
+        matches = labels.get(ref, [])
+        if len(matches) != 1:
+            problem = f'matches {len(matches)} {kind}; give its id' if matches else 'not found'
+            raise click.ClickException(f'{kind[:-1].capitalize()} {ref!r} {problem}')
+        return matches[0]
+
+    return resolve
+
+
+def topological_order(dependencies):
+    # Orders the nodes so each comes after the nodes it depends on; raises on a cycle
+    remaining = {node: set(deps) for node, deps in dependencies.items()}
+    order = []
+    ready = [node for node, deps in remaining.items() if not deps]
+    while ready:
+        node = ready.pop()
+        order.append(node)
+        del remaining[node]
+        for other, deps in remaining.items():
+            if node in deps:
+                deps.discard(node)
+                if not deps:
+                    ready.append(other)
+    if remaining:
+        raise click.ClickException(f'Bundles include each other in a cycle: {", ".join(sorted(remaining))}')
+    return order
+
+
+def bundle_state(bundle):
+    # The fields compared to decide whether a bundle needs updating
+    includes = bundle.get('includes') or {}
+    return (bundle.get('label'), bundle.get('description') or '', bundle.get('auto_assign') or 'none',
+            tuple(tuple(sorted(str(_ref_id(item)) for item in includes.get(name) or [])) for name in INCLUDES))
+
+
+def product_differs(product, current):
+    # Whether any field the catalog file sets for a product differs from the current product; the entitlement is
+    # compared by id, and fields the file leaves out are left as they are
+    if _ref_id(product.get('entitlement') or {}) != _ref_id(current.get('entitlement') or {}):
+        return True
+    return any(current.get(key) != value for key, value in product.items() if key != 'entitlement')
+
+
+def plan_catalog(bundles, products, current):
+    # Returns the create and update actions that make the current catalog match the file, each with the wave it
+    # runs in: an action only waits for the bundles it refers to that are created in this run, so everything
+    # else runs in the first wave. Returns the actions and the ids of existing bundles by label.
+    existing = {}
+    for bundle in current['bundles']:
+        existing.setdefault(bundle.get('label'), []).append(bundle)
+    bundle_ids = {label: found[0]['id'] for label, found in existing.items() if len(found) == 1}
+    resolve = {name: resolver(current[name], name) for name in INCLUDES}
+    desired = {bundle['label']: bundle for bundle in bundles}
+
+    # Bundles in the file are referred to by label, and resolved to ids when their action runs
+    def included_bundles(bundle):
+        return [ref for ref in (bundle.get('includes') or {}).get('bundles') or [] if ref in desired]
+
+    order = topological_order({label: included_bundles(bundle) for label, bundle in desired.items()})
+    actions, waves = [], {}
+    for label in order:
+        bundle = desired[label]
+        if len(existing.get(label, [])) > 1:
+            raise click.ClickException(f'Several bundles are labelled {label!r}; rename all but one first')
+        includes = {name: [resolve[name](ref) for ref in (bundle.get('includes') or {}).get(name) or []]
+                    for name in ('entitlements', 'meters', 'credits')}
+        includes['bundles'] = [ref if ref in desired else resolve['bundles'](ref)
+                               for ref in (bundle.get('includes') or {}).get('bundles') or []]
+        body = {'label': label, 'description': bundle.get('description') or label, 'includes': includes,
+                'auto_assign': bundle.get('auto_assign') or 'none'}
+        needs = {ref for ref in included_bundles(bundle) if ref in waves}
+        # A bundle that includes one created in this run cannot match its current state
+        comparable = dict(body, includes=dict(includes, bundles=[bundle_ids.get(ref, ref) if ref in desired else ref
+                                                                 for ref in includes['bundles']]))
+        if label not in bundle_ids:
+            action = 'create'
+        elif needs or bundle_state(comparable) != bundle_state(existing[label][0]):
+            action = 'update'
+        else:
+            continue
+        if action == 'create':
+            waves[label] = max((waves[ref] + 1 for ref in needs), default=0)
+        actions.append({'wave': max((waves[ref] + 1 for ref in needs), default=0), 'action': action,
+                        'bundle': label, 'body': body, 'needs': needs})
+
+    current_products = {product.get('id'): product for product in current['products']}
+    for product in products:
+        ref = product['bundle']
+        body = dict({k: v for k, v in product.items() if k != 'bundle'},
+                    entitlement={'type': 'bundle', 'id': ref if ref in desired else resolve['bundles'](ref)})
+        needs = {ref} if ref in waves else set()
+        comparable = dict(body, entitlement={'id': bundle_ids.get(ref, ref) if ref in desired else
+                                             body['entitlement']['id']})
+        found = current_products.get(product['id'])
+        if found is not None and not needs and not product_differs(comparable, found):
+            continue
+        actions.append({'wave': max((waves[ref] + 1 for ref in needs), default=0),
+                        'action': 'update' if found is not None else 'create', 'product': product['id'],
+                        'body': body, 'needs': needs})
+    return actions, bundle_ids
+
+
+@click.command(help='Create and update bundles and products to match a catalog file, in dependency order')
+@admin_api_command
+@click.option('--dry-run', is_flag=True, help='Print the planned creates and updates without making them')
+@click.option('-w', '--workers', default=8, show_default=True, help='Concurrent requests')
+@click.argument('file', type=click.Path(exists=True, dir_okay=False))
+def apply_catalog(profile, tenant_id, client_id, client_secret, dry_run, workers, file):
+    tenant_id, client_id, client_secret = parse_credential_options(profile, tenant_id, client_id, client_secret)
+    bundles, products = load_catalog(file)
+
+    def fetch(name):
+        return ("GET", tenant_id, client_id, client_secret, CURRENT[name]), {}
+
+    current = {}
+    for name, r, error in run_requests(fetch, [n for n in CURRENT if n != 'products' or products], workers):
+        if error is not None:
+            raise error
+        # Zephr may answer 404 rather than an empty list
+        if not r.ok and r.status_code != 404:
+            raise click.ClickException(f'Failed to fetch {CURRENT[name]}: {r}')
+        current[name] = result_list(r.json()) if r.ok else []
+    current.setdefault('products', [])
+
+    actions, bundle_ids = plan_catalog(bundles, products, current)
+    wave_count = max((action['wave'] for action in actions), default=-1) + 1
+    creates = sum(1 for action in actions if action['action'] == 'create')
+    click.echo(click.style(f'{len(bundles)} bundles, {len(products)} products: {creates} creates, '
+                           f'{len(actions) - creates} updates in {wave_count} waves', fg='green'), err=True)
+    if dry_run:
+        for action in actions:
+            write_record({key: action[key] for key in ('wave', 'action', 'bundle', 'product', 'body') if key in action})
+        return
+
+    def resolved(body):
+        # Labels of bundles in the file become the ids they have now, including those created in earlier waves
+        if 'includes' in body:
+            return dict(body, includes=dict(body['includes'], bundles=[bundle_ids.get(ref, ref)
+                                                                       for ref in body['includes']['bundles']]))
+        entitlement = body['entitlement']
+        return dict(body, entitlement=dict(entitlement, id=bundle_ids.get(entitlement['id'], entitlement['id'])))
+
+    def apply(action):
+        if 'bundle' in action:
+            path = '/v3/bundles' if action['action'] == 'create' else f"/v3/bundles/{bundle_ids[action['bundle']]}"
+        else:
+            path = '/v3/products' if action['action'] == 'create' else f"/v3/products/{action['product']}"
+        method = "POST" if action['action'] == 'create' else "PUT"
+        return (method, tenant_id, client_id, client_secret, path), {'body': resolved(action['body'])}
+
+    started = time.monotonic()
+    succeeded = failed = unsent = 0
+    for wave in range(wave_count):
+        ready = []
+        for action in (a for a in actions if a['wave'] == wave):
+            # Bundles that failed to be created leave the actions referring to them undone
+            missing = sorted(ref for ref in action['needs'] if ref not in bundle_ids)
+            if missing:
+                failed += 1
+                write_record(dict(_result(action), status='skipped', error=f'Needs {", ".join(missing)}'))
+            else:
+                ready.append(action)
+        for action, r, error in run_requests(apply, ready, workers):
+            if isinstance(error, DeadlineExceeded):
+                unsent += 1
+                continue
+            ok = error is None and r.ok
+            if ok and action['action'] == 'create' and 'bundle' in action:
+                bundle_ids[action['bundle']] = r.json().get('id')
+            succeeded += ok
+            failed += not ok
+            if error is not None:
+                write_record(dict(_result(action), status=repr(error)))
+            elif not ok:
+                write_record(dict(_result(action), status=r.status_code, error=r.text))
+            else:
+                write_record(dict(_result(action), status=r.status_code))
+    if unsent:
+        click.echo(click.style(f'Deadline reached: {unsent} calls not sent; run again to finish', fg='yellow'),
+                   err=True)
+    print_summary('applied', succeeded, failed, started, unit='calls')
+
+
+def _result(action):
+    return {key: action[key] for key in ('wave', 'action', 'bundle', 'product') if key in action}
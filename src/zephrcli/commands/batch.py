@@ -0,0 +1,177 @@
+import json
+import time
+
+import click
+
+from ..bulk import print_summary, run_keyed
+from ..output import write_record
+from ..throttle import DeadlineExceeded, RateLimiter
+
+# Commands that cannot run as one operation of a batch
+_EXCLUDED = {'batch', 'shell', 'login', 'logout'}
+_CREDENTIAL_PARAMS = ('profile', 'tenant_id', 'client_id', 'client_secret')
+# With --order input, operations are started at most this many places after the oldest unfinished one, which bounds
+# the results held back behind a slow operation
+ORDER_WINDOW = 10000
+
+
+def _param_name(name):
+    # "--user-id", "user-id" and "user_id" all name the user_id parameter
+    return name.lstrip('-').replace('-', '_')
+
+
+def find_command(root, ctx, words):
+    # The subcommand named by words, e.g. ['admin', 'create-user'], looked up through the lazy groups
+    command = root
+    for word in words:
+        if not isinstance(command, click.Group):
+            command = None
+            break
+        command = command.get_command(ctx, word)
+        if command is None:
+            break
+    if command is None or isinstance(command, click.Group) or words[-1] in _EXCLUDED:
+        raise click.UsageError(f'No command {" ".join(words)!r} to run in a batch')
+    return command
+
+
+def command_line(command, options, args=()):
+    # The arguments a shell would pass for an options dict, e.g. {"email": "a@b", "foreign_key": [["fk", "1"]]}
+    params = {param.name: param for param in command.params if isinstance(param, click.Option)}
+    argv = []
+    for name, value in options.items():
+        param = params.get(_param_name(name))
+        if param is None:
+            raise click.UsageError(f'{command.name} has no option {name}')
+        flag = max(param.opts, key=len)
+        if param.is_flag:
+            if value:
+                argv.append(flag)
+            continue
+        values = value if param.multiple else [value]
+        for item in values:
+            argv.append(flag)
+            if param.nargs != 1:
+                argv.extend(str(v) for v in item)
+            else:
+                argv.append(str(item))
+    return argv + [str(arg) for arg in args]
+
+
+def has_credentials(params):
+    # Commands left to find their own credentials would prompt for them, which a batch cannot answer
+    if params.get('profile'):
+        return True
+    if 'client_id' in params:
+        return all(params.get(name) for name in ('tenant_id', 'client_id', 'client_secret'))
+    return bool(params.get('tenant_id'))
+
+
+def parse_operations(lines, root, ctx, defaults):
+    # Yields one dict per non-blank line: its position, line number and command, plus either the callback and its
+    # parsed parameters or the error that stops it running
+    index = 0
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        operation = {'index': index, 'line': line_number, 'command': None}
+        index += 1
+        try:
+            op = json.loads(line)
+            words = op['command'].split() if isinstance(op['command'], str) else list(op['command'])
+            operation['command'] = ' '.join(words)
+            command = find_command(root, ctx, words)
+            options = dict(op.get('options') or {})
+            names = {_param_name(name) for name in options}
+            param_names = {param.name for param in command.params}
+            # Operations without credentials of their own use those given to batch that the command takes: public
+            # commands have a profile and tenant but no client key
+            if 'profile' in param_names and not names & set(_CREDENTIAL_PARAMS):
+                options.update({name: value for name, value in defaults.items()
+                                if value is not None and name in param_names})
+            sub_ctx = command.make_context(operation['command'], command_line(command, options, op.get('args', ())),
+                                           parent=ctx)
+            if 'profile' in param_names and not has_credentials(sub_ctx.params):
+                raise click.UsageError('Needs credentials: give --profile to batch, or a profile in the operation')
+            operation.update(callback=command.callback, params=sub_ctx.params)
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            operation['error'] = f'Not an operation: {e!r}'
+        except click.ClickException as e:
+            operation['error'] = e.format_message()
+        yield operation
+
+
+def _in_input_order(results):
+    # Holds each result back until the operations before it have theirs
+    held = {}
+    next_index = 0
+    for result in results:
+        held[result[0]['index']] = result
+        while next_index in held:
+            yield held.pop(next_index)
+            next_index += 1
+
+
+@click.command(help='Run the operations in an NDJSON file, each naming a command and its options, concurrently')
+@click.option('--profile', help='Profile used by operations that give no credentials')
+@click.option('--tenant-id', envvar='TENANT_ID', help='Zephr tenant ID used by operations that give no credentials')
+@click.option('--client-id', envvar='CLIENT_ID', help='Zephr API client key ID, with --tenant-id')
+@click.option('--client-secret', envvar='CLIENT_SECRET', help='Zephr API client secret, with --tenant-id',
+              hide_input=True)
+@click.option('-k', '--key', help='Option whose value serialises operations, e.g. user_id: operations for the same '
+                                  'user run one at a time in file order, while different users run in parallel')
+@click.option('--order', type=click.Choice(['input', 'completion']), default='input', show_default=True,
+              help='Order results are written in')
+@click.option('-w', '--workers', default=8, show_default=True, help='Concurrent operations')
+@click.option('--rate', default=0.0, show_default=True, help='Maximum operations started per second, 0 for no limit')
+@click.argument('file', type=click.File('r'), default='-')
+@click.pass_context
+def batch(ctx, profile, tenant_id, client_id, client_secret, key, order, workers, rate, file):
+    from ..client import ensure_pool_size
+    from ..output import captured
+    ensure_pool_size(workers)
+    root = ctx.find_root().command
+    defaults = {'profile': profile, 'tenant_id': tenant_id, 'client_id': client_id, 'client_secret': client_secret}
+    if profile is not None:
+        defaults.update(tenant_id=None, client_id=None, client_secret=None)
+    limiter = RateLimiter(rate)
+    key_name = _param_name(key) if key else None
+
+    def operation_key(operation):
+        # Operations without the key option, or that will not run, are not held back
+        if key_name is None or 'error' in operation:
+            return None
+        value = operation['params'].get(key_name)
+        return None if value is None else str(value)
+
+    def run(operation):
+        if 'error' in operation:
+            return None
+        limiter.acquire()
+        with captured() as values:
+            operation['callback'](**operation['params'])
+        return values
+
+    started = time.monotonic()
+    succeeded = failed = unsent = 0
+    results = run_keyed(run, parse_operations(file, root, ctx, defaults), operation_key, workers,
+                        window=ORDER_WINDOW if order == 'input' else None)
+    for operation, values, error in _in_input_order(results) if order == 'input' else results:
+        record = {'line': operation['line'], 'command': operation['command']}
+        if isinstance(error, DeadlineExceeded):
+            unsent += 1
+            record['error'] = 'Not sent before the deadline'
+        elif 'error' in operation or error is not None:
+            if isinstance(error, click.ClickException):
+                error = error.format_message()
+            record['error'] = operation.get('error') or str(error) or repr(error)
+        else:
+            record['ok'] = not values.failed
+            record['result'] = values[0] if len(values) == 1 else list(values)
+        ok = record.get('ok', False)
+        succeeded += ok
+        failed += not ok
+        write_record(record)
+    if unsent:
+        click.echo(click.style(f'Deadline reached: {unsent} operations not sent', fg='yellow'), err=True)
+    print_summary('ran', succeeded, failed, started, unit='operations')
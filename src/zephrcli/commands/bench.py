@@ -0,0 +1,101 @@
+import json
+import click
+
+from ..api_auth import public_api_command, parse_single_credential_option
+from ..benchsuite import SUITES, bench_cold_start, format_suite, run_suite, startup_heavy_imports
+from ..client import configure, ensure_pool_size, public_request, setting
+from ..loadgen import format_report, run_open_loop
+from ..mock_server import MockZephrServer, MOCK_TENANT_ID, MOCK_CLIENT_ID, MOCK_CLIENT_SECRET
+from .public import decide_request
+
+# Median cold start of a fresh interpreter running `zephr --version` or `zephr admin --help`
+STARTUP_BUDGET_MS = 200
+
+
+@click.command(name='decide', help='Drive /zephr/decide at a constant arrival rate and report latency')
+@public_api_command
+@click.option('-s', '--site-name', required=True, help='Name of the Zephr site')
+@click.option('-j', '--jwt', help='Specify userID/product claims in a signed JWT')
+@click.option('-k', '--foreign-key', nargs=2, help='Specify user by foreign key e.g. "-k my_fk 1234"')
+@click.option('-i', '--ip', help='Specify IP address of caller')
+@click.option('-u', '--user-agent', help='Specify the User-Agent header')
+@click.option('-z', '--session-id', help='ID of the requesting session')
+@click.option('--rate', default=50.0, show_default=True, help='Target requests per second')
+@click.option('--duration', default=10.0, show_default=True, help='Seconds to send requests for')
+@click.option('--max-in-flight', default=64, show_default=True, help='Maximum concurrent requests')
+@click.option('--stub', is_flag=True, help='Run against a local mock server instead of the tenant')
+@click.option('--stub-latency-ms', default=0.0, show_default=True, help='Artificial latency of the mock server')
+@click.option('--stub-tail-ms', default=0.0, show_default=True, help='Extra latency of a share of mock decides')
+@click.option('--stub-tail-ratio', default=0.0, show_default=True, help='Share of mock decides given --stub-tail-ms')
+@click.option('--json', 'as_json', is_flag=True, help='Print the report as JSON')
+@click.argument('features', nargs=-1, required=True)
+def bench_decide(profile, tenant_id, site_name, jwt, foreign_key, ip, user_agent, session_id, rate, duration,
+                 max_in_flight, stub, stub_latency_ms, stub_tail_ms, stub_tail_ratio, as_json, features):
+    server = None
+    if stub:
+        server = MockZephrServer(latency_ms=stub_latency_ms, tail_ms=stub_tail_ms, tail_ratio=stub_tail_ratio).start()
+        tenant_id = tenant_id or 'stub'
+    else:
+        tenant_id = parse_single_credential_option(profile=profile, tenant_id=tenant_id)
+    ensure_pool_size(max_in_flight)
+
+    foreign_keys = dict([foreign_key]) if foreign_key is not None else None
+    body, cookies, headers = decide_request(features, jwt, foreign_keys, ip, user_agent, session_id)
+
+    def send():
+        return public_request("POST", '/zephr/decide', tenant_id, site_name, body=body, cookies=cookies,
+                              extra_headers=headers)
+
+    # The public URL is process-wide, so it is put back for the commands that follow in a shell or batch
+    public_url = setting('public_url')
+    try:
+        if server is not None:
+            configure(public_url=server.url)
+        result = run_open_loop(send, rate, duration, max_in_flight)
+    finally:
+        if server is not None:
+            configure(public_url=public_url)
+            server.stop()
+    click.echo(json.dumps(result.to_dict(), indent=2) if as_json else format_report(result))
+
+
+@click.command(name='suite', help='Benchmark startup, commands, signing and bulk import against a mock server')
+@click.option('--only', type=click.Choice(SUITES), multiple=True, help='Run only the given suite(s)')
+@click.option('--runs', default=5, show_default=True, help='Repetitions for startup and command timings')
+@click.option('--bulk-rows', default=2000, show_default=True, help='Rows imported by the bulk suite')
+@click.option('--json', 'as_json', is_flag=True, help='Print the results as JSON')
+@click.pass_context
+def bench_suite(ctx, only, runs, bulk_rows, as_json):
+    results = run_suite(ctx.find_root().command, only or SUITES, runs=runs, bulk_rows=bulk_rows)
+    click.echo(json.dumps(results, indent=2) if as_json else format_suite(results))
+
+
+@click.command(name='startup', help='Measure CLI cold-start time and fail if it exceeds the budget')
+@click.option('--runs', default=10, show_default=True, help='Fresh interpreter starts per command')
+@click.option('--budget-ms', default=STARTUP_BUDGET_MS, show_default=True, help='Maximum median start time')
+def bench_startup(runs, budget_ms):
+    results = bench_cold_start(runs)
+    heavy_imports = startup_heavy_imports()
+    click.echo(format_suite({'cold-start': results}))
+    click.echo(f'heavy imports at startup: {", ".join(heavy_imports) or "none"}')
+    over_budget = [name for name, timing in results.items() if timing['median_ms'] > budget_ms]
+    if over_budget or heavy_imports:
+        raise click.ClickException(f'Startup budget of {budget_ms:g}ms exceeded: {", ".join(over_budget) or "-"}; '
+                                   f'heavy imports: {", ".join(heavy_imports) or "-"}')
+
+
+@click.command(name='mock-server', help='Run a local mock Zephr server for offline use')
+@click.option('--port', default=8080, show_default=True, help='Port to listen on')
+@click.option('--latency-ms', default=0.0, show_default=True, help='Artificial latency added to decide')
+@click.option('--rate-limit', type=int, help='Requests per second before answering 429 with Retry-After')
+@click.option('--tail-ms', default=0.0, show_default=True, help='Extra latency added to a share of decides')
+@click.option('--tail-ratio', default=0.0, show_default=True, help='Share of decides given --tail-ms, e.g. 0.02')
+def bench_mock_server(port, latency_ms, rate_limit, tail_ms, tail_ratio):
+    server = MockZephrServer(port=port, latency_ms=latency_ms, rate_limit=rate_limit, tail_ms=tail_ms,
+                             tail_ratio=tail_ratio)
+    click.echo(click.style(f'Mock Zephr server on {server.url} - tenant: {MOCK_TENANT_ID}, client id: '
+                           f'{MOCK_CLIENT_ID}, client secret: {MOCK_CLIENT_SECRET}', fg='green'), err=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -0,0 +1,160 @@
+import click
+
+from ..api_auth import admin_api_command, parse_credential_options
+from .. import response_cache
+from ..client import do_get_admin, do_post_admin, do_put, do_delete_admin
+
+
+@click.command()
+@admin_api_command
+def list_products(profile, tenant_id, client_id, client_secret):
+    tenant_id, client_id, client_secret = parse_credential_options(profile, tenant_id, client_id, client_secret)
+    do_get_admin(tenant_id, client_id, client_secret, "/v3/products", cacheable=True)
+
+
+@click.command()
+@admin_api_command
+def list_entitlements(profile, tenant_id, client_id, client_secret):
+    tenant_id, client_id, client_secret = parse_credential_options(profile, tenant_id, client_id, client_secret)
+    do_get_admin(tenant_id, client_id, client_secret, "/v3/entitlements", cacheable=True)
+
+
+@click.command()
+@admin_api_command
+def list_meters(profile, tenant_id, client_id, client_secret):
+    tenant_id, client_id, client_secret = parse_credential_options(profile, tenant_id, client_id, client_secret)
+    do_get_admin(tenant_id, client_id, client_secret, "/v3/meters", cacheable=True)
+
+
+@click.command()
+@admin_api_command
+def list_credits(profile, tenant_id, client_id, client_secret):
+    tenant_id, client_id, client_secret = parse_credential_options(profile, tenant_id, client_id, client_secret)
+    do_get_admin(tenant_id, client_id, client_secret, "/v3/credits", cacheable=True)
+
+
+@click.command(help="Create a bundle (for attachment to a Product)")
+@admin_api_command
+@click.option('-l', '--label', required=True, help='The label of the bundle')
+@click.option('-d', '--description', required=False, help='The description of the bundle', default="Same as label")
+def create_bundle(profile, tenant_id, client_id, client_secret, label, description=None):
+    if description is None:
+        description = label
+    tenant_id, client_id, client_secret = parse_credential_options(profile, tenant_id, client_id, client_secret)
+    body = {
+        "label": f"{label}",
+        "description": f"{description}",
+        "includes": {
+            "entitlements": [],
+            "meters": [],
+            "credits": [],
+            "bundles": []
+        },
+        "auto_assign": "none"
+    }
+
+    cookies = {}
+
+    do_post_admin(f'/v3/bundles', body, cookies, tenant_id, client_id, client_secret)
+
+
+@click.command(help="List all bundles")
+@admin_api_command
+def list_bundles(profile, tenant_id, client_id, client_secret):
+    tenant_id, client_id, client_secret = parse_credential_options(profile, tenant_id, client_id, client_secret)
+    do_get_admin(tenant_id, client_id, client_secret, "/v3/bundles", cacheable=True)
+
+
+@click.command(help="Get the specified bundle")
+@admin_api_command
+@click.argument('bundle-id')
+def get_bundle(profile, tenant_id, client_id, client_secret, bundle_id):
+    tenant_id, client_id, client_secret = parse_credential_options(profile, tenant_id, client_id, client_secret)
+    do_get_admin(tenant_id, client_id, client_secret, f"/v3/bundles/{bundle_id}", cacheable=True)
+
+
+@click.command(help="Update a bundle")
+@admin_api_command
+@click.option('-l', '--label', required=True, help='The label of the bundle')
+@click.option('-d', '--description', required=True, help='The description of the bundle')
+@click.argument('bundle-id')
+def update_bundle(profile, tenant_id, client_id, client_secret, label, description, bundle_id):
+    tenant_id, client_id, client_secret = parse_credential_options(profile, tenant_id, client_id, client_secret)
+    body = {
+        "label": f"{label}",
+        "description": f"{description}",
+        "includes": {
+            "entitlements": [],
+            "meters": [],
+            "credits": [],
+            "bundles": []
+        },
+        "auto_assign": "none"
+    }
+
+    do_put(tenant_id=tenant_id, client_id=client_id, client_secret=client_secret, path=f'/v3/bundles/{bundle_id}',
+           body=body)
+
+
+@click.command(help="Delete the specified bundle")
+@admin_api_command
+@click.argument('bundle-id')
+def delete_bundle(profile, tenant_id, client_id, client_secret, bundle_id):
+    tenant_id, client_id, client_secret = parse_credential_options(profile, tenant_id, client_id, client_secret)
+    do_delete_admin(tenant_id, client_id, client_secret, f"/v3/bundles/{bundle_id}")
+
+
+@click.command()
+@admin_api_command
+def get_configuration(profile, tenant_id, client_id, client_secret):
+    tenant_id, client_id, client_secret = parse_credential_options(profile, tenant_id, client_id, client_secret)
+    do_get_admin(tenant_id, client_id, client_secret, "/v3/configuration", cacheable=True)
+
+
+@click.command()
+@admin_api_command
+def list_feature_rules(profile, tenant_id, client_id, client_secret):
+    tenant_id, client_id, client_secret = parse_credential_options(profile, tenant_id, client_id, client_secret)
+    do_get_admin(tenant_id, client_id, client_secret, "/v3/feature-rules", cacheable=True)
+
+
+@click.command()
+@admin_api_command
+def list_request_rules(profile, tenant_id, client_id, client_secret):
+    tenant_id, client_id, client_secret = parse_credential_options(profile, tenant_id, client_id, client_secret)
+    do_get_admin(tenant_id, client_id, client_secret, f"/v3/request-rules")
+
+
+@click.command()
+@admin_api_command
+def list_static(profile, tenant_id, client_id, client_secret):
+    tenant_id, client_id, client_secret = parse_credential_options(profile, tenant_id, client_id, client_secret)
+    do_get_admin(tenant_id, client_id, client_secret, "/v3/static")
+
+
+@click.command()
+@admin_api_command
+def list_webhooks(profile, tenant_id, client_id, client_secret):
+    tenant_id, client_id, client_secret = parse_credential_options(profile, tenant_id, client_id, client_secret)
+    do_get_admin(tenant_id, client_id, client_secret, "/v3/webhooks")
+
+
+@click.command()
+@admin_api_command
+def list_cache_configurations(profile, tenant_id, client_id, client_secret):
+    tenant_id, client_id, client_secret = parse_credential_options(profile, tenant_id, client_id, client_secret)
+    do_get_admin(tenant_id, client_id, client_secret, "/v3/cache-configurations")
+
+
+@click.command()
+@admin_api_command
+def list_unclaimed_gifts(profile, tenant_id, client_id, client_secret):
+    tenant_id, client_id, client_secret = parse_credential_options(profile, tenant_id, client_id, client_secret)
+    do_get_admin(tenant_id, client_id, client_secret, f"/v3/gift")
+
+
+@click.command(help="Clear cached catalog responses")
+@click.option('--tenant-id', envvar='TENANT_ID', help="Only clear responses cached for this Zephr tenant")
+def clear_cache(tenant_id):
+    removed = response_cache.clear(tenant_id)
+    print(f'cleared {removed} cached responses')
@@ -0,0 +1,141 @@
+import json
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import click
+
+from ..api_auth import admin_api_command, parse_credential_options
+from ..bulk import print_summary, read_rows, run_requests
+from ..client import ensure_pool_size
+from ..output import write_record
+from ..paging import result_list
+from ..throttle import RateLimiter
+
+REQUIRED_COLUMNS = ('user_id', 'product_id', 'entitlement_id')
+
+
+def timestamp(value):
+    # Grant times as comparable UTC datetimes, whether given as "2023-12-31 23:59:59", ISO 8601 with an offset or Z,
+    # or epoch seconds or milliseconds; times without an offset are taken as UTC, and anything else is left as is
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value / 1000 if value > 1e11 else value, timezone.utc)
+    text = str(value).strip()
+    try:
+        parsed = datetime.fromisoformat(text[:-1] + '+00:00' if text.endswith('Z') else text)
+    except ValueError:
+        return text
+    return parsed.replace(tzinfo=timezone.utc) if parsed.tzinfo is None else parsed.astimezone(timezone.utc)
+
+
+def grant_key(grant):
+    # Grants are compared on what they entitle and until when; grant ids and other server fields are ignored, and
+    # start times are compared by starts_match
+    return grant.get('product_id'), grant.get('entitlement_id'), timestamp(grant.get('endTime'))
+
+
+def starts_match(wanted, grant):
+    # A start time left blank in the file matches whatever start the server gave the grant
+    return not wanted.get('startTime') or timestamp(wanted['startTime']) == timestamp(grant.get('startTime'))
+
+
+def desired_grants(path):
+    # Rows of user_id, product_id, entitlement_id and optional start_time/end_time, grouped by user
+    desired = defaultdict(list)
+    for row_number, record in read_rows(path):
+        missing = [column for column in REQUIRED_COLUMNS if not record.get(column)]
+        if missing:
+            raise click.BadParameter(f'Row {row_number} has no {", ".join(missing)}', param_hint='FILE')
+        grant = {'entitlement_type': 'bundle', 'entitlement_id': record['entitlement_id'],
+                 'product_id': record['product_id']}
+        if record.get('start_time'):
+            grant['startTime'] = record['start_time']
+        if record.get('end_time'):
+            grant['endTime'] = record['end_time']
+        desired[record['user_id']].append(grant)
+    return desired
+
+
+def plan_grants(desired, current, delete_extra=True):
+    # Returns the create and delete actions that turn each user's current bundle grants into the desired ones, and
+    # the (user_id, grant) of extra grants that cannot be deleted because they were listed without a grant_id
+    actions, undeletable = [], []
+    for user_id, wanted in desired.items():
+        existing = {}
+        for grant in current.get(user_id, []):
+            if grant.get('entitlement_type', 'bundle') == 'bundle':
+                existing.setdefault(grant_key(grant), []).append(grant)
+        # Grants with a start time are matched first, so one without cannot take the grant they need
+        for grant in sorted(wanted, key=lambda g: not g.get('startTime')):
+            matches = existing.get(grant_key(grant), [])
+            match = next((i for i, found in enumerate(matches) if starts_match(grant, found)), None)
+            if match is not None:
+                matches.pop(match)
+            else:
+                actions.append({'action': 'create', 'user_id': user_id, 'grant': grant})
+        if delete_extra:
+            for grants in existing.values():
+                for grant in grants:
+                    if grant.get('grant_id'):
+                        actions.append({'action': 'delete', 'user_id': user_id, 'grant_id': grant['grant_id']})
+                    else:
+                        undeletable.append((user_id, grant))
+    return actions, undeletable
+
+
+@click.command(help='Make user grants match a desired-state file, creating and deleting only what differs')
+@admin_api_command
+@click.option('--dry-run', is_flag=True, help='Print the planned creates and deletes without making them')
+@click.option('--no-delete', is_flag=True, help='Only create missing grants; keep grants not in the file')
+@click.option('-w', '--workers', default=8, show_default=True, help='Concurrent requests')
+@click.option('--rate', default=20.0, show_default=True, help='Maximum write requests per second, 0 for no limit')
+@click.argument('file', type=click.Path(exists=True, dir_okay=False))
+def reconcile_grants(profile, tenant_id, client_id, client_secret, dry_run, no_delete, workers, rate, file):
+    tenant_id, client_id, client_secret = parse_credential_options(profile, tenant_id, client_id, client_secret)
+    ensure_pool_size(workers)
+    desired = desired_grants(file)
+
+    def fetch_grants(user_id):
+        return ("GET", tenant_id, client_id, client_secret, f'/v3/users/{user_id}/grants'), {}
+
+    current = {}
+    for user_id, r, error in run_requests(fetch_grants, desired, workers):
+        if error is not None:
+            raise error
+        # Zephr returns 404 rather than an empty list for a user with no grants
+        if r.status_code == 404:
+            current[user_id] = []
+        elif r.ok:
+            current[user_id] = result_list(r.json())
+        else:
+            raise click.ClickException(f'Failed to fetch grants for user {user_id}: {r}')
+    actions, undeletable = plan_grants(desired, current, delete_extra=not no_delete)
+    for user_id, grant in undeletable:
+        click.echo(click.style(f'Skipping a grant of user {user_id} without a grant_id: {json.dumps(grant)}',
+                               fg='yellow'), err=True)
+    creates = sum(1 for a in actions if a['action'] == 'create')
+    click.echo(click.style(f'{len(desired)} users: {creates} creates, {len(actions) - creates} deletes, '
+                           f'{len(actions)} write calls', fg='green'), err=True)
+    if dry_run:
+        for action in actions:
+            write_record(action)
+        return
+
+    def apply(action):
+        if action['action'] == 'create':
+            return ("POST", tenant_id, client_id, client_secret,
+                    f"/v3/users/{action['user_id']}/grants"), {'body': action['grant']}
+        return ("DELETE", tenant_id, client_id, client_secret,
+                f"/v3/users/{action['user_id']}/grants/{action['grant_id']}"), {}
+
+    started = time.monotonic()
+    succeeded = failed = 0
+    for action, r, error in run_requests(apply, actions, workers, limiter=RateLimiter(rate)):
+        ok = error is None and r.ok
+        succeeded += ok
+        failed += not ok
+        result = dict(action, status=r.status_code if error is None else repr(error))
+        write_record(result)
+    print_summary('applied', succeeded, failed, started, unit='calls')
@@ -0,0 +1,176 @@
+import click
+
+from click import UsageError
+
+from ..api_auth import public_api_command, parse_single_credential_option
+from ..bulk import read_rows, run_requests
+from ..client import do_get_public, do_post_public, do_delete_public
+from ..output import write_record
+
+
+@click.command(help='List rules (aka Features)')
+@public_api_command
+@click.option('-s', '--site-name', required=True, help='Name of the Zephr site')
+@click.option('-r', '--rule-type', required=True,
+              type=click.Choice(['html', 'json', 'sdk', 'browser'], case_sensitive=False))
+def list_rules(profile, tenant_id, site_name, rule_type):
+    tenant_id = parse_single_credential_option(profile, tenant_id)
+    query = f'ruleType={rule_type}' if rule_type else ''
+    do_get_public("/zephr/features", tenant_id, site_name, query)
+
+
+@click.command(help='List sessions for the authenticated user')
+@public_api_command
+@click.option('-s', '--site-name', required=True, help='Name of the Zephr site')
+@click.option('-j', '--jwt', required=True, help='JWT bearing foreign key user ID')
+@click.option('-z', '--session-id', help='ID of the requesting session')
+def list_sessions(profile, tenant_id, site_name, jwt, session_id):
+    tenant_id = parse_single_credential_option(profile=profile, tenant_id=tenant_id)
+    cookies = {}
+    if jwt is not None:
+        cookies['blaize_jwt'] = jwt
+    if session_id is not None:
+        cookies['blaize_session'] = session_id
+    do_get_public(path="/zephr/public/sessions/v1/sessions", tenant_id=tenant_id,
+                  site_name=site_name, cookies=cookies)
+
+
+@click.command(help='Delete session for the authenticated user')
+@public_api_command
+@click.option('-s', '--site-name', required=True, help='Name of the Zephr site')
+@click.option('-j', '--jwt', required=True, help='JWT bearing foreign key user ID')
+@click.option('-z', '--session-id', required=True, help='ID of the requesting session')
+def delete_session(profile, tenant_id, site_name, jwt, session_id):
+    tenant_id = parse_single_credential_option(profile=profile, tenant_id=tenant_id)
+    cookies = {}
+    if jwt is not None:
+        cookies['blaize_jwt'] = jwt
+    if session_id is not None:
+        cookies['blaize_session'] = session_id
+    do_delete_public(path=f"/zephr/public/sessions/v1/sessions/{session_id}",
+                     tenant_id=tenant_id, site_name=site_name, cookies=cookies)
+
+
+@click.command(help='Delete all other sessions except this one')
+@public_api_command
+@click.option('-s', '--site-name', required=True, help='Name of the Zephr site')
+@click.option('-j', '--jwt', required=True, help='JWT bearing foreign key user ID')
+@click.option('-z', '--session-id', required=True, help='ID of the requesting session')
+def delete_other_sessions(profile, tenant_id, site_name, jwt, session_id):
+    tenant_id = parse_single_credential_option(profile=profile, tenant_id=tenant_id)
+    cookies = {'blaize_jwt': jwt,
+               'blaize_session': session_id}
+    do_delete_public(path=f"/zephr/public/sessions/v1/sessions?except-current",
+                     tenant_id=tenant_id, site_name=site_name, cookies=cookies)
+
+
+@click.command(help='Invoke rule(s) and get decisions')
+@public_api_command
+@click.option('-s', '--site-name', required=True, help='Name of the Zephr site')
+@click.option('-j', '--jwt', help='Specify userID/product claims in a signed JWT')
+@click.option('-k', '--foreign-key', nargs=2, help='Specify user by foreign key e.g. "-k my_fk 1234"')
+@click.option('-i', '--ip', help='Specify IP address of caller: default = actual IP')
+@click.option('-u', '--user-agent', help='Specify the User-Agent header')
+@click.option('-z', '--session-id', help='ID of the requesting session')
+@click.option('-b', '--batch', 'batch_file', type=click.Path(exists=True, dir_okay=False),
+              help='CSV or NDJSON file of identities (jwt, session_id, ip, user_agent, foreign_key.<name>, '
+                   'features) to decide for each row, streamed out as NDJSON')
+@click.option('-w', '--workers', default=8, show_default=True, help='Concurrent decide requests with --batch')
+@click.argument('features', nargs=-1)
+def decide(profile, tenant_id, site_name, jwt, foreign_key, ip, user_agent, session_id, batch_file, workers,
+           features):
+    tenant_id = parse_single_credential_option(profile=profile, tenant_id=tenant_id)
+    if batch_file is not None:
+        decide_batch(tenant_id, site_name, batch_file, workers, features)
+        return
+    if not features:
+        raise UsageError('Please specify at least one feature, or a --batch file')
+
+    foreign_keys = dict([foreign_key]) if foreign_key is not None else None
+    body, cookies, headers = decide_request(features, jwt, foreign_keys, ip, user_agent, session_id)
+    do_post_public(path='/zephr/decide', body=body,
+                   cookies=cookies, tenant_id=tenant_id, site_name=site_name,
+                   extra_headers=headers)
+
+
+def decide_request(features, jwt=None, foreign_keys=None, ip=None, user_agent=None, session_id=None):
+    body = {'features': []}
+    cookies = {}
+    headers = {}
+    for f_id in features:
+        body['features'].append({'slug': f_id})
+
+    if ip:
+        body['ip'] = ip
+
+    if session_id:
+        body['session'] = session_id
+
+    if jwt:
+        body['jwt'] = jwt
+        # Also add to cookies as not certain that jwt in the body works correctly
+        cookies = {'blaize_jwt': jwt}
+
+    if user_agent:
+        # Some versions of Zephr documentation say you should do this which doesn't work
+        # body['UserAgent'] = user_agent
+        # This doesn't seem to work either
+        # headers.update({'User-Agent': user_agent})
+        # Only this, un-documented method seems to work
+        body['user_agent'] = user_agent
+
+    # N.B. If you specify a foreign key, no user session is created for this user.
+    # An anonymous session is created - this overrides the JWT
+    # JWT + session id is required to consume a user session.
+    if foreign_keys:
+        body['foreign_keys'] = foreign_keys
+
+    return body, cookies, headers
+
+
+def decide_row_request(record, default_features=()):
+    # Features may come from the row (list, or space separated string in CSV) or apply to every row
+    features = record.get('features') or list(default_features)
+    if isinstance(features, str):
+        features = features.split()
+    # Foreign keys from an NDJSON "foreign_keys" object, or CSV columns named foreign_key.<name>
+    foreign_keys = dict(record.get('foreign_keys') or {})
+    foreign_keys.update({column.split('.', 1)[1]: value for column, value in record.items()
+                         if column.startswith('foreign_key.') and value})
+    return decide_request(features, record.get('jwt'), foreign_keys, record.get('ip'), record.get('user_agent'),
+                          record.get('session_id'))
+
+
+def decide_batch(tenant_id, site_name, batch_file, workers, features):
+    def decide_row(row):
+        row_number, record = row
+        body, cookies, headers = decide_row_request(record, features)
+        return ("POST", '/zephr/decide', tenant_id, site_name), {'body': body, 'cookies': cookies,
+                                                                'extra_headers': headers}
+
+    for (row_number, record), r, error in run_requests(decide_row, read_rows(batch_file), workers, public=True):
+        result = {'row': row_number}
+        if error is not None:
+            result['error'] = repr(error)
+        elif r.ok:
+            result.update({'status': r.status_code, 'decisions': r.json()})
+        else:
+            result.update({'status': r.status_code, 'error': r.text})
+        write_record(result)
+
+
+@click.command(help='Register a new user')
+@public_api_command
+@click.option('-s', '--site-name', required=True, help='Name of the Zephr site')
+@click.option('-e', '--email', required=True, help='Email of the user to register')
+@click.option('-k', '--foreign-key', nargs=2, help='Foreign key to your user platform e.g. "-k my_fk 1234"')
+def register_user(profile, tenant_id, site_name, email, foreign_key):
+    tenant_id = parse_single_credential_option(profile, tenant_id)
+    body = {'identifiers': {'email_address': email}}
+    cookies = {}
+
+    if foreign_key is not None:
+        key, value = foreign_key
+        body['foreign_keys'] = {key: value}
+
+    do_post_public('/blaize/register', body, cookies, tenant_id, site_name)
@@ -0,0 +1,142 @@
+import fnmatch
+import re
+import time
+from contextlib import closing
+from datetime import datetime
+
+import click
+
+from ..api_auth import admin_api_command, parse_credential_options
+from ..bulk import batched, print_summary, read_rows, run_requests
+from ..client import ensure_pool_size
+from ..output import write_record
+from ..paging import iter_admin_results, result_list
+from ..throttle import DeadlineExceeded
+
+# Users whose sessions are listed before the matching sessions are deleted, so memory stays flat on tenant-wide
+# purges while both the listing and the deletes run with full concurrency
+PURGE_CHUNK = 1000
+
+_AGE = re.compile(r'^(\d+(?:\.\d+)?)([smhdw])$')
+_AGE_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+
+def parse_age(ctx, param, value):
+    # --older-than as a duration, e.g. 90m, 12h or 7d, or an ISO 8601 date/time; returns an epoch cutoff
+    if value is None:
+        return None
+    match = _AGE.match(value.strip().lower())
+    if match:
+        return time.time() - float(match[1]) * _AGE_UNITS[match[2]]
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise click.BadParameter('Give a duration such as 12h or 7d, or a date such as 2024-01-31')
+
+
+def session_created(session):
+    # Epoch seconds the session was created, from epoch milliseconds or an ISO 8601 timestamp; None if unknown
+    value = session.get('created_at') or session.get('createdAt')
+    if isinstance(value, (int, float)) or isinstance(value, str) and value.isdigit():
+        return int(value) / 1000
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+    except (AttributeError, ValueError):
+        return None
+
+
+def session_matches(session, created_before=None, user_agents=()):
+    # Sessions of unknown age are kept when filtering by age, rather than purged by mistake
+    if created_before is not None:
+        created = session_created(session)
+        if created is None or created >= created_before:
+            return False
+    if user_agents:
+        agent = (session.get('user_agent') or session.get('userAgent') or '').lower()
+        if not any(fnmatch.fnmatchcase(agent, pattern.lower()) for pattern in user_agents):
+            return False
+    return True
+
+
+@click.command(help='Delete the sessions of many users: from a file, a search, the local snapshot or the whole tenant')
+@admin_api_command
+@click.option('-u', '--user-id', 'user_ids', multiple=True, help='ID of a user whose sessions to purge')
+@click.option('-f', '--file', type=click.Path(exists=True, dir_okay=False),
+              help='CSV or NDJSON file with a user_id column')
+@click.option('-s', '--search', help='Purge the sessions of users matching this search term')
+@click.option('--all-users', is_flag=True, help='Purge the sessions of every user in the tenant')
+@click.option('--snapshot', 'from_snapshot', type=click.Path(exists=True, dir_okay=False),
+              help='Purge the sessions of every user in this local snapshot, without listing users from the API')
+@click.option('--older-than', callback=parse_age, help='Only sessions created before this, e.g. 7d or 2024-01-31')
+@click.option('--user-agent', 'user_agents', multiple=True,
+              help='Only sessions whose user agent matches this pattern, e.g. "*Android*"; may be repeated')
+@click.option('--dry-run', is_flag=True, help='List and count the sessions that would be deleted')
+@click.option('-w', '--workers', default=8, show_default=True, help='Concurrent requests')
+def purge_sessions(profile, tenant_id, client_id, client_secret, user_ids, file, search, all_users, from_snapshot,
+                   older_than, user_agents, dry_run, workers):
+    tenant_id, client_id, client_secret = parse_credential_options(profile, tenant_id, client_id, client_secret)
+    if sum(1 for source in (user_ids, file, search, all_users, from_snapshot) if source) != 1:
+        raise click.UsageError('Give exactly one of --user-id, --file, --search, --all-users or --snapshot')
+    ensure_pool_size(workers)
+
+    if user_ids:
+        users = iter(user_ids)
+    elif file:
+        users = (record['user_id'] for row_number, record in read_rows(file) if record.get('user_id'))
+    elif from_snapshot:
+        from ..snapshot import connect
+        with closing(connect(from_snapshot)) as conn:
+            users = iter([user_id for user_id, in conn.execute('SELECT user_id FROM users')])
+    else:
+        query = f'search=*{search}*' if search else ''
+        users = (user['user_id'] for user in iter_admin_results(tenant_id, client_id, client_secret, '/v3/users',
+                                                                query=query, results_per_page=100,
+                                                                prefetch=workers))
+
+    def list_sessions(user_id):
+        return ("GET", tenant_id, client_id, client_secret, f'/v4/users/{user_id}/sessions'), {}
+
+    def delete_session(session):
+        return ("DELETE", tenant_id, client_id, client_secret, f"/v3/sessions/{session['session_id']}"), {}
+
+    started = time.monotonic()
+    scanned = matched = deleted = failed = unsent = 0
+    for chunk in batched(users, PURGE_CHUNK):
+        purge = []
+        for user_id, r, error in run_requests(list_sessions, chunk, workers):
+            scanned += 1
+            if isinstance(error, DeadlineExceeded):
+                unsent += 1
+                continue
+            # A user with no sessions may be answered with 404 rather than an empty list
+            if error is not None or not r.ok and r.status_code != 404:
+                failed += 1
+                write_record({'user_id': user_id, 'error': repr(error) if error else f'{r.status_code} {r.text}'})
+                continue
+            for session in result_list(r.json()) if r.ok else []:
+                session_id = session.get('session_id') or session.get('id')
+                if session_id and session_matches(session, older_than, user_agents):
+                    purge.append(dict(session, session_id=session_id, user_id=user_id))
+        matched += len(purge)
+        if dry_run:
+            for session in purge:
+                write_record({'action': 'delete', 'user_id': session['user_id'],
+                              'session_id': session['session_id']})
+            continue
+        for session, r, error in run_requests(delete_session, purge, workers):
+            if isinstance(error, DeadlineExceeded):
+                unsent += 1
+                continue
+            # Already gone, e.g. expired or logged out since it was listed
+            ok = error is None and (r.ok or r.status_code == 404)
+            deleted += ok
+            failed += not ok
+            write_record({'user_id': session['user_id'], 'session_id': session['session_id'],
+                          'status': r.status_code if error is None else repr(error)})
+
+    click.echo(click.style(f'{scanned} users scanned, {matched} sessions matched', fg='green'), err=True)
+    if unsent:
+        click.echo(click.style(f'Deadline reached: {unsent} requests not sent; run again to finish', fg='yellow'),
+                   err=True)
+    if not dry_run:
+        print_summary('deleted', deleted, failed, started, unit='sessions')
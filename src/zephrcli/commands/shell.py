@@ -0,0 +1,109 @@
+import os
+import shlex
+
+import click
+
+HISTORY_FILE = os.path.join(os.path.expanduser('~'), '.zephr_history')
+
+SHELL_HELP = '''Run any zephr command without the "zephr" prefix, e.g. "admin list-users".
+  use <profile>   use a stored profile for every admin and public command
+  exit            leave the shell (or Ctrl-D)'''
+
+
+@click.command(help='Interactive shell that keeps credentials and connections warm between commands')
+@click.option('--profile', help='Profile used for every admin and public command')
+@click.pass_context
+def shell(ctx, profile):
+    root = ctx.find_root()
+    state = {'profile': profile}
+    readline = _setup_readline(root)
+    click.echo('zephr shell - type "help" for help, "exit" to leave', err=True)
+
+    while True:
+        try:
+            line = input(f'zephr{":" + state["profile"] if state["profile"] else ""}> ')
+        except EOFError:
+            click.echo(err=True)
+            break
+        except KeyboardInterrupt:
+            click.echo(err=True)
+            continue
+        try:
+            args = shlex.split(line)
+        except ValueError as e:
+            click.echo(f'Error: {e}', err=True)
+            continue
+        if not args:
+            continue
+        if args[0] in ('exit', 'quit'):
+            break
+        if args[0] == 'help':
+            click.echo(SHELL_HELP)
+            continue
+        if args[0] == 'use':
+            state['profile'] = args[1] if len(args) > 1 else None
+            continue
+        run_command(root, args, state['profile'])
+
+    if readline is not None:
+        readline.write_history_file(HISTORY_FILE)
+
+
+def run_command(root, args, profile=None):
+    # Root options given to `zephr shell` carry over to every command as defaults, and the process-wide client
+    # and credential memo keep connections and the resolved profile warm between commands
+    default_map = {name: value for name, value in root.params.items() if value is not None}
+    if profile is not None:
+        for group_name in ('admin', 'public'):
+            group = root.command.get_command(root, group_name)
+            default_map[group_name] = {name: {'profile': profile} for name in group.list_commands(root)}
+    try:
+        root.command.main(args, prog_name='zephr', standalone_mode=False, default_map=default_map)
+    except click.exceptions.Exit:
+        pass
+    except click.exceptions.Abort:
+        click.echo('Aborted!', err=True)
+    except click.ClickException as e:
+        e.show()
+    except Exception as e:
+        click.echo(f'Error: {e!r}', err=True)
+
+
+def _setup_readline(root):
+    try:
+        import readline
+    except ImportError:
+        return None
+    if os.path.exists(HISTORY_FILE):
+        readline.read_history_file(HISTORY_FILE)
+    readline.set_history_length(1000)
+    readline.set_completer_delims(' \t\n')
+    readline.set_completer(_completer(root))
+    readline.parse_and_bind('bind ^I rl_complete' if 'libedit' in (readline.__doc__ or '') else 'tab: complete')
+    return readline
+
+
+def _completer(root):
+    def candidates(words):
+        command = root.command
+        for word in words:
+            if not isinstance(command, click.Group):
+                break
+            command = command.get_command(root, word)
+            if command is None:
+                return []
+        if isinstance(command, click.Group):
+            names = command.list_commands(root)
+            return names + (['help', 'use', 'exit'] if command is root.command else [])
+        return [opt for param in command.params for opt in param.opts if opt.startswith('--')]
+
+    def complete(text, state):
+        import readline
+        try:
+            words = shlex.split(readline.get_line_buffer()[:readline.get_begidx()])
+        except ValueError:
+            return None
+        matches = [c + ' ' for c in candidates(words) if c.startswith(text)]
+        return matches[state] if state < len(matches) else None
+
+    return complete
@@ -0,0 +1,81 @@
+import os
+from contextlib import closing
+
+import click
+
+from ..api_auth import admin_api_command, parse_credential_options, public_api_command, parse_single_credential_option
+from ..client import ensure_pool_size
+from ..fk_index import lookup, refresh_index, resolve_remote
+from ..output import write_record
+from ..snapshot import connect, query, snapshot_path, take_snapshot
+
+
+@click.command(help='Crawl users, grants, accounts, companies, products and bundles into a local SQLite file')
+@admin_api_command
+@click.option('-w', '--workers', default=8, show_default=True, help='Concurrent requests')
+@click.option('--full', is_flag=True, help='Re-fetch every user rather than only those changed since last time')
+@click.option('--sessions', is_flag=True, help='Also crawl the sessions of each new or changed user, a request each')
+@click.option('--db', type=click.Path(dir_okay=False),
+              help='Snapshot file [default: ~/.cache/zephr/snapshot-<tenant>.sqlite3]')
+def snapshot(profile, tenant_id, client_id, client_secret, workers, full, sessions, db):
+    tenant_id, client_id, client_secret = parse_credential_options(profile, tenant_id, client_id, client_secret)
+    ensure_pool_size(workers)
+    path = db or snapshot_path(tenant_id)
+    stats = take_snapshot(path, tenant_id, client_id, client_secret, workers=workers, full=full, sessions=sessions)
+    click.echo(click.style(f"{stats['users']} users, {stats['changed']} refreshed, {stats['deleted']} removed in "
+                           f"{stats['elapsed']:.1f}s ({stats['requests']} requests) -> {path}", fg='green'), err=True)
+
+
+@click.command(help='Run a SQL query against a local snapshot, printing rows as NDJSON')
+@public_api_command
+@click.option('--db', type=click.Path(exists=True, dir_okay=False), help='Snapshot file instead of the tenant default')
+@click.argument('sql')
+def query_snapshot(profile, tenant_id, db, sql):
+    path = db or snapshot_path(parse_single_credential_option(profile, tenant_id))
+    if db is None and not os.path.exists(path):
+        raise click.ClickException(f'No snapshot at {path}; run "zephr admin snapshot" first')
+    for row in query(path, sql):
+        write_record(row)
+
+
+@click.command(help='Resolve foreign key values to user IDs from the local index, falling back to the API')
+@admin_api_command
+@click.option('-f', '--file', type=click.File(), help='File of values, one per line ("-" for stdin)')
+@click.option('--refresh-index', 'refresh', is_flag=True, help='Update the index from a full user listing first')
+@click.option('--offline', is_flag=True, help='Only use the index; never query the API for missing values')
+@click.option('-w', '--workers', default=8, show_default=True, help='Concurrent requests')
+@click.option('--db', type=click.Path(dir_okay=False), help='Snapshot file holding the index')
+@click.argument('foreign_key')
+@click.argument('values', nargs=-1)
+def resolve_fk(profile, tenant_id, client_id, client_secret, file, refresh, offline, workers, db, foreign_key,
+               values):
+    tenant_id, client_id, client_secret = parse_credential_options(profile, tenant_id, client_id, client_secret)
+    ensure_pool_size(workers)
+    values = list(values) + ([line.strip() for line in file if line.strip()] if file else [])
+    if not values:
+        raise click.UsageError('Give foreign key values as arguments or with --file')
+
+    with closing(connect(db or snapshot_path(tenant_id))) as conn:
+        if refresh:
+            listed, changed, deleted = refresh_index(conn, tenant_id, client_id, client_secret, prefetch=workers)
+            click.echo(click.style(f'index: {len(listed)} users, {len(changed)} updated, {len(deleted)} removed',
+                                   fg='green'), err=True)
+        found = lookup(conn, foreign_key, values)
+        for value, user_id in found.items():
+            write_record({'value': value, 'user_id': user_id})
+        missing = [value for value in dict.fromkeys(values) if value not in found]
+        resolved = 0
+        if offline:
+            for value in missing:
+                write_record({'value': value, 'user_id': None})
+        else:
+            for value, user_id, error in resolve_remote(conn, tenant_id, client_id, client_secret, foreign_key,
+                                                        missing, workers=workers):
+                result = {'value': value, 'user_id': user_id}
+                if error is not None:
+                    result['error'] = str(error)
+                resolved += user_id is not None
+                write_record(result)
+    click.echo(click.style(f'{len(found)} from index, {resolved} from API, {len(missing) - resolved} unresolved',
+                           fg='green'),
+               err=True)
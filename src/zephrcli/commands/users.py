@@ -0,0 +1,455 @@
+import json
+import time
+from collections import deque
+import click
+
+from ..api_auth import admin_api_command, parse_credential_options
+from ..bulk import Checkpoint, batched, print_summary, read_rows, run_requests
+from ..client import do_get_admin, do_post_admin, do_delete_admin, do_admin_graphql
+from ..output import write_record
+from ..paging import iter_admin_results
+from ..throttle import DeadlineExceeded
+
+
+# # TODO - needs testing - need to validate a request that requires a valid session id
+# # TODO - find out why it always returns 200 even if the session has been deleted
+# @click.command()
+# @click.argument('admin-session-id')
+# def logout(admin_session_id):
+#     path = "/v3/admin/logout"
+#     body = {}
+#     r = do_post(path=path, body=body, extra_headers={"blaize-admin-session": f"{admin_session_id}"})
+#     if r.ok:
+#         print(json.dumps(r.json()))
+#     else:
+#         print(r)
+#
+
+# TODO - needs some testing - what is it useful for?
+# @click.command()
+# @click.argument('email')
+# @click.argument('password')
+# def get_session(email, password):
+#     body = {
+#         "identifiers": {
+#             "email_address": f"{email}"
+#         },
+#         "validators": {
+#             "password": f"{password}"
+#         }
+#     }
+#     path = "/v3/admin/login"
+#     r = do_post(path=path, body=body)
+#     if r.ok:
+#         print(json.dumps(r.json(), indent=2))
+#         # print(json.dumps(dict(r.headers), indent=2))
+#         print(f'blaize_admin_session: {r.cookies["blaize_admin_session"]}')
+#     else:
+#         print(r)
+
+# TODO - needs some testing - what is it useful for?
+# @click.command()
+# @click.argument('admin-session-id')
+# def get_admin_user(admin_session_id):
+#     do_get(f"/v3/admin/sessions/{admin_session_id}")
+
+@click.command(help='Create a user')
+@admin_api_command
+@click.option('-e', '--email', required=True, help='Email address of the user, used as identifier')
+@click.option('-f', '--first-name', help='First name of the user')
+@click.option('-l', '--last-name', help='Last name of the user')
+@click.option('-k', '--foreign-key', nargs=2, help='Foreign key to external user system e.g. "-k myfk 1234"')
+def create_user(profile, tenant_id, client_id, client_secret, email, first_name, last_name, foreign_key):
+    tenant_id, client_id, client_secret = parse_credential_options(profile, tenant_id, client_id, client_secret)
+    cookies = {}
+    foreign_keys = dict([foreign_key]) if foreign_key is not None else None
+    body = user_body(email, first_name, last_name, foreign_keys)
+    do_post_admin("/v3/users", body, cookies, tenant_id, client_id, client_secret)
+
+
+def user_body(email, first_name=None, last_name=None, foreign_keys=None):
+    body = {
+        'identifiers': {
+            'email_address': email
+        },
+        'attributes': {}
+    }
+
+    if first_name:
+        # Zephr documentation incorrectly shows attribute name as 'first_name'
+        body['attributes'].update({'firstname': first_name})
+    if last_name:
+        # Zephr documentation incorrectly shows attribute name as 'surname'
+        body['attributes'].update({'lastname': last_name})
+
+    if foreign_keys:
+        body['foreign_keys'] = foreign_keys
+
+    return body
+
+
+@click.command(help='Import users from a CSV or NDJSON file, resuming from a checkpoint if present')
+@admin_api_command
+@click.option('--email-column', default='email', show_default=True, help='Column holding the email address')
+@click.option('--first-name-column', default='first_name', show_default=True, help='Column holding the first name')
+@click.option('--last-name-column', default='last_name', show_default=True, help='Column holding the last name')
+@click.option('-k', '--foreign-key', 'foreign_key_columns', nargs=2, multiple=True,
+              help='Foreign key name and the column holding its value e.g. "-k myfk subscriber_id"')
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'ndjson'], case_sensitive=False),
+              help='Input format: default from file extension')
+@click.option('-w', '--workers', default=8, show_default=True, help='Concurrent create requests')
+@click.option('--checkpoint', help='Checkpoint file: default <file>.checkpoint')
+@click.option('--rejects', help='File collecting failed rows as NDJSON: default <file>.rejects.ndjson')
+@click.option('--restart', is_flag=True, help='Ignore an existing checkpoint and import from the first row')
+@click.argument('file', type=click.Path(exists=True, dir_okay=False))
+def import_users(profile, tenant_id, client_id, client_secret, email_column, first_name_column, last_name_column,
+                 foreign_key_columns, file_format, workers, checkpoint, rejects, restart, file):
+    tenant_id, client_id, client_secret = parse_credential_options(profile, tenant_id, client_id, client_secret)
+    progress = Checkpoint(checkpoint or f'{file}.checkpoint')
+    if restart:
+        progress.remove()
+        progress = Checkpoint(progress.path)
+    if progress.done_through:
+        click.echo(click.style(f'Resuming after row {progress.done_through}', fg='green'), err=True)
+
+    def create(row):
+        row_number, record = row
+        foreign_keys = {key: record[column] for key, column in foreign_key_columns if record.get(column)}
+        body = user_body(record[email_column], record.get(first_name_column), record.get(last_name_column),
+                         foreign_keys)
+        return ("POST", tenant_id, client_id, client_secret, "/v3/users"), {'body': body}
+
+    started = time.monotonic()
+    succeeded = failed = unsent = 0
+    rows = read_rows(file, file_format, skip_through=progress.done_through)
+    rejects = rejects or f'{file}.rejects.ndjson'
+    # Rejects from the interrupted run are kept when resuming; otherwise they are from an earlier, finished run
+    with open(rejects, 'a' if progress.done_through else 'w') as reject_file:
+        for (row_number, record), r, error in run_requests(create, rows, workers):
+            # Rows not sent before the --deadline stay unmarked, so the checkpoint resumes from them
+            if isinstance(error, DeadlineExceeded):
+                unsent += 1
+                continue
+            if error is None and r.ok:
+                succeeded += 1
+            else:
+                failed += 1
+                reason = repr(error) if error is not None else f'{r.status_code} {r.text}'
+                reject_file.write(json.dumps({'row': row_number, 'error': reason, 'record': record}) + '\n')
+            progress.mark(row_number)
+    # A run that finished every row leaves no checkpoint, so importing the file again starts from the first row
+    if unsent or failed:
+        progress.save()
+    else:
+        progress.remove()
+    if unsent:
+        click.echo(click.style(f'Deadline reached: {unsent} rows not sent; run again to resume', fg='yellow'),
+                   err=True)
+    # Failed rows still advance the checkpoint: retrying them on a re-run would mean re-sending every row created
+    # after the first of them
+    if failed:
+        click.echo(click.style(f'{failed} failed rows are not retried by running again; they are in {rejects}',
+                               fg='yellow'), err=True)
+    print_summary('imported', succeeded, failed, started)
+
+
+@click.command(help='List users, or select by foreign key query')
+@admin_api_command
+@click.option('-k', '--foreign-key', nargs=2, help='Query by foreign key e.g. "-f my_fk 1234"')
+@click.option('-r', '--results-per-page', help='Number of results per page response', default=50)
+@click.option('-p', '--page', help='Number of page', default=1)
+@click.option('-s', '--search', help='Search term')
+@click.option('-a', '--all', 'all_pages', is_flag=True, help='Stream every page of users as NDJSON')
+@click.option('--prefetch', default=4, show_default=True, help='Pages fetched ahead concurrently with --all')
+def list_users(profile, tenant_id, client_id, client_secret, foreign_key, results_per_page, page, search,
+               all_pages, prefetch):
+    tenant_id, client_id, client_secret = parse_credential_options(profile, tenant_id, client_id, client_secret)
+
+    if all_pages:
+        query = f'search=*{search}*' if search is not None else ''
+        if foreign_key is not None:
+            key, value = foreign_key
+            query = f'foreign_key.{key}={value}'
+        users = iter_admin_results(tenant_id, client_id, client_secret, '/v3/users', query=query,
+                                   results_per_page=int(results_per_page), prefetch=prefetch)
+        for user in users:
+            write_record(user)
+        return
+
+    query = f'rpp={results_per_page}&page={page}'
+
+    if search is not None:
+        query += f'&search=*{search}*'
+
+    # query = 'rpp=2'
+    if foreign_key is not None:
+        key, value = foreign_key
+        query = f'foreign_key.{key}={value}'
+
+    do_get_admin(tenant_id, client_id, client_secret, '/v3/users',
+                 query=query)
+
+
+@click.command()
+@admin_api_command
+@click.argument('user-id')
+def get_user(profile, tenant_id, client_id, client_secret, user_id):
+    tenant_id, client_id, client_secret = parse_credential_options(profile, tenant_id, client_id, client_secret)
+    do_get_admin(tenant_id, client_id, client_secret, f"/v3/users/{user_id}")
+
+
+@click.command(help='Delete a user')
+@admin_api_command
+@click.option('-u', '--user-id', required=True, help='The ID of the user')
+def delete_user(profile, tenant_id, client_id, client_secret, user_id):
+    tenant_id, client_id, client_secret = parse_credential_options(profile, tenant_id, client_id, client_secret)
+    do_delete_admin(tenant_id, client_id, client_secret, f"/v3/users/{user_id}")
+
+
+@click.command()
+@admin_api_command
+def list_schema_users(profile, tenant_id, client_id, client_secret):
+    tenant_id, client_id, client_secret = parse_credential_options(profile, tenant_id, client_id, client_secret)
+    do_get_admin(tenant_id, client_id, client_secret, f"/v3/schema/users")
+
+
+@click.command()
+@admin_api_command
+@click.option('-j', '--jwt')
+@click.option('-z', '--session-id', help='ID of the requesting session')
+@click.argument('email')
+def create_session(profile, tenant_id, client_id, client_secret, jwt, email):
+    tenant_id, client_id, client_secret = parse_credential_options(profile, tenant_id, client_id, client_secret)
+    body = {
+        "identifiers": {
+            "email_address": f"{email}"
+        }
+    }
+    cookies = {}
+
+    if jwt is not None:
+        # body['jwt'] = jwt
+        # Also add to cookies as not certain that jwt in the body works correctly
+        cookies = {'blaize_jwt': jwt}
+
+    do_post_admin("/v3/sessions", body, cookies, tenant_id, client_id, client_secret)
+
+
+@click.command(help="List sessions for the given user")
+@admin_api_command
+# @click.option('-j', '--jwt')
+# @click.option('-z', '--session-id', help='ID of the requesting session')
+@click.option('-u', '--user-id', required=True, help='Unique ID of the user')
+def list_user_sessions(profile, tenant_id, client_id, client_secret, user_id):
+    tenant_id, client_id, client_secret = parse_credential_options(profile, tenant_id, client_id, client_secret)
+
+    # https://{tenantId}.api.zephr.com/v3/users/{user_id}/sessions
+    do_get_admin(tenant_id=tenant_id, client_id=client_id, client_secret=client_secret,
+                 path=f'/v4/users/{user_id}/sessions')
+
+
+# This operation was not available through the documented API, so we use the admin console graphql.
+# This may not be supported in the future, so this approach will need to be reviewed
+@click.command()
+@admin_api_command
+@click.option('-u', '--user-id', required=True, help='The ID of the user')
+@click.option('-l', '--session-limit', required=True, help='User concurrent session limit')
+def set_user_session_limit(profile, tenant_id, client_id, client_secret, user_id, session_limit):
+    tenant_id, client_id, client_secret = parse_credential_options(profile, tenant_id, client_id, client_secret)
+
+    body = {
+        "operationName": "updateUserConcurrentSessionLimit",
+        "variables": {
+            "userId": user_id,
+            "limit": session_limit
+        },
+        "query": "mutation updateUserConcurrentSessionLimit($userId: ID!, $limit: Int) {"
+                 "    updateUserConcurrentSessionLimit(userId: $userId, limit: $limit) {"
+                 "      status"
+                 "      message"
+                 "      __typename"
+                 "    }"
+                 "}"
+    }
+
+    do_admin_graphql(body=body, cookies={}, client_id=client_id, client_secret=client_secret)
+
+
+def session_limit_batch_body(batch):
+    # One document with an aliased updateUserConcurrentSessionLimit per (row_number, user_id, limit) of the batch.
+    # Aliases and variables are named after the row number, so results map straight back to input rows.
+    declarations, fields, variables = [], [], {}
+    for row_number, user_id, limit in batch:
+        declarations.append(f'$userId{row_number}: ID!, $limit{row_number}: Int')
+        fields.append(f'r{row_number}: updateUserConcurrentSessionLimit(userId: $userId{row_number}, '
+                      f'limit: $limit{row_number}) {{ status message __typename }}')
+        variables[f'userId{row_number}'] = user_id
+        variables[f'limit{row_number}'] = limit
+    return {
+        "operationName": "updateUserConcurrentSessionLimits",
+        "variables": variables,
+        "query": f"mutation updateUserConcurrentSessionLimits({', '.join(declarations)}) {{ {' '.join(fields)} }}"
+    }
+
+
+def session_limit_results(batch, r, error):
+    # Yields (row, result, message) for each row of a batch. A row succeeded when the request did and graphql
+    # returned a result for its alias without an error; the status the result holds is passed on as is, since its
+    # values are not documented. Rows without a result, because the request failed or graphql reported an error for
+    # their alias or the whole document, get a result of None and the reason as the message.
+    if error is not None or not r.ok:
+        reason = repr(error) if error is not None else f'{r.status_code} {r.text}'
+        for row in batch:
+            yield row, None, reason
+        return
+    payload = r.json()
+    data = payload.get('data') or {}
+    alias_errors, document_error = {}, None
+    for graphql_error in payload.get('errors') or []:
+        if graphql_error.get('path'):
+            alias_errors[graphql_error['path'][0]] = graphql_error.get('message')
+        else:
+            document_error = document_error or graphql_error.get('message')
+    for row in batch:
+        alias = f'r{row[0]}'
+        result = data.get(alias)
+        if alias in alias_errors or not result:
+            yield row, None, alias_errors.get(alias) or document_error or 'No result'
+        else:
+            yield row, result, result.get('message')
+
+
+@click.command(help='Set the concurrent session limit of many users from a CSV or NDJSON file, '
+                    'batching the mutations')
+@admin_api_command
+@click.option('--user-id-column', default='user_id', show_default=True, help='Column holding the user ID')
+@click.option('--limit-column', default='limit', show_default=True, help='Column holding the session limit')
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'ndjson'], case_sensitive=False),
+              help='Input format: default from file extension')
+@click.option('-b', '--batch-size', default=100, show_default=True, type=click.IntRange(min=1),
+              help='Mutations sent in each graphql request')
+@click.option('--retries', default=1, show_default=True, type=click.IntRange(min=0),
+              help='Times a failed row is retried, in a request of its own')
+@click.option('-w', '--workers', default=4, show_default=True, help='Concurrent graphql requests')
+@click.argument('file', type=click.Path(exists=True, dir_okay=False))
+def set_user_session_limits(profile, tenant_id, client_id, client_secret, user_id_column, limit_column, file_format,
+                            batch_size, retries, workers, file):
+    tenant_id, client_id, client_secret = parse_credential_options(profile, tenant_id, client_id, client_secret)
+    counts = {'updated': 0, 'failed': 0, 'unsent': 0}
+    # With --concurrency the rows are read on the asyncio engine's thread, so invalid ones are handed to this
+    # thread to be counted and written
+    invalid = deque()
+
+    def parse(rows):
+        for row_number, record in rows:
+            user_id, limit = record.get(user_id_column), record.get(limit_column)
+            try:
+                limit = int(limit)
+            except (TypeError, ValueError):
+                user_id = None
+            if not user_id:
+                invalid.append({'row': row_number, 'user_id': record.get(user_id_column), 'limit': limit,
+                                'status': None,
+                                'message': f'Needs a {user_id_column} and a whole number {limit_column}'})
+                continue
+            yield row_number, user_id, limit
+
+    def write_invalid():
+        while invalid:
+            counts['failed'] += 1
+            write_record(invalid.popleft())
+
+    def mutate(batch):
+        return (session_limit_batch_body(batch), {}, client_id, client_secret), {}
+
+    started = time.monotonic()
+    batches = batched(parse(read_rows(file, file_format)), batch_size)
+    attempt = 0
+    while True:
+        retry = []
+        for batch, r, error in run_requests(mutate, batches, workers, graphql=True):
+            write_invalid()
+            if isinstance(error, DeadlineExceeded):
+                counts['unsent'] += len(batch)
+                continue
+            for row, result, message in session_limit_results(batch, r, error):
+                ok = result is not None
+                # A failed row is retried alone, so one bad user ID or limit cannot fail the rows batched with it
+                if not ok and attempt < retries:
+                    retry.append(row)
+                    continue
+                counts['updated' if ok else 'failed'] += 1
+                row_number, user_id, limit = row
+                write_record({'row': row_number, 'user_id': user_id, 'limit': limit,
+                              'status': result.get('status') if ok else None, 'message': message})
+        write_invalid()
+        if not retry:
+            break
+        attempt += 1
+        batches = ([row] for row in retry)
+
+    if counts['unsent']:
+        click.echo(click.style(f"Deadline reached: {counts['unsent']} rows not sent", fg='yellow'), err=True)
+    print_summary('updated', counts['updated'], counts['failed'], started)
+
+
+@click.command()
+@admin_api_command
+@click.option('-u', '--user-id', required=True, help='The ID of the user')
+def get_user_grants(profile, tenant_id, client_id, client_secret, user_id):
+    tenant_id, client_id, client_secret = parse_credential_options(profile, tenant_id, client_id, client_secret)
+    do_get_admin(tenant_id, client_id, client_secret, f'/v3/users/{user_id}/grants')
+
+
+@click.command(help='Get a user grant')
+@admin_api_command
+@click.option('-u', '--user-id', required=True, help='The ID of the user')
+@click.option('-g', '--grant-id', required=True, help='The ID of the grant')
+def get_user_grant(profile, tenant_id, client_id, client_secret, user_id, grant_id):
+    tenant_id, client_id, client_secret = parse_credential_options(profile, tenant_id, client_id, client_secret)
+    do_get_admin(tenant_id, client_id, client_secret, f'/v3/users/{user_id}/grants/{grant_id}')
+
+
+@click.command(help="Grant a product to a user")
+@admin_api_command
+@click.option('-u', '--user-id', required=True, help='The ID of the user')
+@click.option('-p', '--product-id', required=True, help='The ID of the product')
+# If it's a product share, not sure we need entitlement_id - i.e. we could get the product to get its bundle entitlement ID instead
+@click.option('-e', '--entitlement-id', required=True, help='The ID of the associated bundle entitlement')
+@click.option('-b', '--start-time', help='When grant will begin - e.g. 2023-12-31 23:59:59 - default=now')
+@click.option('-f', '--end-time', help='When grant will finish e.g. 2024-12-31 23:59:59 - default=indefinite')
+def create_user_grant(profile, tenant_id, client_id, client_secret, user_id, product_id, entitlement_id,
+                      start_time, end_time):
+    tenant_id, client_id, client_secret = parse_credential_options(profile, tenant_id, client_id, client_secret)
+    body = {
+        "entitlement_type": "bundle",
+        "entitlement_id": f"{entitlement_id}",
+        "product_id": f"{product_id}"
+    }
+    if start_time is not None:
+        body['startTime'] = start_time
+
+    if end_time is not None:
+        body['endTime'] = end_time
+
+    cookies = {}
+
+    do_post_admin(f'/v3/users/{user_id}/grants', body, cookies, tenant_id, client_id, client_secret)
+
+
+@click.command(help='Delete a user grant')
+@admin_api_command
+@click.option('-u', '--user-id', required=True, help='The ID of the user')
+@click.option('-g', '--grant-id', required=True, help='The ID of the grant')
+def delete_user_grant(profile, tenant_id, client_id, client_secret, user_id, grant_id):
+    tenant_id, client_id, client_secret = parse_credential_options(profile, tenant_id, client_id, client_secret)
+    do_delete_admin(tenant_id, client_id, client_secret, f'/v3/users/{user_id}/grants/{grant_id}')
+
+
+@click.command(help="Accounts the user is a member of")
+@admin_api_command
+@click.argument('user-id')
+def list_user_accounts(profile, tenant_id, client_id, client_secret, user_id):
+    tenant_id, client_id, client_secret = parse_credential_options(profile, tenant_id, client_id, client_secret)
+    # NOTE - rather than return empty list - this returns 404 if no results
+    do_get_admin(tenant_id, client_id, client_secret, f"/v3/users/{user_id}/accounts")
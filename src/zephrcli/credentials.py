@@ -0,0 +1,256 @@
+import base64
+import json
+import os
+import sys
+import threading
+
+import click
+
+from .config import app_name
+
+BACKENDS = ['keychain', 'secret-service', 'file', 'env']
+
+# Credential settings, overridden by the global options on the root cli group
+_settings = {
+    'backend': 'keychain' if sys.platform == 'darwin' else 'secret-service',
+    'cache_ttl': 0,
+    'cache_file': os.path.join(os.path.expanduser('~'), '.cache', 'zephr', 'credentials-cache.json'),
+    'credentials_file': os.path.join(os.path.expanduser('~'), '.config', 'zephr', 'credentials.enc'),
+    # Names of the profiles saved to a keyring, which cannot list its entries; holds no secrets
+    'profiles_file': os.path.join(os.path.expanduser('~'), '.config', 'zephr', 'profiles.json'),
+}
+
+# Profiles already resolved in this process, so repeated lookups never leave memory
+_memo = {}
+_memo_lock = threading.Lock()
+_backend = None
+
+
+def configure(backend=None, cache_ttl=None, credentials_file=None):
+    # Called for every command, including each one run in the shell, so the backend and resolved profiles are
+    # only dropped when a setting actually changes
+    global _backend
+    given = {'backend': backend, 'cache_ttl': cache_ttl, 'credentials_file': credentials_file}
+    changed = {k: v for k, v in given.items() if v is not None and v != _settings[k]}
+    if not changed:
+        return
+    _settings.update(changed)
+    _backend = None
+    _memo.clear()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        _backend = {
+            'keychain': KeyringBackend,
+            'secret-service': KeyringBackend,
+            'file': EncryptedFileBackend,
+            'env': EnvBackend,
+        }[_settings['backend']](_settings['backend'])
+    return _backend
+
+
+def get_creds_string(profile):
+    with _memo_lock:
+        if profile in _memo:
+            return _memo[profile]
+        creds_string = _read_cache(profile)
+        if creds_string is None:
+            creds_string = get_backend().get(profile)
+            if creds_string is not None:
+                _write_cache(profile, creds_string)
+        _memo[profile] = creds_string
+        return creds_string
+
+
+def set_creds_string(profile, creds_string):
+    get_backend().set(profile, creds_string)
+    forget(profile)
+
+
+def delete_creds(profile):
+    forget(profile)
+    return get_backend().delete(profile)
+
+
+def profile_names():
+    # Sorted names of the stored profiles, for --all-profiles
+    return sorted(get_backend().names())
+
+
+def forget(profile):
+    with _memo_lock:
+        _memo.pop(profile, None)
+    if os.path.exists(_settings['cache_file']):
+        entries = _load_json(_settings['cache_file'])
+        if entries.pop(profile, None) is not None:
+            _save_json(_settings['cache_file'], entries)
+
+
+class KeyringBackend:
+    # System keyring: the macOS keychain, or the freedesktop Secret Service (GNOME Keyring, KWallet) on Linux
+
+    def __init__(self, name):
+        import keyring
+        if name == 'keychain':
+            from keyring.backends.macOS import Keyring
+        else:
+            from keyring.backends.SecretService import Keyring
+        # Set the backend explicitly; otherwise keyring warns of missing config file
+        keyring.set_keyring(Keyring())
+        self.keyring = keyring
+
+    def get(self, profile):
+        return self.keyring.get_password(app_name, profile)
+
+    def set(self, profile, creds_string):
+        self.keyring.set_password(app_name, profile, creds_string)
+        _save_json(_settings['profiles_file'], sorted(set(self.names()) | {profile}))
+
+    def delete(self, profile):
+        from keyring.errors import PasswordDeleteError
+        if profile in self.names():
+            _save_json(_settings['profiles_file'], [name for name in self.names() if name != profile])
+        try:
+            self.keyring.delete_password(app_name, profile)
+            return True
+        except PasswordDeleteError:
+            return False
+
+    def names(self):
+        # Only profiles saved with login since the list was introduced are known
+        return _load_json(_settings['profiles_file']) if os.path.exists(_settings['profiles_file']) else []
+
+
+class EncryptedFileBackend:
+    # All profiles in one file, encrypted with a key derived from ZEPHR_CREDENTIALS_PASSPHRASE (or a prompt)
+
+    def __init__(self, name):
+        self.path = _settings['credentials_file']
+        self._fernet = None
+        self._salt = None
+
+    def get(self, profile):
+        return self._load().get(profile)
+
+    def set(self, profile, creds_string):
+        profiles = self._load()
+        profiles[profile] = creds_string
+        self._save(profiles)
+
+    def delete(self, profile):
+        profiles = self._load()
+        if profiles.pop(profile, None) is None:
+            return False
+        self._save(profiles)
+        return True
+
+    def names(self):
+        return list(self._load())
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            self._salt = os.urandom(16)
+            return {}
+        stored = _load_json(self.path)
+        self._salt = base64.b64decode(stored['salt'])
+        _, invalid_token = _crypto()
+        try:
+            return json.loads(self._cipher().decrypt(stored['token'].encode()))
+        except invalid_token:
+            raise click.ClickException(f'Wrong passphrase for {self.path}')
+
+    def _save(self, profiles):
+        token = self._cipher().encrypt(json.dumps(profiles).encode()).decode()
+        _save_json(self.path, {'salt': base64.b64encode(self._salt).decode(), 'token': token})
+
+    def _cipher(self):
+        if self._fernet is None:
+            from .api_auth import prompt_secret
+            passphrase = os.environ.get('ZEPHR_CREDENTIALS_PASSPHRASE') or prompt_secret('Credentials passphrase: ')
+            fernet, _ = _crypto()
+            from cryptography.hazmat.primitives import hashes
+            from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+            kdf = PBKDF2HMAC(algorithm=hashes.SHA256(), length=32, salt=self._salt, iterations=200_000)
+            self._fernet = fernet(base64.urlsafe_b64encode(kdf.derive(passphrase.encode())))
+        return self._fernet
+
+
+class EnvBackend:
+    # No storage: a profile is read from ZEPHR_PROFILE_<NAME>, holding the same JSON a login would save
+
+    def __init__(self, name):
+        pass
+
+    def get(self, profile):
+        return os.environ.get(self.variable(profile))
+
+    def set(self, profile, creds_string):
+        raise click.ClickException(f'The env credentials backend is read-only; export {self.variable(profile)} '
+                                   'as JSON with tenant_id, client_id and client_secret instead')
+
+    def delete(self, profile):
+        raise click.ClickException(f'The env credentials backend is read-only; unset {self.variable(profile)}')
+
+    def names(self):
+        # Profile names come back lower case, which variable() maps to the same environment variable
+        return [name[len('ZEPHR_PROFILE_'):].lower() for name in os.environ if name.startswith('ZEPHR_PROFILE_')]
+
+    @staticmethod
+    def variable(profile):
+        return 'ZEPHR_PROFILE_' + ''.join(c if c.isalnum() else '_' for c in profile).upper()
+
+
+def new_cache_key():
+    fernet, _ = _crypto()
+    return fernet.generate_key().decode()
+
+
+def _read_cache(profile):
+    # The on-disk cache is only used with a TTL and a key from ZEPHR_CREDENTIALS_CACHE_KEY, which is held in the
+    # environment of a batch job rather than on disk. Entries expire using the timestamp inside the Fernet token.
+    key = os.environ.get('ZEPHR_CREDENTIALS_CACHE_KEY')
+    if not _settings['cache_ttl'] or not key or not os.path.exists(_settings['cache_file']):
+        return None
+    token = _load_json(_settings['cache_file']).get(profile)
+    if token is None:
+        return None
+    fernet, invalid_token = _crypto()
+    try:
+        return fernet(key.encode()).decrypt(token.encode(), ttl=_settings['cache_ttl']).decode()
+    except invalid_token:
+        return None
+
+
+def _write_cache(profile, creds_string):
+    key = os.environ.get('ZEPHR_CREDENTIALS_CACHE_KEY')
+    if not _settings['cache_ttl'] or not key:
+        return
+    fernet, _ = _crypto()
+    entries = _load_json(_settings['cache_file']) if os.path.exists(_settings['cache_file']) else {}
+    entries[profile] = fernet(key.encode()).encrypt(creds_string.encode()).decode()
+    _save_json(_settings['cache_file'], entries)
+
+
+def _crypto():
+    try:
+        from cryptography.fernet import Fernet, InvalidToken
+    except ImportError:
+        raise click.ClickException('The encrypted file backend and credential cache need the "cryptography" '
+                                   'package: pip install cryptography')
+    return Fernet, InvalidToken
+
+
+def _load_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def _save_json(path, value):
+    # Written owner-only and replaced atomically, so concurrent processes never see a partial file
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+        json.dump(value, f)
+    os.replace(tmp_path, path)
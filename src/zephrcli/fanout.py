@@ -0,0 +1,138 @@
+import click
+
+# Fan-out settings, overridden by the global options on the root cli group
+_settings = {
+    # Profiles a read command is run against concurrently; None runs it once, as usual
+    'profiles': None,
+    # Print the paths whose values differ between the profiles instead of each profile's output
+    'diff': False,
+}
+
+# Commands with these prefixes only read, so are safe to run against every tenant at once
+READ_PREFIXES = ('list-', 'get-')
+# Fields telling list items apart, so lists in a different order on each tenant are compared item by item
+IDENTITY_FIELDS = ('id', 'user_id', 'slug', 'label', 'name')
+_CREDENTIAL_PARAMS = ('profile', 'tenant_id', 'client_id', 'client_secret')
+_MISSING = object()
+
+
+def configure(profiles=None, all_profiles=False, diff=False):
+    if profiles and all_profiles:
+        raise click.UsageError('Use either --profiles or --all-profiles, not both')
+    if all_profiles:
+        from .credentials import profile_names
+        profiles = profile_names()
+        if not profiles:
+            raise click.UsageError('No stored profiles found for --all-profiles')
+    elif profiles:
+        profiles = list(dict.fromkeys(p.strip() for p in profiles.split(',') if p.strip()))
+    if diff and not profiles:
+        raise click.UsageError('--diff needs --profiles or --all-profiles')
+    _settings.update(profiles=profiles or None, diff=diff)
+
+
+def wrap(name, command):
+    # With --profiles, returns a command that runs `command` for each profile concurrently and tags or diffs the
+    # output; otherwise returns `command` itself
+    if _settings['profiles'] is None or not any(param.name == 'profile' for param in command.params):
+        return command
+
+    def callback(**kwargs):
+        # Checked when the command runs, so --help still works for any command
+        if not name.startswith(READ_PREFIXES):
+            raise click.UsageError(f'--profiles and --all-profiles only run list-* and get-* commands, not {name}')
+        if any(kwargs.get(param) for param in _CREDENTIAL_PARAMS):
+            raise click.UsageError('--profiles and --all-profiles take the place of --profile, --tenant-id, '
+                                   '--client-id and --client-secret')
+        results = run_profiles(command.callback, kwargs, _settings['profiles'])
+        if _settings['diff']:
+            write_diff(results)
+        else:
+            write_tagged(results)
+
+    return click.Command(name, params=command.params, callback=callback, help=command.help,
+                         short_help=command.short_help)
+
+
+def _run_profile(callback, kwargs, profile):
+    from .output import captured
+    with captured() as values:
+        callback(**dict(kwargs, profile=profile))
+    return values[0] if len(values) == 1 else values
+
+
+def run_profiles(callback, kwargs, profiles):
+    # Returns {profile: (output, error)} in the order the profiles were given, running them all at once
+    from .bulk import run_bounded
+    results = {}
+    for profile, value, error in run_bounded(lambda p: _run_profile(callback, kwargs, p), profiles, len(profiles)):
+        if isinstance(error, click.ClickException):
+            error = error.format_message()
+        results[profile] = (value, None if error is None else str(error) or repr(error))
+    return {profile: results[profile] for profile in profiles}
+
+
+def _tenant(profile):
+    from .api_auth import get_creds
+    try:
+        return get_creds(profile).get('tenant_id')
+    except click.ClickException:
+        return None
+
+
+def write_tagged(results):
+    from .output import write_record
+    for profile, (value, error) in results.items():
+        record = {'profile': profile, 'tenant_id': _tenant(profile)}
+        record.update({'error': error} if error is not None else {'result': value})
+        write_record(record)
+
+
+def _identity(items):
+    # The first field present and unique in every item of a list, or None to compare the items by position
+    for field in IDENTITY_FIELDS:
+        keys = [str(item.get(field)) for item in items if isinstance(item, dict) and item.get(field) is not None]
+        if len(keys) == len(items) and len(set(keys)) == len(keys):
+            return field
+    return None
+
+
+def flatten(value, path=''):
+    # {path: leaf value} of a response, e.g. {'results[id=abc].label': 'Gold'}
+    if isinstance(value, dict) and value:
+        flat = {}
+        for key, item in value.items():
+            flat.update(flatten(item, f'{path}.{key}' if path else key))
+        return flat
+    if isinstance(value, list) and value:
+        field = _identity(value)
+        flat = {}
+        for i, item in enumerate(value):
+            flat.update(flatten(item, f'{path}[{field}={item[field]}]' if field else f'{path}[{i}]'))
+        return flat
+    return {path: value}
+
+
+def write_diff(results):
+    # One record per path whose value is not the same for every profile; paths a profile lacks are left out of
+    # its values. Exits with status 1 when anything differs, like diff.
+    from .output import write_record
+    compared = {}
+    for profile, (value, error) in results.items():
+        if error is not None:
+            click.echo(click.style(f'{profile}: {error}', fg='red'), err=True)
+        else:
+            compared[profile] = flatten(value)
+    paths = list(dict.fromkeys(path for flat in compared.values() for path in flat))
+    differences = 0
+    for path in paths:
+        values = {profile: flat.get(path, _MISSING) for profile, flat in compared.items()}
+        if len({repr(v) for v in values.values()}) > 1:
+            differences += 1
+            write_record({'path': path, 'values': {p: v for p, v in values.items() if v is not _MISSING}})
+    failed = len(results) - len(compared)
+    click.echo(click.style(f'{differences} paths differ across {len(compared)} profiles'
+                           + (f', {failed} failed' if failed else ''), fg='yellow' if differences else 'green'),
+               err=True)
+    if differences or failed:
+        click.get_current_context().exit(1)
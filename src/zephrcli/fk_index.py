@@ -0,0 +1,50 @@
+from urllib.parse import quote
+
+from .bulk import run_requests
+from .paging import result_list
+from .snapshot import sync_users, write_user
+
+# SQLite limits the number of bound parameters, so index lookups are split into chunks
+_LOOKUP_CHUNK = 500
+
+
+def refresh_index(conn, tenant_id, client_id, client_secret, prefetch=4, full=False):
+    # The index is the user_foreign_keys table of the tenant snapshot, kept current from a user listing alone
+    with conn:
+        return sync_users(conn, tenant_id, client_id, client_secret, prefetch=prefetch, full=full,
+                          record_updated=False)
+
+
+def lookup(conn, key, values):
+    # Returns {value: user_id} for the values found in the index
+    values = list(dict.fromkeys(values))
+    found = {}
+    for i in range(0, len(values), _LOOKUP_CHUNK):
+        chunk = values[i:i + _LOOKUP_CHUNK]
+        found.update(conn.execute(f'SELECT value, user_id FROM user_foreign_keys WHERE key = ? AND value IN '
+                                  f'({",".join("?" * len(chunk))})', [key] + chunk))
+    return found
+
+
+def resolve_remote(conn, tenant_id, client_id, client_secret, key, values, workers=8, batch_size=500):
+    # Looks up values missing from the index with concurrent foreign key queries, writing each batch of users
+    # found back into the index. Yields (value, user_id or None, error) in completion order.
+    def fetch(value):
+        query = f'foreign_key.{key}={quote(str(value), safe="")}'
+        return ("GET", tenant_id, client_id, client_secret, '/v3/users'), {'query': query}
+
+    pending = 0
+    for value, r, error in run_requests(fetch, values, workers):
+        user = None
+        if error is None and not r.ok:
+            error = RuntimeError(f'{r.status_code} {r.text}')
+        elif error is None:
+            user = next(iter(result_list(r.json())), None)
+        if user is not None:
+            write_user(conn, user)
+            pending += 1
+            if pending >= batch_size:
+                conn.commit()
+                pending = 0
+        yield value, user['user_id'] if user else None, error
+    conn.commit()
@@ -0,0 +1,213 @@
+import math
+import threading
+import time
+from collections import deque
+
+import click
+
+# Hedging settings, overridden by the global options on the root cli group
+_settings = {
+    # Percentile of recent latency to a host after which a second, hedge request is sent; None never hedges
+    'percentile': None,
+    # Latencies kept per host, and how many are needed before hedging starts
+    'window': 200,
+    'min_samples': 20,
+}
+
+# Hedges are capped at this multiple of the share of requests the percentile alone would hedge (5% at p95), so a
+# host that slows down as a whole is not sent twice the traffic
+BUDGET_FACTOR = 2
+# Requests recorded between recalculations of a host's hedging threshold
+RECALCULATE_EVERY = 20
+
+_stats = {'requests': 0, 'hedged': 0, 'hedge_won': 0, 'bounded': 0, 'answered': None, 'unhedged': None}
+_stats_lock = threading.Lock()
+_executor = {}
+
+
+def configure(percentile=None):
+    # Called once per command run, so the statistics reported are for that command only
+    _settings['percentile'] = percentile
+    with _stats_lock:
+        _stats.update(requests=0, hedged=0, hedge_won=0, bounded=0, answered=None, unhedged=None)
+
+
+def applies(method, path):
+    # Only requests that are safe to send twice are hedged: public reads, and decides
+    return _settings['percentile'] is not None and (method in ('GET', 'HEAD') or path == '/zephr/decide')
+
+
+class LatencyTracker:
+    # Recent latencies of one host, in seconds, and the hedging threshold derived from them
+
+    def __init__(self, window):
+        self._latencies = deque(maxlen=window)
+        self._threshold = None
+        self._recorded = 0
+        self._lock = threading.Lock()
+
+    def record(self, latency):
+        with self._lock:
+            self._latencies.append(latency)
+            self._recorded += 1
+            if self._recorded >= RECALCULATE_EVERY:
+                self._threshold = None
+
+    def threshold(self, percentile):
+        with self._lock:
+            if len(self._latencies) < _settings['min_samples']:
+                return None
+            if self._threshold is None:
+                ordered = sorted(self._latencies)
+                self._threshold = ordered[max(0, math.ceil(percentile / 100 * len(ordered)) - 1)]
+                self._recorded = 0
+            return self._threshold
+
+
+_trackers = {}
+_trackers_lock = threading.Lock()
+
+
+def tracker_for(base_url):
+    with _trackers_lock:
+        tracker = _trackers.get(base_url)
+        if tracker is None:
+            tracker = _trackers[base_url] = LatencyTracker(_settings['window'])
+        return tracker
+
+
+def _hedge_delay(base_url):
+    # Seconds to wait for the first response before hedging, or None to send the request once
+    threshold = tracker_for(base_url).threshold(_settings['percentile'])
+    if threshold is None:
+        return None
+    with _stats_lock:
+        budget = BUDGET_FACTOR * (100 - _settings['percentile']) / 100 * _stats['requests']
+        if _stats['hedged'] >= budget:
+            return None
+    return threshold
+
+
+def _histograms():
+    # Called with _stats_lock held
+    if _stats['answered'] is None:
+        from .loadgen import LatencyHistogram
+        _stats.update(answered=LatencyHistogram(), unhedged=LatencyHistogram())
+    return _stats['answered'], _stats['unhedged']
+
+
+def _record(base_url, answered, unhedged=None, hedged=False, hedge_won=False):
+    # answered is the latency the caller saw. unhedged is that of the first request alone, recorded separately by
+    # _record_unhedged when the first request was beaten by its hedge.
+    with _stats_lock:
+        _stats['requests'] += 1
+        _stats['hedged'] += hedged
+        _stats['hedge_won'] += hedge_won
+        _histograms()[0].record(answered * 1_000_000)
+    if unhedged is not None:
+        _record_unhedged(base_url, unhedged)
+
+
+def _record_unhedged(base_url, latency, bounded=False):
+    # bounded when the request was cancelled, so latency is only how long it had taken so far. Such a lower bound
+    # would drag the hedging threshold down, so it only counts towards the unhedged figures reported.
+    if not bounded:
+        tracker_for(base_url).record(latency)
+    with _stats_lock:
+        _stats['bounded'] += bounded
+        _histograms()[1].record(latency * 1_000_000)
+
+
+def _pool():
+    # Requests sent with requests cannot be interrupted, so a losing request runs to completion on this pool and
+    # its connection goes back to the session's pool; its response is discarded
+    if 'pool' not in _executor:
+        from concurrent.futures import ThreadPoolExecutor
+        _executor['pool'] = ThreadPoolExecutor(max_workers=256, thread_name_prefix='zephr-hedge')
+    return _executor['pool']
+
+
+def call(base_url, send):
+    # Returns send(), sending it a second time if the first has not answered within the hedging threshold, and
+    # returning whichever answers first. An error is only raised when both requests fail.
+    from concurrent.futures import FIRST_COMPLETED, wait
+    delay = _hedge_delay(base_url)
+    started = time.perf_counter()
+    if delay is None:
+        r = send()
+        elapsed = time.perf_counter() - started
+        _record(base_url, elapsed, elapsed)
+        return r
+    primary = _pool().submit(send)
+    if wait([primary], timeout=delay).done:
+        elapsed = time.perf_counter() - started
+        _record(base_url, elapsed, elapsed)
+        return primary.result()
+    hedge = _pool().submit(send)
+    pending = {primary, hedge}
+    while True:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        winner = next((f for f in (primary, hedge) if f in done and f.exception() is None), None)
+        if winner is not None or not pending:
+            break
+    elapsed = time.perf_counter() - started
+    if winner is hedge:
+        # The first request still runs to completion, and how long it took is what hedging saved
+        primary.add_done_callback(lambda f: _record_unhedged(base_url, time.perf_counter() - started))
+        _record(base_url, elapsed, hedged=True, hedge_won=True)
+    else:
+        _record(base_url, elapsed, elapsed, hedged=True)
+    return (winner or primary).result()
+
+
+async def call_async(base_url, send):
+    # As call(), for a coroutine function send on the asyncio engine. The losing request is cancelled, so when the
+    # hedge wins, the unhedged figures get the time the first request had taken so far and the tracker gets nothing.
+    import asyncio
+    delay = _hedge_delay(base_url)
+    started = time.perf_counter()
+    if delay is None:
+        r = await send()
+        elapsed = time.perf_counter() - started
+        _record(base_url, elapsed, elapsed)
+        return r
+    primary = asyncio.ensure_future(send())
+    done, _ = await asyncio.wait({primary}, timeout=delay)
+    if done:
+        elapsed = time.perf_counter() - started
+        _record(base_url, elapsed, elapsed)
+        return primary.result()
+    hedge = asyncio.ensure_future(send())
+    pending = {primary, hedge}
+    try:
+        while True:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            winner = next((t for t in (primary, hedge) if t in done and t.exception() is None), None)
+            if winner is not None or not pending:
+                break
+    finally:
+        for task in pending:
+            task.cancel()
+    elapsed = time.perf_counter() - started
+    _record(base_url, elapsed, hedged=True, hedge_won=winner is hedge)
+    _record_unhedged(base_url, elapsed, bounded=winner is hedge)
+    return (winner or primary).result()
+
+
+def report():
+    # Printed when a command run with hedging finishes: how often it fired, and the tail latency with and without it
+    with _stats_lock:
+        # Commands making fewer requests than the samples needed could not have hedged any
+        if _settings['percentile'] is None or _stats['requests'] < _settings['min_samples']:
+            return
+    if 'pool' in _executor:
+        # First requests beaten by their hedge are still finishing; their latencies complete the unhedged figures
+        _executor.pop('pool').shutdown(wait=True)
+    with _stats_lock:
+        requests, hedged, hedge_won = _stats['requests'], _stats['hedged'], _stats['hedge_won']
+        answered, unhedged = _stats['answered'], _stats['unhedged']
+        at_least = 'at least ' if _stats['bounded'] else ''
+    tails = ', '.join(f'p{p:g} {answered.value_at_percentile(p) / 1000:.1f}ms '
+                      f'({at_least}{unhedged.value_at_percentile(p) / 1000:.1f}ms unhedged)' for p in (99.0, 99.9))
+    click.echo(click.style(f'hedged {hedged} of {requests} requests ({100 * hedged / requests:.1f}%), '
+                           f'hedge answered first {hedge_won} times; {tails}', fg='green'), err=True)
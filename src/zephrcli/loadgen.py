@@ -0,0 +1,139 @@
+import math
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+REPORT_PERCENTILES = [50.0, 90.0, 99.0, 99.9]
+
+
+class LatencyHistogram:
+    # Log-linear buckets in the style of HdrHistogram: each value is kept to `significant_bits` of precision,
+    # so memory stays bounded however many values are recorded. Values are integer microseconds.
+
+    def __init__(self, significant_bits=8):
+        self.significant_bits = significant_bits
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def record(self, value_us):
+        value = max(0, int(value_us))
+        shift = max(0, value.bit_length() - self.significant_bits)
+        bucket = (value >> shift) << shift
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        for bucket, count in other.counts.items():
+            self.counts[bucket] = self.counts.get(bucket, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def value_at_percentile(self, percentile):
+        if self.count == 0:
+            return 0
+        target = max(1, math.ceil(percentile / 100 * self.count))
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= target:
+                # Report the highest value equivalent to the bucket, as HdrHistogram does
+                shift = max(0, bucket.bit_length() - self.significant_bits)
+                return min(bucket + (1 << shift) - 1, self.max)
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+
+class LoadResult:
+
+    def __init__(self, rate, duration):
+        self.rate = rate
+        self.duration = duration
+        self.histogram = LatencyHistogram()
+        self.statuses = Counter()
+        self.errors = Counter()
+        self.elapsed = 0.0
+
+    @property
+    def completed(self):
+        return self.histogram.count
+
+    @property
+    def failed(self):
+        return sum(self.errors.values()) + sum(n for status, n in self.statuses.items() if status >= 400)
+
+    def to_dict(self):
+        h = self.histogram
+        return {
+            'target_rate': self.rate,
+            'duration': self.duration,
+            'elapsed': round(self.elapsed, 3),
+            'completed': self.completed,
+            'throughput': round(self.completed / self.elapsed, 1) if self.elapsed else 0.0,
+            'failed': self.failed,
+            'statuses': {str(k): v for k, v in sorted(self.statuses.items())},
+            'errors': dict(self.errors),
+            'latency_ms': dict({f'p{p:g}': h.value_at_percentile(p) / 1000 for p in REPORT_PERCENTILES},
+                               min=(h.min or 0) / 1000, mean=round(h.mean() / 1000, 3), max=h.max / 1000),
+        }
+
+
+def run_open_loop(send, rate, duration, max_in_flight=64):
+    # Constant-arrival scheduler: request i is due at start + i / rate whether or not earlier requests have
+    # returned, and its latency is measured from that due time. A stalled server therefore shows up as queueing
+    # delay in the histogram rather than silently lowering the send rate (coordinated omission).
+    result = LoadResult(rate, duration)
+    lock = threading.Lock()
+    interval = 1.0 / rate
+    total = int(rate * duration)
+
+    def fire(due):
+        try:
+            outcome = send().status_code
+        except Exception as e:
+            outcome = type(e).__name__
+        latency_us = (time.perf_counter() - due) * 1_000_000
+        with lock:
+            result.histogram.record(latency_us)
+            if isinstance(outcome, int):
+                result.statuses[outcome] += 1
+            else:
+                result.errors[outcome] += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+        for i in range(total):
+            due = start + i * interval
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(fire, due)
+    result.elapsed = time.perf_counter() - start
+    return result
+
+
+def format_report(result):
+    report = result.to_dict()
+    latency = report['latency_ms']
+    lines = [
+        f"target rate:  {report['target_rate']:g}/s for {report['duration']:g}s",
+        f"completed:    {report['completed']} in {report['elapsed']:.2f}s ({report['throughput']:.1f}/s)",
+        f"failed:       {report['failed']}",
+        f"statuses:     {', '.join(f'{k}={v}' for k, v in report['statuses'].items()) or '-'}",
+        f"errors:       {', '.join(f'{k}={v}' for k, v in report['errors'].items()) or '-'}",
+        'latency (ms):',
+    ]
+    for name in ['min'] + [f'p{p:g}' for p in REPORT_PERCENTILES] + ['max', 'mean']:
+        lines.append(f'  {name:>6}  {latency[name]:10.3f}')
+    return '\n'.join(lines)
@@ -0,0 +1,440 @@
+import json
+import math
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+from .client import sign_zephr_request
+
+# Credentials accepted by default; any other client id is rejected with 401
+MOCK_TENANT_ID = 'mock'
+MOCK_CLIENT_ID = 'mock-client'
+MOCK_CLIENT_SECRET = 'mock-secret'
+
+# Read-only admin catalog endpoints served from the store as {"results": [...]}
+_CATALOGS = ['accounts', 'companies', 'products', 'meters', 'static', 'webhooks', 'cache-configurations', 'credits',
+             'entitlements', 'feature-rules', 'request-rules', 'gift', 'schema/users', 'accounts/users']
+
+_routes = []
+
+
+def route(method, pattern, admin=True):
+    # Admin routes (/v3, /v4) must carry a valid ZEPHR-HMAC-SHA256 signature; CDN routes are public
+    def register(handler):
+        _routes.append((method, re.compile(f'^{pattern}$'), admin, handler))
+        return handler
+    return register
+
+
+class MockStore:
+    # In-memory tenant state shared by all request threads
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.users = {}
+        self.grants = {}
+        self.memberships = {}
+        self.sessions = {}
+        self.bundles = {}
+        self.session_limits = {}
+        self.catalogs = {name: [] for name in _CATALOGS}
+        self.configuration = {'tenant': MOCK_TENANT_ID}
+        self.features = [{'id': 'mock-feature', 'label': 'Mock feature', 'ruleType': 'sdk'}]
+
+    def add_user(self, body):
+        email = body.get('identifiers', {}).get('email_address')
+        with self.lock:
+            if any(u['identifiers'].get('email_address') == email for u in self.users.values()):
+                return None
+            user = {'user_id': str(uuid.uuid4()), 'identifiers': body.get('identifiers', {}),
+                    'attributes': body.get('attributes', {}), 'foreign_keys': body.get('foreign_keys', {}),
+                    'updated_at': int(time.time() * 1000)}
+            self.users[user['user_id']] = user
+            return user
+
+
+@route('GET', '/v3/users')
+def list_users(server, match, query, body):
+    users = list(server.store.users.values())
+    for name, value in query.items():
+        if name.startswith('foreign_key.'):
+            key = name.split('.', 1)[1]
+            users = [u for u in users if u['foreign_keys'].get(key) == value]
+    if 'search' in query:
+        term = query['search'].strip('*').lower()
+        users = [u for u in users if term in json.dumps(u).lower()]
+    rpp, page = int(query.get('rpp', 50)), int(query.get('page', 1))
+    return 200, {'results': users[(page - 1) * rpp:page * rpp], 'total': len(users)}
+
+
+@route('POST', '/v3/users')
+def create_user(server, match, query, body):
+    user = server.store.add_user(body)
+    if user is None:
+        return 409, {'message': 'User already exists'}
+    return 200, {'user_id': user['user_id']}
+
+
+@route('GET', '/v3/users/([^/]+)')
+def get_user(server, match, query, body):
+    user = server.store.users.get(match[1])
+    return (200, user) if user else (404, {'message': 'User not found'})
+
+
+@route('DELETE', '/v3/users/([^/]+)')
+def delete_user(server, match, query, body):
+    user = server.store.users.pop(match[1], None)
+    return (200, {'message': 'deleted'}) if user else (404, {'message': 'User not found'})
+
+
+@route('GET', '/v3/users/([^/]+)/grants')
+def list_user_grants(server, match, query, body):
+    return 200, {'results': list(server.store.grants.get(match[1], {}).values())}
+
+
+def _grant_time(value=None):
+    # Like Zephr, grant times are answered in ISO 8601 UTC with milliseconds whatever form they were given in, and a
+    # grant given no start time starts now
+    if value is None:
+        parsed = datetime.now(timezone.utc)
+    else:
+        parsed = datetime.fromisoformat(value[:-1] + '+00:00' if value.endswith('Z') else value)
+        parsed = parsed.replace(tzinfo=timezone.utc) if parsed.tzinfo is None else parsed
+    return parsed.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+
+@route('POST', '/v3/users/([^/]+)/grants')
+def create_user_grant(server, match, query, body):
+    grant = dict(body, grant_id=str(uuid.uuid4()), user_id=match[1])
+    try:
+        grant['startTime'] = _grant_time(body.get('startTime') or None)
+        if body.get('endTime'):
+            grant['endTime'] = _grant_time(body['endTime'])
+    except ValueError:
+        return 400, {'message': 'Invalid grant time'}
+    with server.store.lock:
+        server.store.grants.setdefault(match[1], {})[grant['grant_id']] = grant
+    return 200, grant
+
+
+@route('GET', '/v3/users/([^/]+)/grants/([^/]+)')
+def get_user_grant(server, match, query, body):
+    grant = server.store.grants.get(match[1], {}).get(match[2])
+    return (200, grant) if grant else (404, {'message': 'Grant not found'})
+
+
+@route('DELETE', '/v3/users/([^/]+)/grants/([^/]+)')
+def delete_user_grant(server, match, query, body):
+    grant = server.store.grants.get(match[1], {}).pop(match[2], None)
+    return (200, {'message': 'deleted'}) if grant else (404, {'message': 'Grant not found'})
+
+
+@route('GET', '/v3/users/([^/]+)/accounts')
+def list_user_accounts(server, match, query, body):
+    accounts = [{'account_id': account_id} for account_id, users in server.store.memberships.items()
+                if match[1] in users]
+    return (200, {'results': accounts}) if accounts else (404, {'message': 'No accounts'})
+
+
+@route('PUT', '/v3/accounts/([^/]+)/users/([^/]+)')
+def add_user_to_account(server, match, query, body):
+    with server.store.lock:
+        server.store.memberships.setdefault(match[1], set()).add(match[2])
+    return 200, {'message': 'added'}
+
+
+@route('DELETE', '/v3/accounts/([^/]+)/users/([^/]+)')
+def remove_user_from_account(server, match, query, body):
+    server.store.memberships.get(match[1], set()).discard(match[2])
+    return 200, {'message': 'removed'}
+
+
+@route('GET', '/v4/users/([^/]+)/sessions')
+def list_user_sessions(server, match, query, body):
+    return 200, {'results': list(server.store.sessions.get(match[1], {}).values())}
+
+
+@route('POST', '/v3/sessions')
+def create_session(server, match, query, body):
+    email = body.get('identifiers', {}).get('email_address')
+    user = next((u for u in server.store.users.values() if u['identifiers'].get('email_address') == email), None)
+    if user is None:
+        return 404, {'message': 'User not found'}
+    session = {'session_id': str(uuid.uuid4()), 'user_id': user['user_id'], 'created_at': int(time.time() * 1000)}
+    if body.get('user_agent'):
+        session['user_agent'] = body['user_agent']
+    with server.store.lock:
+        server.store.sessions.setdefault(user['user_id'], {})[session['session_id']] = session
+    return 200, session
+
+
+@route('DELETE', '/v3/sessions/([^/]+)')
+def delete_session(server, match, query, body):
+    with server.store.lock:
+        for sessions in server.store.sessions.values():
+            if sessions.pop(match[1], None) is not None:
+                return 200, {'message': 'deleted'}
+    return 404, {'message': 'Session not found'}
+
+
+@route('GET', '/v3/configuration')
+def get_configuration(server, match, query, body):
+    return 200, server.store.configuration
+
+
+@route('GET', '/v3/bundles')
+def list_bundles(server, match, query, body):
+    return 200, {'results': list(server.store.bundles.values())}
+
+
+@route('POST', '/v3/bundles')
+def create_bundle(server, match, query, body):
+    bundle = dict(body, id=str(uuid.uuid4()))
+    server.store.bundles[bundle['id']] = bundle
+    return 200, bundle
+
+
+@route('GET', '/v3/bundles/([^/]+)')
+def get_bundle(server, match, query, body):
+    bundle = server.store.bundles.get(match[1])
+    return (200, bundle) if bundle else (404, {'message': 'Bundle not found'})
+
+
+@route('PUT', '/v3/bundles/([^/]+)')
+def update_bundle(server, match, query, body):
+    if match[1] not in server.store.bundles:
+        return 404, {'message': 'Bundle not found'}
+    server.store.bundles[match[1]] = dict(body, id=match[1])
+    return 200, server.store.bundles[match[1]]
+
+
+@route('DELETE', '/v3/bundles/([^/]+)')
+def delete_bundle(server, match, query, body):
+    bundle = server.store.bundles.pop(match[1], None)
+    return (200, {'message': 'deleted'}) if bundle else (404, {'message': 'Bundle not found'})
+
+
+@route('GET', f'/v3/({"|".join(_CATALOGS)})')
+def list_catalog(server, match, query, body):
+    items = server.store.catalogs[match[1]]
+    # Paged like users when asked for a page, e.g. accounts and companies
+    if 'rpp' in query:
+        rpp, page = int(query['rpp']), int(query.get('page', 1))
+        return 200, {'results': items[(page - 1) * rpp:page * rpp], 'total': len(items)}
+    return 200, {'results': items}
+
+
+@route('GET', '/v3/(accounts|companies)/([^/]+)')
+def get_catalog_item(server, match, query, body):
+    item = next((i for i in server.store.catalogs[match[1]] if i.get('id') == match[2]), None)
+    return (200, item) if item else (404, {'message': 'Not found'})
+
+
+@route('POST', '/v3/products')
+def create_product(server, match, query, body):
+    products = server.store.catalogs['products']
+    with server.store.lock:
+        if any(p.get('id') == body.get('id') for p in products):
+            return 409, {'message': 'Product already exists'}
+        products.append(body)
+    return 200, body
+
+
+@route('PUT', '/v3/products/([^/]+)')
+def update_product(server, match, query, body):
+    products = server.store.catalogs['products']
+    with server.store.lock:
+        index = next((i for i, p in enumerate(products) if p.get('id') == match[1]), None)
+        if index is None:
+            return 404, {'message': 'Product not found'}
+        products[index] = dict(body, id=match[1])
+    return 200, products[index]
+
+
+_LIMIT_ALIAS = re.compile(r'(\w+):\s*updateUserConcurrentSessionLimit\(userId:\s*\$(\w+),\s*limit:\s*\$(\w+)\)')
+
+
+@route('POST', '/v4/admin/graphql/')
+def admin_graphql(server, match, query, body):
+    variables = body.get('variables', {})
+    aliases = _LIMIT_ALIAS.findall(body.get('query', ''))
+    if not aliases:
+        server.store.session_limits[variables.get('userId')] = variables.get('limit')
+        result = {'status': 'OK', 'message': None, '__typename': 'Response'}
+        return 200, {'data': {body.get('operationName', 'result'): result}}
+    # A batch of aliased mutations, as sent by set-user-session-limits; an unknown user is a graphql error on its
+    # own alias, leaving that alias null and the rest of the batch applied
+    data, errors = {}, []
+    with server.store.lock:
+        for alias, user_var, limit_var in aliases:
+            user_id = variables.get(user_var)
+            if user_id in server.store.users:
+                server.store.session_limits[user_id] = variables.get(limit_var)
+                data[alias] = {'status': 'OK', 'message': None, '__typename': 'Response'}
+            else:
+                data[alias] = None
+                errors.append({'message': f'User {user_id} not found', 'path': [alias]})
+    return 200, dict({'data': data}, **({'errors': errors} if errors else {}))
+
+
+@route('GET', '/zephr/features', admin=False)
+def list_features(server, match, query, body):
+    rule_type = query.get('ruleType')
+    return 200, [f for f in server.store.features if rule_type is None or f['ruleType'] == rule_type]
+
+
+@route('POST', '/zephr/decide', admin=False)
+def decide(server, match, query, body):
+    server.simulate_latency()
+    return 200, {f['slug']: {'decision': 'allow'} for f in body.get('features', [])}
+
+
+@route('GET', '/zephr/public/sessions/v1/sessions', admin=False)
+def list_sessions(server, match, query, body):
+    return 200, []
+
+
+@route('DELETE', '/zephr/public/sessions/v1/sessions(/[^/]+)?', admin=False)
+def delete_sessions(server, match, query, body):
+    return 200, {'message': 'deleted'}
+
+
+@route('POST', '/blaize/register', admin=False)
+def register_user(server, match, query, body):
+    user = server.store.add_user(body)
+    if user is None:
+        return 409, {'message': 'User already exists'}
+    return 200, {'identifiers': user['identifiers'], 'tracking_id': user['user_id']}
+
+
+class MockZephrHandler(BaseHTTPRequestHandler):
+    # Keep-alive, so clients can reuse pooled connections as they would against the real hosts
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately; without this Nagle adds ~40ms to every response
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_PUT(self):
+        self._dispatch('PUT')
+
+    def do_DELETE(self):
+        self._dispatch('DELETE')
+
+    def _dispatch(self, method):
+        length = int(self.headers.get('Content-Length') or 0)
+        raw_body = self.rfile.read(length).decode('UTF-8') if length else ''
+        path, _, query_string = self.path.partition('?')
+        retry_after = self.server.throttle()
+        if retry_after is not None:
+            # Retry-After is whole seconds, as HTTP requires; urllib3 rejects a fraction
+            self._send_json(429, {'message': 'Too many requests'}, {'Retry-After': str(math.ceil(retry_after))})
+            return
+        for route_method, pattern, admin, handler in _routes:
+            match = pattern.match(path)
+            if route_method != method or match is None:
+                continue
+            if admin and not self.server.verify_signature(self.headers.get('Authorization'), raw_body, path,
+                                                          query_string, method):
+                self._send_json(401, {'message': 'Invalid ZEPHR-HMAC-SHA256 signature'})
+                return
+            status, payload = handler(self.server, match, dict(parse_qsl(query_string)),
+                                      json.loads(raw_body) if raw_body else {})
+            self._send_json(status, payload)
+            return
+        self._send_json(404, {'message': f'No mock route for {method} {path}'})
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode('UTF-8')
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class MockZephrServer(ThreadingHTTPServer):
+    # Local stand-in for the admin, CDN and console hosts, routed by path rather than host name.
+    # Point the CLI at it with --admin-url, --public-url and --console-url set to `url`.
+    daemon_threads = True
+    # Room for hundreds of concurrent connects, as from the asyncio engine; the default backlog of 5 drops them
+    request_queue_size = 1024
+
+    def __init__(self, host='127.0.0.1', port=0, latency_ms=0.0, credentials=None, rate_limit=None, tail_ms=0.0,
+                 tail_ratio=0.0):
+        super().__init__((host, port), MockZephrHandler)
+        self.latency_ms = latency_ms
+        # A share of decides (tail_ratio) take tail_ms longer, for a long-tailed latency distribution
+        self.tail_ms = tail_ms
+        self.tail_ratio = tail_ratio
+        self.rate_limit = rate_limit
+        self._window = [0.0, 0]
+        self._window_lock = threading.Lock()
+        self.credentials = credentials or {MOCK_CLIENT_ID: MOCK_CLIENT_SECRET}
+        self.store = MockStore()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def verify_signature(self, authorization, body, path, query, method):
+        scheme, _, value = (authorization or '').partition(' ')
+        parts = value.split(':')
+        if scheme != 'ZEPHR-HMAC-SHA256' or len(parts) != 4:
+            return False
+        client_id, timestamp, nonce, digest = parts
+        secret = self.credentials.get(client_id)
+        if secret is None:
+            return False
+        return sign_zephr_request(secret, body, path, query, method, timestamp, nonce) == digest
+
+    def throttle(self):
+        # With rate_limit set, requests beyond it within a one-second window are refused; returns the seconds until
+        # the window resets for a 429 Retry-After, or None to serve the request
+        if not self.rate_limit:
+            return None
+        with self._window_lock:
+            now = time.monotonic()
+            if now - self._window[0] >= 1:
+                self._window = [now, 0]
+            self._window[1] += 1
+            if self._window[1] <= self.rate_limit:
+                return None
+            return self._window[0] + 1 - now
+
+    def simulate_latency(self):
+        latency_ms = self.latency_ms
+        if self.tail_ratio and random.random() < self.tail_ratio:
+            latency_ms += self.tail_ms
+        if latency_ms:
+            time.sleep(latency_ms / 1000)
+
+    def handle_error(self, request, client_address):
+        # Clients that hang up mid-response, such as cancelled hedge requests, are not errors of the server
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
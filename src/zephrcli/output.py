@@ -0,0 +1,234 @@
+import csv
+import io
+import json
+import threading
+from contextlib import contextmanager
+
+import click
+
+FORMATS = ['json', 'compact', 'ndjson', 'csv', 'table']
+
+# Output settings, overridden by the global options on the root cli group. A format of None lets each command use
+# its natural format: indented JSON for single responses and NDJSON for streamed records.
+_settings = {
+    'format': None,
+    'fields': None,
+    'buffer_bytes': 64 * 1024,
+}
+
+_state = {'chunks': [], 'size': 0, 'columns': None, 'rows': None}
+# Guards _state: bulk commands on the asyncio engine can write from the event loop's thread as well as the main one
+_lock = threading.RLock()
+
+_codec = {}
+
+# Per thread: a list collecting what the thread writes, instead of stdout
+_capture = threading.local()
+
+
+def configure(output_format=None, fields=None):
+    _settings['format'] = output_format
+    _settings['fields'] = [f.strip() for f in fields.split(',') if f.strip()] if fields else None
+
+
+def _orjson():
+    # orjson is optional (pip install zephrcli[fast]) and imported on first use rather than at startup
+    if 'orjson' not in _codec:
+        try:
+            import orjson
+        except ImportError:
+            orjson = None
+        _codec['orjson'] = orjson
+    return _codec['orjson']
+
+
+def dumps(value, indent=False):
+    # orjson is several times faster than json for large pages; both produce UTF-8 bytes here
+    orjson = _orjson()
+    if orjson is not None:
+        try:
+            return orjson.dumps(value, option=orjson.OPT_INDENT_2 if indent else 0)
+        except TypeError:
+            pass
+    if indent:
+        return json.dumps(value, indent=2).encode()
+    return json.dumps(value, separators=(',', ':')).encode()
+
+
+def loads(text):
+    orjson = _orjson()
+    return orjson.loads(text) if orjson is not None else json.loads(text)
+
+
+class Captured(list):
+    # What a thread wrote while capturing, and how many of the responses it wrote were errors
+    failed = 0
+
+
+@contextmanager
+def captured():
+    # Collects the response bodies and records written by the current thread, e.g. one profile of a --profiles
+    # fan-out; a failed response is collected as its status and text
+    _capture.values = values = Captured()
+    try:
+        yield values
+    finally:
+        _capture.values = None
+
+
+def write_response(r):
+    if not r.ok:
+        if getattr(_capture, 'values', None) is not None:
+            _capture.values.append({'status': r.status_code, 'error': r.text})
+            _capture.values.failed += 1
+            return
+        flush()
+        click.echo(r)
+        return
+    write_body(r.content)
+
+
+def write_body(content):
+    # Compact output of a whole body is written as received, without decoding and re-encoding it
+    if not content:
+        return
+    if getattr(_capture, 'values', None) is not None:
+        _capture.values.append(loads(content))
+        return
+    if _settings['format'] == 'compact' and not _settings['fields']:
+        _write(content.strip() + b'\n')
+        return
+    write_value(loads(content))
+
+
+def write_value(value):
+    if getattr(_capture, 'values', None) is not None:
+        _capture.values.append(value)
+        return
+    output_format = _settings['format'] or 'json'
+    if output_format in ('json', 'compact') and not _settings['fields']:
+        _write(dumps(value, indent=output_format == 'json') + b'\n')
+        return
+    if output_format in ('json', 'compact'):
+        projected = [project(r) for r in _records(value)] if _is_collection(value) else project(value)
+        _write(dumps(projected, indent=output_format == 'json') + b'\n')
+        return
+    for record in _records(value):
+        _write_record(record, output_format)
+    flush()
+
+
+def write_record(record):
+    # One record of a streamed result, e.g. a user from `list-users --all` or a row result from a bulk command
+    if getattr(_capture, 'values', None) is not None:
+        _capture.values.append(record)
+        return
+    _write_record(record, _settings['format'] or 'ndjson')
+
+
+def project(record):
+    # With --fields, keep only the given dotted paths, e.g. identifiers.email_address
+    if not _settings['fields'] or not isinstance(record, dict):
+        return record
+    return {field: _lookup(record, field) for field in _settings['fields']}
+
+
+def flush():
+    # Ends the current result: lays out any pending table and writes everything buffered to stdout
+    with _lock:
+        if _state['rows'] is not None:
+            _write_table()
+        _write_chunks()
+        _state['columns'] = None
+
+
+def _write_chunks():
+    if _state['chunks']:
+        stream = click.get_binary_stream('stdout')
+        stream.write(b''.join(_state['chunks']))
+        stream.flush()
+    _state.update(chunks=[], size=0)
+
+
+def _write_record(record, output_format):
+    record = project(record)
+    if output_format in ('json', 'compact', 'ndjson'):
+        _write(dumps(record, indent=output_format == 'json') + b'\n')
+        return
+    flat = _flatten(record)
+    with _lock:
+        if output_format == 'csv':
+            if _state['columns'] is None:
+                # The first record fixes the columns, so rows can be written as they arrive
+                _state['columns'] = list(flat)
+                _write(_csv_line(_state['columns']))
+            _write(_csv_line([_cell(flat.get(c)) for c in _state['columns']]))
+        else:
+            # Column widths depend on every row, so a table is laid out when output is flushed
+            if _state['rows'] is None:
+                _state['rows'] = []
+            _state['rows'].append(flat)
+
+
+def _write(data):
+    with _lock:
+        _state['chunks'].append(data)
+        _state['size'] += len(data)
+        if _state['size'] >= _settings['buffer_bytes']:
+            _write_chunks()
+
+
+def _write_table():
+    rows, _state['rows'] = _state['rows'], None
+    columns = list(dict.fromkeys(c for row in rows for c in row))
+    cells = [[_cell(row.get(c)) for c in columns] for row in rows]
+    widths = [max([len(c)] + [len(r[i]) for r in cells]) for i, c in enumerate(columns)]
+    lines = [columns, ['-' * w for w in widths]] + cells
+    _write(''.join('  '.join(v.ljust(w) for v, w in zip(line, widths)).rstrip() + '\n' for line in lines).encode())
+
+
+def _is_collection(value):
+    return isinstance(value, list) or isinstance(value, dict) and isinstance(value.get('results'), list)
+
+
+def _records(value):
+    # List endpoints return {"results": [...]} or a bare list; anything else is a single record
+    if not _is_collection(value):
+        return [value]
+    return value if isinstance(value, list) else value['results']
+
+
+def _lookup(record, path):
+    for part in path.split('.'):
+        if not isinstance(record, dict):
+            return None
+        record = record.get(part)
+    return record
+
+
+def _flatten(record, prefix=''):
+    # {"identifiers": {"email_address": "a@b"}} -> {"identifiers.email_address": "a@b"}
+    if not isinstance(record, dict):
+        return {prefix or 'value': record}
+    flat = {}
+    for key, value in record.items():
+        name = f'{prefix}{key}'
+        if isinstance(value, dict) and value:
+            flat.update(_flatten(value, f'{name}.'))
+        else:
+            flat[name] = value
+    return flat
+
+
+def _cell(value):
+    if value is None:
+        return ''
+    if isinstance(value, (dict, list)):
+        return dumps(value).decode()
+    return str(value)
+
+
+def _csv_line(values):
+    line = io.StringIO()
+    csv.writer(line, lineterminator='\n').writerow(values)
+    return line.getvalue().encode()
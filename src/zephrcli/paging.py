@@ -0,0 +1,50 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+
+from .client import admin_request
+
+
+def iter_pages(fetch_page, results_per_page, prefetch=4, first_page=1):
+    # Keep `prefetch` pages in flight while the caller consumes the current one.
+    # A page shorter than results_per_page is the last; anything fetched beyond it is discarded.
+    prefetch = max(1, prefetch)
+    with ThreadPoolExecutor(max_workers=prefetch) as pool:
+        pending = deque()
+        next_page = first_page
+        for _ in range(prefetch):
+            pending.append(pool.submit(fetch_page, next_page))
+            next_page += 1
+        while pending:
+            results = pending.popleft().result()
+            if len(results) < results_per_page:
+                for future in pending:
+                    future.cancel()
+                pending.clear()
+            else:
+                pending.append(pool.submit(fetch_page, next_page))
+                next_page += 1
+            yield from results
+
+
+def result_list(body):
+    # Zephr list endpoints wrap results, but tolerate a bare list
+    return body if isinstance(body, list) else body.get('results', [])
+
+
+def iter_admin_results(tenant_id, client_id, client_secret, path, query="", results_per_page=50, prefetch=4,
+                       on_request=None):
+    # on_request, if given, is called from the fetching thread before each page is requested, e.g. to count them
+    def fetch_page(page):
+        if on_request is not None:
+            on_request()
+        page_query = f'rpp={results_per_page}&page={page}'
+        if query:
+            page_query = f'{query}&{page_query}'
+        r = admin_request("GET", tenant_id, client_id, client_secret, path, query=page_query)
+        if not r.ok:
+            raise click.ClickException(f'Failed to fetch {path} page {page}: {r}')
+        return result_list(r.json())
+
+    return iter_pages(fetch_page, results_per_page, prefetch=prefetch)
@@ -0,0 +1,97 @@
+import os
+import time
+from contextlib import closing
+
+# Slow-changing catalog resources whose GET responses may be cached
+CACHEABLE_PREFIXES = {'/v3/products', '/v3/entitlements', '/v3/bundles', '/v3/meters', '/v3/credits',
+                      '/v3/configuration', '/v3/feature-rules'}
+
+# Cache settings, overridden by the global options on the root cli group
+_settings = {
+    'enabled': True,
+    'refresh': False,
+    'ttl': 300,
+    'max_bytes': 50 * 1024 * 1024,
+    'path': os.path.join(os.path.expanduser('~'), '.cache', 'zephr', 'responses.sqlite3'),
+}
+
+
+def configure(enabled=None, refresh=None, ttl=None, max_bytes=None, path=None):
+    changed = {'enabled': enabled, 'refresh': refresh, 'ttl': ttl, 'max_bytes': max_bytes, 'path': path}
+    _settings.update({k: v for k, v in changed.items() if v is not None})
+
+
+def resource_prefix(path):
+    # '/v3/bundles/1234' -> '/v3/bundles'
+    return '/'.join(path.split('/')[:3])
+
+
+def is_cacheable(path):
+    return resource_prefix(path) in CACHEABLE_PREFIXES
+
+
+def get(tenant_id, method, path, query):
+    if not _settings['enabled'] or _settings['refresh'] or not os.path.exists(_settings['path']):
+        return None
+    now = time.time()
+    with closing(_connect()) as conn, conn:
+        row = conn.execute('SELECT body, stored_at FROM responses WHERE tenant = ? AND key = ?',
+                           (tenant_id, _key(method, path, query))).fetchone()
+        if row is None or now - row[1] > _settings['ttl']:
+            return None
+        conn.execute('UPDATE responses SET accessed_at = ? WHERE tenant = ? AND key = ?',
+                     (now, tenant_id, _key(method, path, query)))
+        return row[0]
+
+
+def put(tenant_id, method, path, query, body):
+    if not _settings['enabled']:
+        return
+    now = time.time()
+    with closing(_connect()) as conn, conn:
+        conn.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)',
+                     (tenant_id, _key(method, path, query), resource_prefix(path), now, now, len(body), body))
+        _evict(conn)
+
+
+def invalidate(tenant_id, path):
+    # Any write to a cached resource drops every cached response under the same prefix for the tenant
+    if not is_cacheable(path) or not os.path.exists(_settings['path']):
+        return
+    with closing(_connect()) as conn, conn:
+        conn.execute('DELETE FROM responses WHERE tenant = ? AND prefix = ?', (tenant_id, resource_prefix(path)))
+
+
+def clear(tenant_id=None):
+    if not os.path.exists(_settings['path']):
+        return 0
+    with closing(_connect()) as conn, conn:
+        if tenant_id is None:
+            return conn.execute('DELETE FROM responses').rowcount
+        return conn.execute('DELETE FROM responses WHERE tenant = ?', (tenant_id,)).rowcount
+
+
+def _evict(conn):
+    # Least recently used entries go first until the cache fits within max_bytes
+    total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+    if total <= _settings['max_bytes']:
+        return
+    for tenant_id, key, size in conn.execute('SELECT tenant, key, size FROM responses ORDER BY accessed_at').fetchall():
+        conn.execute('DELETE FROM responses WHERE tenant = ? AND key = ?', (tenant_id, key))
+        total -= size
+        if total <= _settings['max_bytes']:
+            break
+
+
+def _key(method, path, query):
+    return f'{method} {path}?{query}'
+
+
+def _connect():
+    # sqlite3 is imported on first use rather than at startup
+    import sqlite3
+    os.makedirs(os.path.dirname(_settings['path']), exist_ok=True)
+    conn = sqlite3.connect(_settings['path'], timeout=10)
+    conn.execute('CREATE TABLE IF NOT EXISTS responses (tenant TEXT, key TEXT, prefix TEXT, stored_at REAL, '
+                 'accessed_at REAL, size INTEGER, body TEXT, PRIMARY KEY (tenant, key))')
+    return conn
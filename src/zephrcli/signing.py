@@ -0,0 +1,53 @@
+import hashlib
+import itertools
+import threading
+import time
+import uuid
+
+
+class ZephrSigner:
+    # Produces ZEPHR-HMAC-SHA256 authorization headers for one client id and secret. The signature is
+    # sha256(secret + body + path + query + method + timestamp + nonce), so the hash state after the secret is
+    # computed once and copied for each request. Bodies are signed as the exact bytes that will be sent.
+
+    def __init__(self, client_id, client_secret):
+        self.client_id = client_id
+        self._secret_state = hashlib.sha256(client_secret.encode('UTF-8'))
+        # Nonces only need to be unique: a random UUID prefix and a counter avoid calling uuid1() per request
+        self._nonce_prefix = str(uuid.uuid4())[:24]
+        self._nonce_counter = itertools.count()
+
+    def nonce(self):
+        return f'{self._nonce_prefix}{next(self._nonce_counter) % (1 << 48):012x}'
+
+    def sign(self, body, path, query, method, timestamp, nonce):
+        state = self._secret_state.copy()
+        state.update(body)
+        state.update(f'{path}{query}{method}{timestamp}{nonce}'.encode('UTF-8'))
+        return state.hexdigest()
+
+    def authorization(self, body, method, path, query="", timestamp=None):
+        # body is the request body as bytes, b'' when there is none
+        timestamp = timestamp or str(int(time.time() * 1000))
+        nonce = self.nonce()
+        digest = self.sign(body, path, query, method, timestamp, nonce)
+        return f'ZEPHR-HMAC-SHA256 {self.client_id}:{timestamp}:{nonce}:{digest}'
+
+    def sign_batch(self, requests):
+        # Authorization headers for (body, method, path, query) tuples, all sharing one timestamp
+        timestamp = str(int(time.time() * 1000))
+        return [self.authorization(body, method, path, query, timestamp) for body, method, path, query in requests]
+
+
+_signers = {}
+_signers_lock = threading.Lock()
+
+
+def signer_for(client_id, client_secret):
+    # Signers are kept for the life of the process, so every request with the same credentials reuses one
+    key = (client_id, client_secret)
+    signer = _signers.get(key)
+    if signer is None:
+        with _signers_lock:
+            signer = _signers.setdefault(key, ZephrSigner(client_id, client_secret))
+    return signer
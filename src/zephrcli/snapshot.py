@@ -0,0 +1,182 @@
+import json
+import os
+import threading
+import time
+from contextlib import closing
+
+from .bulk import run_bounded
+from .client import admin_request
+from .paging import iter_admin_results, result_list
+
+SNAPSHOT_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'zephr')
+
+# Tenant-wide collections, each stored as (id, name, body)
+CATALOGS = {'accounts': '/v3/accounts', 'companies': '/v3/companies', 'products': '/v3/products',
+            'bundles': '/v3/bundles'}
+# Catalogs listed a page at a time, like users
+PAGED_CATALOGS = ('accounts', 'companies')
+
+# Per-user collections, fetched only for users that are new or changed since the last snapshot. Sessions cost a
+# request per user and are only crawled when asked for.
+USER_RESOURCES = {'grants': '/v3/users/{}/grants', 'user_accounts': '/v3/users/{}/accounts',
+                  'sessions': '/v4/users/{}/sessions'}
+
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)',
+    'CREATE TABLE IF NOT EXISTS users (user_id TEXT PRIMARY KEY, email TEXT, updated_at TEXT, body TEXT)',
+    'CREATE TABLE IF NOT EXISTS user_foreign_keys (user_id TEXT, key TEXT, value TEXT, PRIMARY KEY (user_id, key))',
+    'CREATE INDEX IF NOT EXISTS user_foreign_keys_value ON user_foreign_keys (key, value)',
+    'CREATE TABLE IF NOT EXISTS grants (grant_id TEXT PRIMARY KEY, user_id TEXT, product_id TEXT, '
+    'entitlement_id TEXT, entitlement_type TEXT, start_time TEXT, end_time TEXT, body TEXT)',
+    'CREATE INDEX IF NOT EXISTS grants_user ON grants (user_id)',
+    'CREATE INDEX IF NOT EXISTS grants_product ON grants (product_id)',
+    'CREATE TABLE IF NOT EXISTS user_accounts (user_id TEXT, account_id TEXT, PRIMARY KEY (user_id, account_id))',
+    'CREATE INDEX IF NOT EXISTS user_accounts_account ON user_accounts (account_id)',
+    'CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, user_id TEXT, created_at TEXT, body TEXT)',
+    'CREATE INDEX IF NOT EXISTS sessions_user ON sessions (user_id)',
+] + [f'CREATE TABLE IF NOT EXISTS {name} (id TEXT PRIMARY KEY, name TEXT, body TEXT)' for name in CATALOGS]
+
+
+def snapshot_path(tenant_id):
+    return os.path.join(SNAPSHOT_DIR, f'snapshot-{tenant_id}.sqlite3')
+
+
+def connect(path):
+    # sqlite3 is imported on first use rather than at startup
+    import sqlite3
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=10)
+    for statement in SCHEMA:
+        conn.execute(statement)
+    return conn
+
+
+def take_snapshot(path, tenant_id, client_id, client_secret, workers=8, full=False, sessions=False):
+    # Crawls the tenant into the SQLite file at `path`. Users are always listed, but their grants and accounts, and
+    # with sessions=True their sessions, are only re-fetched when the user is new or its updated_at differs from the
+    # stored one. Everything is written in one transaction, so a failed crawl leaves the previous snapshot untouched.
+    started = time.monotonic()
+    stats = {'users': 0, 'changed': 0, 'deleted': 0, 'requests': 0}
+    stats_lock = threading.Lock()
+
+    def count_request():
+        # Called from the worker and page prefetch threads
+        with stats_lock:
+            stats['requests'] += 1
+
+    def get(path):
+        count_request()
+        r = admin_request("GET", tenant_id, client_id, client_secret, path)
+        # Zephr answers 404 rather than an empty list for users without grants or accounts
+        if r.status_code == 404:
+            return []
+        if not r.ok:
+            raise RuntimeError(f'Failed to fetch {path}: {r.status_code} {r.text}')
+        return result_list(r.json())
+
+    def get_catalog(name):
+        if name in PAGED_CATALOGS:
+            return list(iter_admin_results(tenant_id, client_id, client_secret, CATALOGS[name], prefetch=2,
+                                           on_request=count_request))
+        return get(CATALOGS[name])
+
+    with closing(connect(path)) as conn, conn:
+        for name, items, error in run_bounded(get_catalog, CATALOGS, workers):
+            if error is not None:
+                raise error
+            conn.execute(f'DELETE FROM {name}')
+            conn.executemany(f'INSERT OR REPLACE INTO {name} VALUES (?, ?, ?)',
+                             [(_item_id(item), _item_name(item), json.dumps(item)) for item in items])
+
+        listed, changed, deleted = sync_users(conn, tenant_id, client_id, client_secret, prefetch=workers, full=full,
+                                              on_request=count_request)
+
+        def fetch_user_resource(fetch_item):
+            user_id, name = fetch_item
+            return get(USER_RESOURCES[name].format(user_id))
+
+        names = [name for name in USER_RESOURCES if sessions or name != 'sessions']
+        fetches = ((user_id, name) for user_id in changed for name in names)
+        for (user_id, name), items, error in run_bounded(fetch_user_resource, fetches, workers):
+            if error is not None:
+                raise error
+            _write_user_resource(conn, name, user_id, items)
+
+        conn.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', ('tenant_id', tenant_id))
+        conn.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', ('snapshot_at', str(int(time.time()))))
+
+    stats.update(users=len(listed), changed=len(changed), deleted=len(deleted),
+                 elapsed=time.monotonic() - started)
+    return stats
+
+
+def sync_users(conn, tenant_id, client_id, client_secret, prefetch=4, full=False, record_updated=True,
+               on_request=None):
+    # Lists every user, rewriting those that are new or changed and deleting those that have gone.
+    # Returns (listed, changed, deleted). Callers that do not go on to fetch each changed user's grants, accounts
+    # and sessions pass record_updated=False, which leaves updated_at empty so the next snapshot refreshes them.
+    stored = dict(conn.execute('SELECT user_id, updated_at FROM users'))
+    listed = set()
+    changed = []
+    for user in iter_admin_results(tenant_id, client_id, client_secret, '/v3/users', prefetch=prefetch,
+                                   on_request=on_request):
+        user_id = user['user_id']
+        listed.add(user_id)
+        updated_at = _text(user.get('updated_at'))
+        if full or user_id not in stored or updated_at is None or updated_at != stored[user_id]:
+            changed.append(user_id)
+            write_user(conn, user, updated_at if record_updated else None)
+
+    deleted = set(stored) - listed
+    for user_id in deleted:
+        conn.execute('DELETE FROM users WHERE user_id = ?', (user_id,))
+        conn.execute('DELETE FROM user_foreign_keys WHERE user_id = ?', (user_id,))
+        for name in USER_RESOURCES:
+            conn.execute(f'DELETE FROM {name} WHERE user_id = ?', (user_id,))
+    return listed, changed, deleted
+
+
+def query(path, sql, params=()):
+    # Yields each result row as a dict keyed by column name
+    with closing(connect(path)) as conn:
+        cursor = conn.execute(sql, params)
+        columns = [c[0] for c in cursor.description or []]
+        for row in cursor:
+            yield dict(zip(columns, row))
+
+
+def write_user(conn, user, updated_at=None):
+    user_id = user['user_id']
+    conn.execute('INSERT OR REPLACE INTO users VALUES (?, ?, ?, ?)',
+                 (user_id, user.get('identifiers', {}).get('email_address'), updated_at, json.dumps(user)))
+    conn.execute('DELETE FROM user_foreign_keys WHERE user_id = ?', (user_id,))
+    conn.executemany('INSERT INTO user_foreign_keys VALUES (?, ?, ?)',
+                     [(user_id, key, _text(value)) for key, value in (user.get('foreign_keys') or {}).items()])
+
+
+def _write_user_resource(conn, name, user_id, items):
+    conn.execute(f'DELETE FROM {name} WHERE user_id = ?', (user_id,))
+    if name == 'grants':
+        conn.executemany('INSERT OR REPLACE INTO grants VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                         [(g.get('grant_id'), user_id, g.get('product_id'), g.get('entitlement_id'),
+                           g.get('entitlement_type'), _text(g.get('startTime')), _text(g.get('endTime')),
+                           json.dumps(g)) for g in items])
+    elif name == 'user_accounts':
+        conn.executemany('INSERT OR REPLACE INTO user_accounts VALUES (?, ?)',
+                         [(user_id, a.get('account_id') or a.get('id')) for a in items])
+    else:
+        conn.executemany('INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?)',
+                         [(s.get('session_id') or s.get('id'), user_id, _text(s.get('created_at')), json.dumps(s))
+                          for s in items])
+
+
+def _item_id(item):
+    return item.get('id') or item.get('account_id') or item.get('company_id') or item.get('product_id')
+
+
+def _item_name(item):
+    return item.get('name') or item.get('label') or item.get('title')
+
+
+def _text(value):
+    return None if value is None else str(value)
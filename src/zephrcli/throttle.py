@@ -0,0 +1,236 @@
+import random
+import threading
+import time
+
+import click
+
+from . import trace
+
+# Throttling settings, overridden by the global options on the root cli group
+_settings = {
+    # Requests per second allowed to each host; None for no fixed limit
+    'max_rate': None,
+    # Retries of a request answered with 429, or 503 for idempotent methods
+    'retries': 5,
+    # Monotonic time after which no new requests or retries are started; None for no deadline
+    'deadline_at': None,
+}
+
+THROTTLE_STATUSES = {429, 503}
+_IDEMPOTENT = {'GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'}
+
+# Concurrency per host starts here and is halved on each throttled response, then grows by one per window
+MAX_CONCURRENCY = 1024
+# Backoff without Retry-After: a random delay of up to BACKOFF_BASE * 2^attempt seconds, capped
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30.0
+
+
+class DeadlineExceeded(click.ClickException):
+    # A ClickException, so a single command that runs out of time exits with a one-line error; bulk commands catch
+    # it to count the rows left unsent
+    pass
+
+
+def configure(max_rate=None, retries=None, deadline=None):
+    # Called once per command run: the deadline and throttled counts start again, while the AIMD state of each
+    # host carries over to later commands in the same process
+    if max_rate is not None:
+        _settings['max_rate'] = max_rate or None
+        _schedulers.clear()
+    if retries is not None:
+        _settings['retries'] = retries
+    _settings['deadline_at'] = None if deadline is None else time.monotonic() + deadline
+    for scheduler in list(_schedulers.values()):
+        scheduler.throttled = 0
+
+
+class RateLimiter:
+    # Token bucket shared by worker threads: on average at most `rate` acquisitions per second, in bursts of up to
+    # `burst`. A rate of 0 means unlimited.
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        # Takes a token now and returns how long the caller must wait before using it
+        if not self.rate:
+            return 0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= 1
+            return -self._tokens / self.rate if self._tokens < 0 else 0
+
+    def acquire(self):
+        delay = self.reserve()
+        if delay:
+            time.sleep(delay)
+
+
+class HostScheduler:
+    # Admission control for one host: a token bucket for the fixed rate, and an AIMD limit on requests in flight
+    # that halves when the host answers 429/503 and creeps back up as requests succeed. Retry-After pauses every
+    # request to the host, not just the one that was throttled.
+
+    def __init__(self, max_rate=None):
+        self.limiter = RateLimiter(max_rate) if max_rate else None
+        self.limit = float(MAX_CONCURRENCY)
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.throttled = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def _wait(self):
+        # 0 when a request may start now, else seconds to wait, or None to wait for a request to finish
+        now = time.monotonic()
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.in_flight >= int(self.limit):
+            return None
+        return 0
+
+    def acquire(self):
+        with self._cond:
+            while True:
+                wait = self._wait()
+                if wait == 0:
+                    self.in_flight += 1
+                    break
+                self._cond.wait(wait)
+        if self.limiter is not None:
+            self.limiter.acquire()
+
+    async def acquire_async(self):
+        import asyncio
+        while True:
+            with self._cond:
+                wait = self._wait()
+                if wait == 0:
+                    self.in_flight += 1
+                    break
+            await asyncio.sleep(0.005 if wait is None else wait)
+        delay = self.limiter.reserve() if self.limiter is not None else 0
+        if delay:
+            await asyncio.sleep(delay)
+
+    def release(self, status=None, retry_after=None):
+        with self._cond:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if status in THROTTLE_STATUSES:
+                self.throttled += 1
+                # Responses to requests sent before the last decrease would otherwise halve the limit again
+                if now - self._last_decrease > 0.1:
+                    self.limit = max(1.0, min(self.limit, self.in_flight + 1) / 2)
+                    self._last_decrease = now
+                if retry_after:
+                    self.paused_until = max(self.paused_until, now + retry_after)
+            elif status is not None:
+                self.limit = min(float(MAX_CONCURRENCY), self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def scheduler_for(base_url):
+    with _schedulers_lock:
+        scheduler = _schedulers.get(base_url)
+        if scheduler is None:
+            scheduler = _schedulers[base_url] = HostScheduler(_settings['max_rate'])
+        return scheduler
+
+
+def throttled_count():
+    return sum(scheduler.throttled for scheduler in list(_schedulers.values()))
+
+
+def call(base_url, method, send_once):
+    # Sends with send_once() under the host's scheduler, retrying throttled responses until the retries run out,
+    # when the last response is returned. A throttled request that cannot be retried before the deadline raises
+    # DeadlineExceeded, as the host did not process it.
+    scheduler = scheduler_for(base_url)
+    attempt = 0
+    while True:
+        _check_deadline()
+        scheduler.acquire()
+        try:
+            r = send_once()
+        except BaseException:
+            scheduler.release()
+            raise
+        scheduler.release(r.status_code, _retry_after(r) if r.status_code in THROTTLE_STATUSES else None)
+        delay = _retry_delay(r, method, attempt)
+        if delay is None:
+            return r
+        time.sleep(delay)
+        trace.add('retries', 1)
+        attempt += 1
+
+
+async def call_async(base_url, method, send_once):
+    # As call(), for a coroutine function send_once on the asyncio engine
+    import asyncio
+    scheduler = scheduler_for(base_url)
+    attempt = 0
+    while True:
+        _check_deadline()
+        await scheduler.acquire_async()
+        try:
+            r = await send_once()
+        except BaseException:
+            scheduler.release()
+            raise
+        scheduler.release(r.status_code, _retry_after(r) if r.status_code in THROTTLE_STATUSES else None)
+        delay = _retry_delay(r, method, attempt)
+        if delay is None:
+            return r
+        await asyncio.sleep(delay)
+        trace.add('retries', 1)
+        attempt += 1
+
+
+def _check_deadline():
+    if _settings['deadline_at'] is not None and time.monotonic() >= _settings['deadline_at']:
+        raise DeadlineExceeded('Deadline reached before the request was sent')
+
+
+def _retry_delay(r, method, attempt):
+    # Seconds to wait before retrying, or None when the response should be returned as it is
+    if r.status_code not in THROTTLE_STATUSES or (r.status_code == 503 and method not in _IDEMPOTENT):
+        return None
+    if attempt >= _settings['retries']:
+        return None
+    delay = _retry_after(r)
+    if delay is None:
+        delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+    else:
+        # Spread out the requests that were all told to come back at the same time
+        delay += random.uniform(0, BACKOFF_BASE)
+    if _settings['deadline_at'] is not None and time.monotonic() + delay >= _settings['deadline_at']:
+        raise DeadlineExceeded('Deadline reached while the host was throttling requests')
+    return delay
+
+
+def _retry_after(r):
+    # Retry-After is either a number of seconds or an HTTP date
+    value = r.headers.get('Retry-After') or r.headers.get('retry-after')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    from email.utils import parsedate_to_datetime
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,408 @@
+import contextvars
+import os
+import re
+import threading
+import time
+
+import click
+
+# Tracing settings, overridden by the global options on the root cli group
+_settings = {
+    'enabled': False,
+    # Print a summary table of the calls on stderr when the command finishes
+    'table': False,
+    # OTLP JSON file of spans, one export request per line as written by the OpenTelemetry collector file exporter
+    'spans_path': None,
+    # Prometheus textfile, as read by the node exporter textfile collector
+    'metrics_path': None,
+}
+
+# Time of each call is split into these phases. wait is the time not spent on the wire: queueing for the throttle
+# scheduler and backing off between retries.
+PHASES = ['dns', 'connect', 'tls', 'server', 'download', 'wait']
+# Spans are written in batches, so a long bulk run keeps a bounded number in memory
+SPAN_BATCH = 512
+QUANTILES = [0.5, 0.9, 0.99]
+
+# The call being traced on the current thread or asyncio task; the transports add their timings to it
+_current = contextvars.ContextVar('zephr_trace', default=None)
+_state = {'trace_id': None, 'endpoints': {}, 'spans': [], 'spans_started': False}
+_lock = threading.Lock()
+_classes = {}
+
+# Path segments that identify a record rather than a resource, e.g. user IDs and email addresses, so that calls
+# are grouped by endpoint: /v3/users/1a2b... -> /v3/users/{id}
+_ID_SEGMENT = re.compile(r'^(?!v\d+$).*\d|@|^.{33,}$')
+
+
+def configure(table=False, spans_path=None, metrics_path=None):
+    # Called once per command run, so what is reported covers that command only
+    enabled = bool(table or spans_path or metrics_path)
+    if enabled != _settings['enabled']:
+        # Sessions are only built with the traced connection pools while tracing, e.g. in a shell where one
+        # command is run with --trace and the next without
+        from .client import close_sessions
+        close_sessions()
+    _settings.update(enabled=enabled, table=table, spans_path=spans_path, metrics_path=metrics_path)
+    with _lock:
+        _state.update(trace_id=os.urandom(16).hex(), endpoints={}, spans=[], spans_started=False)
+
+
+def enabled():
+    return _settings['enabled']
+
+
+def add(phase, seconds):
+    # Adds to a phase, or another counter such as retries, of the call being traced, if any
+    record = _current.get()
+    if record is not None:
+        record[phase] += seconds
+
+
+def endpoint(path):
+    return '/'.join('{id}' if _ID_SEGMENT.search(segment) else segment for segment in path.split('/'))
+
+
+def call(method, url, send):
+    # Returns send(), recording the call when tracing is enabled
+    if not _settings['enabled']:
+        return send()
+    record = _begin(method, url)
+    token = _current.set(record)
+    try:
+        r = send()
+    except BaseException as e:
+        _end(record, error=e)
+        raise
+    finally:
+        _current.reset(token)
+    _end(record, r)
+    return r
+
+
+async def call_async(method, url, send):
+    # As call(), for a coroutine function send on the asyncio engine
+    if not _settings['enabled']:
+        return await send()
+    record = _begin(method, url)
+    token = _current.set(record)
+    try:
+        r = await send()
+    except BaseException as e:
+        _end(record, error=e)
+        raise
+    finally:
+        _current.reset(token)
+    _end(record, r)
+    return r
+
+
+def send(request, *args, **kwargs):
+    # Calls a requests request function for one attempt of the traced call. requests measures the time to the
+    # response headers; what is left of it after connecting is server time, and the rest is the download along
+    # with requests' own handling of the response.
+    record = _current.get()
+    if record is None:
+        return request(*args, **kwargs)
+    connecting = record['dns'] + record['connect'] + record['tls']
+    started = time.perf_counter()
+    r = request(*args, **kwargs)
+    total = time.perf_counter() - started
+    headers = min(total, r.elapsed.total_seconds())
+    record['server'] += max(0.0, headers - (record['dns'] + record['connect'] + record['tls'] - connecting))
+    record['download'] += total - headers
+    retries = getattr(r.raw, 'retries', None)
+    record['retries'] += len(retries.history) if retries is not None else 0
+    return r
+
+
+def _begin(method, url):
+    from urllib.parse import urlsplit
+    parts = urlsplit(url)
+    record = dict.fromkeys(PHASES, 0.0)
+    record.update(method=method, host=parts.netloc, path=parts.path or '/', start_ns=time.time_ns(),
+                  started=time.perf_counter(), retries=0, status=None, bytes=0, error=None)
+    return record
+
+
+def _end(record, r=None, error=None):
+    record['total'] = time.perf_counter() - record['started']
+    record['wait'] = max(0.0, record['total'] - sum(record[phase] for phase in PHASES))
+    if r is not None:
+        record['status'] = r.status_code
+        record['bytes'] = len(r.content)
+    if error is not None:
+        record['error'] = type(error).__name__
+    with _lock:
+        _aggregate(record)
+        if _settings['spans_path']:
+            _state['spans'].append(_span(record))
+            if len(_state['spans']) >= SPAN_BATCH:
+                _write_spans()
+
+
+def _aggregate(record):
+    # Called with _lock held
+    key = (record['method'], record['host'], endpoint(record['path']))
+    stats = _state['endpoints'].get(key)
+    if stats is None:
+        from .loadgen import LatencyHistogram
+        stats = _state['endpoints'][key] = dict.fromkeys(PHASES, 0.0)
+        stats.update(calls=0, errors=0, cancelled=0, bytes=0, retries=0, statuses={}, histogram=LatencyHistogram())
+    stats['calls'] += 1
+    # Hedge requests that lost the race are cancelled rather than failed
+    if record['error'] == 'CancelledError':
+        stats['cancelled'] += 1
+    elif record['error'] is not None or record['status'] >= 400:
+        stats['errors'] += 1
+    status = str(record['status'] or record['error'])
+    stats['statuses'][status] = stats['statuses'].get(status, 0) + 1
+    stats['bytes'] += record['bytes']
+    stats['retries'] += record['retries']
+    for phase in PHASES:
+        stats[phase] += record[phase]
+    stats['histogram'].record(record['total'] * 1_000_000)
+
+
+def _span(record):
+    duration_ns = int(record['total'] * 1_000_000_000)
+    attributes = {'http.request.method': record['method'], 'server.address': record['host'],
+                  'url.path': record['path'], 'http.response.body.size': record['bytes'],
+                  'zephr.retries': record['retries']}
+    attributes.update({f'zephr.{phase}_ms': round(record[phase] * 1000, 3) for phase in PHASES})
+    if record['status'] is not None:
+        attributes['http.response.status_code'] = record['status']
+    if record['error'] is not None:
+        attributes['error.type'] = record['error']
+    failed = record['error'] not in (None, 'CancelledError') or (record['status'] or 0) >= 400
+    return {
+        'traceId': _state['trace_id'],
+        'spanId': os.urandom(8).hex(),
+        'name': f"{record['method']} {endpoint(record['path'])}",
+        # SPAN_KIND_CLIENT
+        'kind': 3,
+        'startTimeUnixNano': str(record['start_ns']),
+        'endTimeUnixNano': str(record['start_ns'] + duration_ns),
+        'attributes': [{'key': key, 'value': _any_value(value)} for key, value in attributes.items()],
+        # STATUS_CODE_ERROR, or STATUS_CODE_UNSET
+        'status': {'code': 2 if failed else 0},
+    }
+
+
+def _any_value(value):
+    if isinstance(value, str):
+        return {'stringValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    return {'doubleValue': value}
+
+
+def _write_spans():
+    # Called with _lock held. The file is replaced by the first batch of a run and appended to after that.
+    if not _state['spans']:
+        return
+    import importlib.resources
+    from .output import dumps
+    resource = [{'key': 'service.name', 'value': {'stringValue': 'zephrcli'}},
+                {'key': 'service.version',
+                 'value': {'stringValue': importlib.resources.read_text(__package__, 'VERSION').strip()}}]
+    export = {'resourceSpans': [{'resource': {'attributes': resource},
+                                 'scopeSpans': [{'scope': {'name': 'zephrcli'}, 'spans': _state['spans']}]}]}
+    with open(_settings['spans_path'], 'ab' if _state['spans_started'] else 'wb') as f:
+        f.write(dumps(export) + b'\n')
+    _state.update(spans=[], spans_started=True)
+
+
+def report():
+    # Called when the command finishes: writes what was asked for with --trace, --trace-spans and --trace-metrics
+    if not _settings['enabled']:
+        return
+    with _lock:
+        if _settings['spans_path']:
+            _write_spans()
+        endpoints = dict(_state['endpoints'])
+    if _settings['metrics_path']:
+        _write_metrics(endpoints)
+    if _settings['table'] and endpoints:
+        click.echo(format_table(endpoints), err=True)
+
+
+def format_table(endpoints):
+    # Phase columns are means per call
+    hosts = {host for _, host, _ in endpoints}
+    columns = ['call', 'calls', 'errors', 'p50 ms', 'p99 ms'] + [f'{phase} ms' for phase in PHASES] + \
+              ['KB', 'retries']
+    rows = []
+    for (method, host, path), stats in sorted(endpoints.items()):
+        name = f'{method} {host}{path}' if len(hosts) > 1 else f'{method} {path}'
+        calls, histogram = stats['calls'], stats['histogram']
+        errors = f"{stats['errors']}" + (f" (+{stats['cancelled']} cancelled)" if stats['cancelled'] else '')
+        rows.append([name, str(calls), errors, f'{histogram.value_at_percentile(50) / 1000:.1f}',
+                     f'{histogram.value_at_percentile(99) / 1000:.1f}'] +
+                    [f'{stats[phase] / calls * 1000:.1f}' for phase in PHASES] +
+                    [f"{stats['bytes'] / 1024:.1f}", str(stats['retries'])])
+    widths = [max([len(c)] + [len(r[i]) for r in rows]) for i, c in enumerate(columns)]
+    lines = [columns, ['-' * w for w in widths]] + rows
+    return '\n'.join('  '.join(v.ljust(w) if i == 0 else v.rjust(w) for i, (v, w) in enumerate(zip(line, widths)))
+                     for line in lines)
+
+
+def _write_metrics(endpoints):
+    lines = ['# HELP zephr_http_requests_total HTTP calls made by the zephr CLI, after retries',
+             '# TYPE zephr_http_requests_total counter']
+    for (method, host, path), stats in sorted(endpoints.items()):
+        for status, count in sorted(stats['statuses'].items()):
+            lines.append(f'zephr_http_requests_total{_labels(method, host, path, status=status)} {count}')
+    lines += ['# HELP zephr_http_request_duration_seconds Duration of HTTP calls, including retries',
+              '# TYPE zephr_http_request_duration_seconds summary']
+    for (method, host, path), stats in sorted(endpoints.items()):
+        histogram = stats['histogram']
+        for quantile in QUANTILES:
+            value = histogram.value_at_percentile(quantile * 100) / 1_000_000
+            lines.append(f'zephr_http_request_duration_seconds{_labels(method, host, path, quantile=quantile)} '
+                         f'{value}')
+        lines.append(f'zephr_http_request_duration_seconds_sum{_labels(method, host, path)} '
+                     f'{histogram.total / 1_000_000}')
+        lines.append(f'zephr_http_request_duration_seconds_count{_labels(method, host, path)} {histogram.count}')
+    lines += ['# HELP zephr_http_request_phase_seconds_total Time spent in each phase of HTTP calls',
+              '# TYPE zephr_http_request_phase_seconds_total counter']
+    for (method, host, path), stats in sorted(endpoints.items()):
+        for phase in PHASES:
+            lines.append(f'zephr_http_request_phase_seconds_total{_labels(method, host, path, phase=phase)} '
+                         f'{stats[phase]}')
+    for name, key, help_text in (('zephr_http_response_bytes_total', 'bytes', 'Bytes of response bodies'),
+                                 ('zephr_http_retries_total', 'retries', 'Retries of HTTP calls')):
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+        for (method, host, path), stats in sorted(endpoints.items()):
+            lines.append(f'{name}{_labels(method, host, path)} {stats[key]}')
+    lines += ['# HELP zephr_last_run_timestamp_seconds When the command that wrote this file finished',
+              '# TYPE zephr_last_run_timestamp_seconds gauge', f'zephr_last_run_timestamp_seconds {time.time()}']
+    # Written to a temporary file and renamed, so the collector never reads half a file
+    tmp_path = f"{_settings['metrics_path']}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.replace(tmp_path, _settings['metrics_path'])
+
+
+def _labels(method, host, path, **extra):
+    labels = {'method': method, 'host': host, 'endpoint': path}
+    labels.update({name: str(value) for name, value in extra.items()})
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+def connection_pool_classes():
+    # urllib3 connection pools for the requests transport whose new connections add their DNS, connect and TLS
+    # time to the call being traced. Sessions only use them while tracing is enabled.
+    if 'pools' not in _classes:
+        from urllib3.connection import HTTPConnection, HTTPSConnection
+        from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+        class TracedHTTPConnection(HTTPConnection):
+            def _new_conn(self):
+                return _new_conn(self, super()._new_conn)
+
+        class TracedHTTPSConnection(HTTPSConnection):
+            def _new_conn(self):
+                return _new_conn(self, super()._new_conn)
+
+            def connect(self):
+                # The TLS handshake is whatever connect() takes beyond opening the socket
+                record = _current.get()
+                if record is None:
+                    return super().connect()
+                opening = record['dns'] + record['connect']
+                started = time.perf_counter()
+                try:
+                    super().connect()
+                finally:
+                    opened = record['dns'] + record['connect'] - opening
+                    record['tls'] += max(0.0, time.perf_counter() - started - opened)
+
+        class TracedHTTPConnectionPool(HTTPConnectionPool):
+            ConnectionCls = TracedHTTPConnection
+
+        class TracedHTTPSConnectionPool(HTTPSConnectionPool):
+            ConnectionCls = TracedHTTPSConnection
+
+        _classes['pools'] = {'http': TracedHTTPConnectionPool, 'https': TracedHTTPSConnectionPool}
+    return _classes['pools']
+
+
+def _new_conn(connection, new_conn):
+    # urllib3 resolves and connects in one call, so when tracing the host is resolved here first and each address
+    # is then connected to in turn, as urllib3 would, from the connection's public settings
+    record = _current.get()
+    if record is None:
+        return new_conn()
+    import socket
+    from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+    from urllib3.util.connection import allowed_gai_family, create_connection
+    started = time.perf_counter()
+    try:
+        addresses = list(dict.fromkeys(info[4][0] for info in socket.getaddrinfo(
+            connection.host.strip('[]'), connection.port, allowed_gai_family(), socket.SOCK_STREAM)))
+    except OSError:
+        addresses = []
+    resolved = time.perf_counter()
+    record['dns'] += resolved - started
+    if not addresses:
+        # Left for urllib3 to fail on and report as usual
+        return new_conn()
+    try:
+        for i, address in enumerate(addresses):
+            try:
+                return create_connection((address, connection.port), connection.timeout,
+                                         source_address=connection.source_address,
+                                         socket_options=connection.socket_options)
+            except socket.timeout as e:
+                if i == len(addresses) - 1:
+                    raise ConnectTimeoutError(connection, f'Connection to {connection.host} timed out. '
+                                                          f'(connect timeout={connection.timeout})') from e
+            except OSError as e:
+                if i == len(addresses) - 1:
+                    raise NewConnectionError(connection, f'Failed to establish a new connection: {e}') from e
+    finally:
+        record['connect'] += time.perf_counter() - resolved
+
+
+async def open_connection(host, port, tls):
+    # asyncio counterpart of the traced urllib3 connections, for the asyncio engine's pool
+    import asyncio
+    import socket
+    record = _current.get()
+    if record is None:
+        return await asyncio.open_connection(host, port, ssl=tls)
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    infos = await loop.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    resolved = time.perf_counter()
+    record['dns'] += resolved - started
+    # StreamWriter.start_tls (Python 3.11) lets the handshake be timed apart from the connect; before that it is
+    # part of the connect time
+    tls_apart = tls and hasattr(asyncio.StreamWriter, 'start_tls')
+    tls_options = {'ssl': True, 'server_hostname': host} if tls and not tls_apart else {}
+    addresses = list(dict.fromkeys(info[4][0] for info in infos))
+    try:
+        for i, address in enumerate(addresses):
+            try:
+                reader, writer = await asyncio.open_connection(address, port, **tls_options)
+                break
+            except OSError:
+                if i == len(addresses) - 1:
+                    raise
+    finally:
+        connected = time.perf_counter()
+        record['connect'] += connected - resolved
+    if tls_apart:
+        if 'ssl_context' not in _classes:
+            import ssl
+            _classes['ssl_context'] = ssl.create_default_context()
+        try:
+            await writer.start_tls(_classes['ssl_context'], server_hostname=host)
+        except BaseException:
+            writer.close()
+            raise
+        finally:
+            record['tls'] += time.perf_counter() - connected
+    return reader, writer
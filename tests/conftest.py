@@ -0,0 +1,39 @@
+import pytest
+from click.testing import CliRunner
+
+from zephrcli import client, response_cache
+from zephrcli.commands import shell
+from zephrcli.mock_server import MOCK_CLIENT_ID, MOCK_CLIENT_SECRET, MockZephrServer
+from zephrcli.zephr import cli
+
+CREDENTIALS = ['--tenant-id', 'mock', '--client-id', MOCK_CLIENT_ID, '--client-secret', MOCK_CLIENT_SECRET]
+
+
+@pytest.fixture(autouse=True)
+def isolated(tmp_path, monkeypatch):
+    # Each test runs in its own directory, with its own client settings and sessions, and keeps the response cache
+    # and shell history out of the home directory
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(client, '_settings', dict(client._settings))
+    monkeypatch.setattr(response_cache, '_settings', dict(response_cache._settings,
+                                                          path=str(tmp_path / 'responses.sqlite3')))
+    monkeypatch.setattr(shell, 'HISTORY_FILE', str(tmp_path / 'history'))
+    yield
+    client.close_sessions()
+
+
+@pytest.fixture
+def server():
+    server = MockZephrServer().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def zephr(server):
+    # Runs the CLI against the mock server, returning the click Result
+    def invoke(*args, input=None, env=None, url=None):
+        url = url or server.url
+        return CliRunner(env=env).invoke(cli, ['--admin-url', url, '--public-url', url, '--console-url', url,
+                                               '--no-cache', *args], input=input)
+    return invoke
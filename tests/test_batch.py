@@ -0,0 +1,46 @@
+import json
+
+from zephrcli.mock_server import MOCK_CLIENT_ID, MOCK_CLIENT_SECRET
+
+
+def write_operations(path, operations):
+    with open(path, 'w') as f:
+        f.write(''.join(json.dumps(operation) + '\n' for operation in operations))
+
+
+def results(result):
+    return [json.loads(line) for line in result.stdout.splitlines()]
+
+
+def test_credentials_injected_only_where_taken(zephr):
+    # Public commands take a tenant but no client key, so only the tenant of batch is passed to them
+    write_operations('ops.ndjson', [
+        {'command': 'public list-rules', 'options': {'site_name': 'www', 'rule_type': 'json'}},
+        {'command': 'admin list-users'},
+    ])
+    env = {'CLIENT_ID': MOCK_CLIENT_ID, 'CLIENT_SECRET': MOCK_CLIENT_SECRET}
+    result = zephr('batch', '--tenant-id', 'mock', 'ops.ndjson', env=env)
+    assert result.exit_code == 0, result.output
+    assert [(r['command'], r['ok']) for r in results(result)] == [('public list-rules', True),
+                                                                  ('admin list-users', True)]
+
+
+def test_operation_credentials_not_overridden(zephr):
+    write_operations('ops.ndjson', [
+        {'command': 'admin list-users', 'options': {'tenant_id': 'mock', 'client_id': 'other',
+                                                    'client_secret': 'wrong'}},
+        {'command': 'admin list-users'},
+    ])
+    result = zephr('batch', '--tenant-id', 'mock', '--client-id', MOCK_CLIENT_ID, '--client-secret',
+                   MOCK_CLIENT_SECRET, 'ops.ndjson')
+    assert result.exit_code == 0, result.output
+    first, second = results(result)
+    assert not first.get('ok')
+    assert second['ok']
+
+
+def test_operation_without_credentials_is_an_error(zephr):
+    write_operations('ops.ndjson', [{'command': 'admin list-users'}])
+    result = zephr('batch', 'ops.ndjson', env={'TENANT_ID': None, 'CLIENT_ID': None, 'CLIENT_SECRET': None})
+    assert result.exit_code == 0, result.output
+    assert 'Needs credentials' in results(result)[0]['error']
@@ -0,0 +1,29 @@
+from conftest import CREDENTIALS
+
+# Nothing listens here, so a replay that reached the network would fail
+UNREACHABLE = 'http://127.0.0.1:9'
+
+
+def test_record_and_replay(zephr, server):
+    for i in range(3):
+        server.store.add_user({'identifiers': {'email_address': f'u{i}@example.com'}})
+    commands = ('admin list-users', 'admin create-user -e new@example.com', 'admin list-users')
+    lines = ''.join(f'{command} {" ".join(CREDENTIALS)}\n' for command in commands)
+
+    recorded = zephr('--record', 'session.cassette', 'shell', input=lines)
+    assert recorded.exit_code == 0, recorded.output
+    assert 'new@example.com' in recorded.stdout
+    assert len(server.store.users) == 4
+
+    replayed = zephr('--replay', 'session.cassette', 'shell', input=lines, url=UNREACHABLE)
+    assert replayed.exit_code == 0, replayed.output
+    assert replayed.stdout == recorded.stdout
+    assert len(server.store.users) == 4
+
+
+def test_replay_of_other_file_is_a_usage_error(zephr):
+    with open('notes.txt', 'w') as f:
+        f.write('not a cassette\n')
+    result = zephr('--replay', 'notes.txt', 'admin', 'list-users', *CREDENTIALS, url=UNREACHABLE)
+    assert result.exit_code == 2
+    assert '--replay' in result.stderr
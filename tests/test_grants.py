@@ -0,0 +1,46 @@
+from zephrcli.commands.grants import plan_grants
+from conftest import CREDENTIALS
+
+
+def test_plan_matches_times_in_any_format():
+    desired = {'u1': [{'entitlement_type': 'bundle', 'product_id': 'p1', 'entitlement_id': 'e1',
+                       'startTime': '2024-01-01 00:00:00', 'endTime': '2024-12-31T23:59:59+00:00'},
+                      {'entitlement_type': 'bundle', 'product_id': 'p2', 'entitlement_id': 'e2'}]}
+    current = {'u1': [{'grant_id': 'g1', 'entitlement_type': 'bundle', 'product_id': 'p1', 'entitlement_id': 'e1',
+                       'startTime': '2024-01-01T00:00:00.000Z', 'endTime': 1735689599000},
+                      {'grant_id': 'g2', 'entitlement_type': 'bundle', 'product_id': 'p2', 'entitlement_id': 'e2',
+                       'startTime': '2023-06-01T12:00:00.000Z'},
+                      {'grant_id': 'g3', 'entitlement_type': 'bundle', 'product_id': 'p3', 'entitlement_id': 'e3'}]}
+    actions, undeletable = plan_grants(desired, current)
+    assert actions == [{'action': 'delete', 'user_id': 'u1', 'grant_id': 'g3'}]
+    assert undeletable == []
+
+
+def test_reconcile_is_idempotent(zephr, server):
+    users = [server.store.add_user({'identifiers': {'email_address': f'u{i}@example.com'}})['user_id']
+             for i in range(3)]
+    server.store.grants[users[0]] = {'old': {'grant_id': 'old', 'user_id': users[0], 'entitlement_type': 'bundle',
+                                             'product_id': 'gone', 'entitlement_id': 'gone'}}
+    with open('grants.csv', 'w') as f:
+        f.write('user_id,product_id,entitlement_id,start_time,end_time\n')
+        for user_id in users:
+            f.write(f'{user_id},gold,e1,2024-01-01 00:00:00,2030-12-31 23:59:59\n')
+            f.write(f'{user_id},silver,e2,,\n')
+
+    first = zephr('admin', 'reconcile-grants', *CREDENTIALS, 'grants.csv')
+    assert first.exit_code == 0, first.output
+    assert '6 creates, 1 deletes' in first.stderr
+    assert sorted(g['product_id'] for g in server.store.grants[users[0]].values()) == ['gold', 'silver']
+
+    # The server answers the times in its own format, which still matches the file
+    second = zephr('admin', 'reconcile-grants', *CREDENTIALS, 'grants.csv')
+    assert second.exit_code == 0, second.output
+    assert '0 creates, 0 deletes, 0 write calls' in second.stderr
+
+
+def test_reconcile_names_a_missing_column(zephr):
+    with open('grants.csv', 'w') as f:
+        f.write('user_id,product_id\nu1,gold\n')
+    result = zephr('admin', 'reconcile-grants', *CREDENTIALS, 'grants.csv')
+    assert result.exit_code == 2
+    assert 'Row 1 has no entitlement_id' in result.stderr
@@ -0,0 +1,51 @@
+import json
+import os
+
+from zephrcli.bulk import Checkpoint
+from conftest import CREDENTIALS
+
+
+def emails(server):
+    return sorted(user['identifiers']['email_address'] for user in server.store.users.values())
+
+
+def test_checkpoint_waits_for_earlier_rows(tmp_path):
+    progress = Checkpoint(str(tmp_path / 'progress'))
+    for row_number in (2, 3, 1, 5):
+        progress.mark(row_number)
+    assert progress.done_through == 3
+    progress.save()
+    assert Checkpoint(progress.path).done_through == 3
+
+
+def test_import_resumes_after_checkpoint(zephr, server):
+    with open('users.csv', 'w') as f:
+        f.write('email\n' + ''.join(f'u{i}@example.com\n' for i in range(1, 7)))
+    # As left by a run interrupted after its first four rows
+    with open('users.csv.checkpoint', 'w') as f:
+        json.dump({'done_through': 4}, f)
+
+    result = zephr('admin', 'import-users', *CREDENTIALS, 'users.csv')
+    assert result.exit_code == 0, result.output
+    assert 'Resuming after row 4' in result.stderr
+    assert emails(server) == ['u5@example.com', 'u6@example.com']
+    assert not os.path.exists('users.csv.checkpoint')
+
+    # A finished import starts again from the first row
+    result = zephr('admin', 'import-users', *CREDENTIALS, 'users.csv')
+    assert result.exit_code == 0, result.output
+    assert emails(server) == [f'u{i}@example.com' for i in range(1, 7)]
+
+
+def test_failed_rows_are_rejected_not_retried(zephr, server):
+    server.store.add_user({'identifiers': {'email_address': 'u2@example.com'}})
+    with open('users.csv', 'w') as f:
+        f.write('email\nu1@example.com\nu2@example.com\nu3@example.com\n')
+
+    result = zephr('admin', 'import-users', *CREDENTIALS, 'users.csv')
+    assert result.exit_code == 0, result.output
+    assert '1 failed rows are not retried' in result.stderr
+    with open('users.csv.rejects.ndjson') as f:
+        assert [json.loads(line)['row'] for line in f] == [2]
+    with open('users.csv.checkpoint') as f:
+        assert json.load(f) == {'done_through': 3}
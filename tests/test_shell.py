@@ -0,0 +1,30 @@
+from zephrcli import client
+from conftest import CREDENTIALS
+
+
+def test_shell_keeps_grown_pool(zephr, server, monkeypatch):
+    for i in range(3):
+        server.store.add_user({'identifiers': {'email_address': f'u{i}@example.com'}})
+    sessions = []
+    get_session = client.get_session
+
+    def recording_get_session(base_url):
+        session = get_session(base_url)
+        sessions.append(session)
+        return session
+    monkeypatch.setattr(client, 'get_session', recording_get_session)
+
+    credentials = ' '.join(CREDENTIALS)
+    commands = [f'admin list-users {credentials}',
+                f'admin purge-sessions --all-users --dry-run -w 20 {credentials}',
+                f'admin list-users {credentials}',
+                f'admin list-users {credentials}']
+    result = zephr('shell', input=''.join(f'{command}\n' for command in commands))
+    assert result.exit_code == 0, result.output
+    assert 'Error' not in result.stderr
+
+    # Growing the pool to 20 workers replaces the first session once; the commands after it, which configure the
+    # default pool size of 10 again, keep using the grown one
+    assert len({id(session) for session in sessions}) == 2
+    assert sessions[-1] is client.get_session(server.url)
+    assert client.setting('pool_size') == 20